@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.cache_stampede
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Recomputations of an expiring memoized value under concurrent calls, with Flask-Cache's
+    ``memoize`` and with :class:`~jema.cache.JemaCache`'s.
+
+    ``--threads`` threads call a function taking ``--compute`` seconds, memoized for
+    ``--timeout`` seconds, for ``--duration`` seconds. Flask-Cache's memoize recomputes it in
+    every thread calling it while it's expired.
+
+    Usage::
+
+        python benchmarks/cache_stampede.py --threads 50 --duration 10
+'''
+
+# Import python libs
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import Flask libs & plugins
+from flask import Flask
+from flask_cache import Cache
+
+# Import JeMa libs
+from jema.cache import JemaCache, hit_ratios
+from jema.metrics import cache_requests
+
+
+def run(cache_class, options):
+    app = Flask(__name__)
+    app.config.update(
+        CACHE_TYPE='simple',
+        CACHE_LOCAL_TIMEOUT=options.local_timeout
+    )
+    cache = cache_class(app)
+    cache_requests.reset()
+    computations = []
+
+    @cache.memoize(options.timeout)
+    def expensive():
+        computations.append(time.time())
+        time.sleep(options.compute)
+        return 'value'
+
+    latencies = []
+    deadline = time.time() + options.duration
+
+    def caller():
+        with app.app_context():
+            while time.time() < deadline:
+                start = time.time()
+                expensive()
+                latencies.append(time.time() - start)
+                time.sleep(options.interval)
+
+    threads = [threading.Thread(target=caller) for _ in range(options.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    result = {
+        'calls': len(latencies),
+        'computations': len(computations),
+        'expiries': int(options.duration / options.timeout),
+        'latency_ms': dict(
+            ('p{0}'.format(pct), round(latencies[int(len(latencies) * pct / 100.0)] * 1000, 2))
+            for pct in (50, 99)
+        ),
+        'max_latency_ms': round(latencies[-1] * 1000, 2)
+    }
+    if cache_class is JemaCache:
+        result['hit_ratios'] = dict(
+            (tier, round(ratio, 4) if ratio is not None else None)
+            for tier, ratio in hit_ratios().items()
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memoized value recomputations under load')
+    parser.add_argument('-t', '--threads', type=int, default=50)
+    parser.add_argument('-d', '--duration', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=2,
+                        help='Seconds the value is memoized for')
+    parser.add_argument('--compute', type=float, default=0.2,
+                        help='Seconds computing the value takes')
+    parser.add_argument('--interval', type=float, default=0.01,
+                        help='Seconds each thread waits between calls')
+    parser.add_argument('--local-timeout', type=float, default=1,
+                        help='Seconds values are kept in the per-process tier')
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    options = parser.parse_args()
+
+    results = {}
+    for name, cache_class in (('flask-cache', Cache), ('two-tier', JemaCache)):
+        results[name] = run(cache_class, options)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for name, result in sorted(results.items()):
+        print('{0:<12} {1:>7} calls  {2:>4} computations ({3} expiries)  p50 {4[p50]:>8.2f}ms  '
+              'p99 {4[p99]:>8.2f}ms  max {5:>8.2f}ms'.format(
+                  name, result['calls'], result['computations'], result['expiries'],
+                  result['latency_ms'], result['max_latency_ms']))
+        if 'hit_ratios' in result:
+            print('{0:<12} hit ratios: {1}'.format('', ', '.join(
+                '{0} {1}'.format(tier, ratio) for tier, ratio in sorted(result['hit_ratios'].items())
+            )))
+
+
+if __name__ == '__main__':
+    main()
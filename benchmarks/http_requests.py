@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.http_requests
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The end-to-end HTTP benchmark suite of :mod:`jema.benchmark`, with a bare configuration
+    instead of ``jemaappconfig``'s. ``jema benchmark`` runs it with the configured application.
+
+    Usage::
+
+        python benchmarks/http_requests.py --accounts 10000 --groups 200 -o results.json
+'''
+
+# Import python libs
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import JeMa libs
+from jema.application import app
+from jema.benchmark import OPTIONS, run_benchmark, write_results
+from jema.signals import configuration_loaded
+
+
+class BenchmarkConfig(object):
+    SECRET_KEY = 'benchmark'
+    CACHE_TYPE = 'simple'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end HTTP benchmark suite')
+    for args, kwargs in OPTIONS:
+        parser.add_argument(*args, **kwargs)
+    options = parser.parse_args()
+
+    app.config.from_object(BenchmarkConfig)
+    configuration_loaded.send(app)
+    write_results(run_benchmark(app, vars(options)), options.output)
+
+
+if __name__ == '__main__':
+    main()
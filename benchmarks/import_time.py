@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.import_time
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Startup import time of the CLI, ``jema.scripts``, and of the web and worker processes,
+    ``jema.application``.
+
+    Each module is imported in a fresh interpreter, the best of ``--repeat`` runs is kept. On
+    interpreters supporting ``-X importtime`` the costliest imports are listed too. Exits with
+    a non-zero status when a module takes longer than ``--target-ms`` to import or when it
+    eagerly imports one of the heavy integrations which should only be loaded on first use, so
+    it can run in CI::
+
+        python benchmarks/import_time.py --target-ms 300
+'''
+
+# Import python libs
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Integrations which must only be imported on first use
+LAZY_MODULES = ('github', 'jenkinsapi', 'wtforms_alchemy', 'pygments', 'sass', 'flask_sass')
+
+PROBE = '''
+import sys, time, json
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'modules': sorted(set(name.split('.')[0] for name in sys.modules))
+}}))
+'''
+
+
+def supports_importtime():
+    return sys.version_info >= (3, 7)
+
+
+def parse_importtime(output, top):
+    '''
+    Parse the ``-X importtime`` output into the ``top`` costliest ``(cumulative_ms, module)``.
+    '''
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = [part.strip() for part in line.split(':', 1)[1].split('|')]
+        entries.append((int(cumulative_us) / 1000.0, name))
+    entries.sort(reverse=True)
+    return entries[:top]
+
+
+def measure(module, repeat, top):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+    # Don't let stale or missing bytecode skew the numbers, the first run compiles it
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    best = None
+    for _ in range(repeat + 1):
+        cmd = [sys.executable]
+        if supports_importtime():
+            cmd.extend(['-X', 'importtime'])
+        cmd.extend(['-c', PROBE.format(module=module)])
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=ROOT_DIR
+        )
+        stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError('Failed to import {0}:\n{1}'.format(
+                module, stderr.decode('utf-8', 'replace')
+            ))
+        result = json.loads(stdout.decode('utf-8').strip().splitlines()[-1])
+        if supports_importtime():
+            result['top'] = parse_importtime(stderr.decode('utf-8', 'replace'), top)
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup import time')
+    parser.add_argument('modules', nargs='*', default=['jema.scripts', 'jema.application'])
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--target-ms', type=float, default=300,
+                        help='Fail when importing a module takes longer than this')
+    parser.add_argument('--top', type=int, default=15,
+                        help='How many of the costliest imports to list, needs -X importtime')
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    options = parser.parse_args()
+
+    results = {}
+    failed = False
+    for module in options.modules:
+        result = measure(module, options.repeat, options.top)
+        eager = sorted(set(result.pop('modules')).intersection(LAZY_MODULES))
+        result.update({
+            'milliseconds': result.pop('seconds') * 1000,
+            'eager_lazy_modules': eager,
+        })
+        result['passed'] = result['milliseconds'] <= options.target_ms and not eager
+        failed = failed or not result['passed']
+        results[module] = result
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for module in options.modules:
+            result = results[module]
+            print('{0:<20} {1:>8.1f}ms  {2}'.format(
+                module, result['milliseconds'], 'OK' if result['passed'] else 'FAILED'
+            ))
+            if result['eager_lazy_modules']:
+                print('    Eagerly imports: {0}'.format(', '.join(result['eager_lazy_modules'])))
+            for cumulative, name in result.get('top', ()):
+                print('    {0:>8.1f}ms  {1}'.format(cumulative, name))
+        print('Target: {0:.0f}ms'.format(options.target_ms))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
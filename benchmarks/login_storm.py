@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.login_storm
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    A storm of ``--users`` distinct users signing in at once, ``--concurrency`` at a time,
+    end to end against :mod:`jema.fakegithub`.
+
+    Each sign-in follows the browser's path: ``account.signin``, the fake GitHub's authorize
+    page, over HTTP, and ``account.signin/callback``, which exchanges the code and, for new
+    accounts, fetches the user from the fake GitHub's API. The storm runs twice, first with
+    new accounts and then with returning ones.
+
+    Usage::
+
+        python benchmarks/login_storm.py --users 5000 --concurrency 50 --latency 0.1
+'''
+
+# Import python libs
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import httplib
+import tempfile
+import argparse
+import threading
+from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import JeMa libs
+from jema.application import app, db
+from jema.benchmark import peak_rss_kb, percentile
+from jema.fakegithub import make_fake_github_server
+from jema.signals import configuration_loaded
+
+
+class BenchmarkConfig(object):
+    SECRET_KEY = 'benchmark'
+    CACHE_TYPE = 'simple'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    GITHUB_CLIENT_ID = 'benchmark'
+    GITHUB_CLIENT_SECRET = 'benchmark'
+
+
+def configure(database_uri, github_url):
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = database_uri
+    BenchmarkConfig.GITHUB_BASE_URL = BenchmarkConfig.GITHUB_API_URL = github_url
+    app.config.from_object(BenchmarkConfig)
+    configuration_loaded.send(app)
+    with app.app_context():
+        db.create_all()
+
+
+def sign_in(number):
+    '''
+    Sign ``user-<number>`` in, returning how long it took and whether it succeeded.
+    '''
+    client = app.test_client()
+    start = time.time()
+    try:
+        response = client.get('/account/signin')
+        if response.status_code != 302:
+            return time.time() - start, False
+        authorize = urlparse(response.headers['Location'])
+        conn = httplib.HTTPConnection(authorize.netloc, timeout=60)
+        conn.request('GET', '{0}?{1}&login=user-{2}'.format(
+            authorize.path, authorize.query, number
+        ))
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        if response.status != 302:
+            return time.time() - start, False
+        callback = urlparse(response.getheader('Location'))
+        response = client.get('{0}?{1}'.format(callback.path, callback.query))
+        elapsed = time.time() - start
+    except (IOError, httplib.HTTPException):
+        return time.time() - start, False
+    with client.session_transaction() as session:
+        return elapsed, response.status_code == 302 and 'identity.id' in session
+
+
+def storm(users, concurrency):
+    pool = ThreadPool(concurrency)
+    start = time.time()
+    results = pool.map(sign_in, range(1, users + 1))
+    elapsed = time.time() - start
+    pool.close()
+
+    latencies = sorted(latency for (latency, ok) in results)
+    return {
+        'sign_ins': users,
+        'errors': len([ok for (latency, ok) in results if not ok]),
+        'seconds': round(elapsed, 3),
+        'sign_ins_per_second': round(users / elapsed, 1),
+        'latency_ms': dict(
+            ('p{0}'.format(pct), round(percentile(latencies, pct) * 1000, 1))
+            for pct in (50, 95, 99)
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end sign-in storm')
+    parser.add_argument('-u', '--users', type=int, default=2000)
+    parser.add_argument('-c', '--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds each fake GitHub answer takes')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to how many more seconds each fake GitHub answer takes')
+    parser.add_argument('--database-uri', default=None,
+                        help='A dedicated, empty, database. Defaults to a temporary SQLite one')
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    options = parser.parse_args()
+
+    github = make_fake_github_server(
+        users=options.users, latency=options.latency, jitter=options.jitter
+    )
+    thread = threading.Thread(target=github.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        configure(
+            options.database_uri or 'sqlite:///{0}'.format(os.path.join(tempdir, 'jema.db')),
+            'http://127.0.0.1:{0}'.format(github.server_port)
+        )
+        results = {}
+        for phase in ('new', 'returning'):
+            results[phase] = storm(options.users, options.concurrency)
+            results[phase]['github_requests'] = dict(github.get_app().requests)
+            github.get_app().requests.clear()
+        results['peak_rss_kb'] = peak_rss_kb()
+    finally:
+        github.shutdown()
+        shutil.rmtree(tempdir)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('{0} users, {1} concurrent, fake GitHub answering in {2}s'.format(
+        options.users, options.concurrency, options.latency
+    ))
+    for phase in ('new', 'returning'):
+        result = results[phase]
+        print('{0:<10} {1:>8.1f} sign-ins/s  p50 {2[p50]:>8.1f}ms  p95 {2[p95]:>8.1f}ms  '
+              'p99 {2[p99]:>8.1f}ms  {3} errors'.format(
+                  phase, result['sign_ins_per_second'], result['latency_ms'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.lookup_indexes
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Hot lookups latency before and after the ``7c3e5a2d1f08`` lookup indexes migration.
+
+    A synthetic SQLite database is built with the migrations, populated with accounts, groups
+    and memberships, some of them duplicated, and the statements issued by
+    ``AccountQuery.get``, ``GroupQuery.get`` and the identity loading are timed before and
+    after upgrading to the lookup indexes revision.
+
+    Usage::
+
+        python benchmarks/lookup_indexes.py --accounts 1000000 --groups 10000
+'''
+
+# Import python libs
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+from imp import load_source
+
+# Import 3rd-party libs
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations', 'versions'
+)
+REVISIONS = (
+    '20140106181445_230f2e9a95c3_initial_layout.py',
+    '20261019101512_4b1f0d7c9a21_sessions.py',
+)
+LOOKUP_INDEXES_REVISION = '20261019143027_7c3e5a2d1f08_lookup_indexes.py'
+
+LOOKUPS = (
+    ('account by login',
+     'SELECT * FROM accounts WHERE accounts.login = :login LIMIT 1'),
+    ('group by name',
+     'SELECT * FROM groups WHERE groups.name = :group_name LIMIT 1'),
+    ('account groups',
+     'SELECT groups.* FROM groups, group_accounts '
+     'WHERE :account_id = group_accounts.account_id AND groups.id = group_accounts.group_id'),
+    ('group privileges',
+     'SELECT privileges.* FROM privileges, group_privileges '
+     'WHERE :group_id = group_privileges.group_id '
+     'AND privileges.id = group_privileges.privilege_id'),
+    ('account privileges',
+     'SELECT privileges.* FROM privileges, account_privileges '
+     'WHERE :account_id = account_privileges.account_id '
+     'AND privileges.id = account_privileges.privilege_id'),
+)
+
+
+def run_revision(connection, filename, direction='upgrade'):
+    module = load_source(
+        'revision_{0}'.format(filename.split('_')[1]), os.path.join(MIGRATIONS_DIR, filename)
+    )
+    with Operations.context(MigrationContext.configure(connection)):
+        getattr(module, direction)()
+
+
+def chunked(rows, size=10000):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def populate(connection, accounts, groups, duplicates):
+    # The initial layout already inserted the 6 built-in groups
+    first_group = 7
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    with connection.begin():
+        for chunk in chunked(
+                {'id': idx, 'login': 'user{0}'.format(idx), 'name': 'User {0}'.format(idx),
+                 'last_login': now, 'register_date': now}
+                for idx in range(1, accounts + 1)):
+            connection.execute(
+                sa.text('INSERT INTO accounts (id, login, name, last_login, register_date) '
+                        'VALUES (:id, :login, :name, :last_login, :register_date)'),
+                chunk
+            )
+        for chunk in chunked(
+                {'id': idx, 'name': 'group{0}'.format(idx)}
+                for idx in range(first_group, first_group + groups)):
+            connection.execute(sa.text('INSERT INTO groups (id, name) VALUES (:id, :name)'), chunk)
+
+        def memberships():
+            for idx in range(1, accounts + 1):
+                # Everyone is registered and belongs to some other group
+                yield {'group_id': 6, 'account_id': idx}
+                yield {'group_id': first_group + idx % groups, 'account_id': idx}
+                if random.random() < duplicates:
+                    yield {'group_id': 6, 'account_id': idx}
+
+        for chunk in chunked(memberships()):
+            connection.execute(
+                sa.text('INSERT INTO group_accounts (group_id, account_id) '
+                        'VALUES (:group_id, :account_id)'),
+                chunk
+            )
+        for chunk in chunked(
+                {'account_id': idx, 'privilege_id': 1 + idx % 5}
+                for idx in range(1, accounts + 1, 100)):
+            connection.execute(
+                sa.text('INSERT INTO account_privileges (account_id, privilege_id) '
+                        'VALUES (:account_id, :privilege_id)'),
+                chunk
+            )
+
+
+def measure(connection, accounts, groups, iterations):
+    results = {}
+    for name, statement in LOOKUPS:
+        statement = sa.text(statement)
+        timings = []
+        for _ in range(iterations):
+            account_id = random.randint(1, accounts)
+            params = {
+                'login': 'user{0}'.format(account_id),
+                'account_id': account_id,
+                'group_name': 'group{0}'.format(random.randint(7, 6 + groups)),
+                'group_id': random.randint(1, 6 + groups)
+            }
+            start = time.time()
+            connection.execute(statement, params).fetchall()
+            timings.append(time.time() - start)
+        timings.sort()
+        results[name] = {
+            'p50_ms': timings[len(timings) // 2] * 1000,
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Hot lookups latency before and after the lookup indexes migration'
+    )
+    parser.add_argument('--accounts', type=int, default=1000000)
+    parser.add_argument('--groups', type=int, default=10000)
+    parser.add_argument('--duplicates', type=float, default=0.01,
+                        help='The fraction of accounts with a duplicated group membership')
+    parser.add_argument('-n', '--iterations', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    options = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        engine = sa.create_engine('sqlite:///{0}'.format(os.path.join(tempdir, 'jema.db')))
+        connection = engine.connect()
+        for filename in REVISIONS:
+            run_revision(connection, filename)
+
+        start = time.time()
+        populate(connection, options.accounts, options.groups, options.duplicates)
+        sys.stderr.write('Populated the database in {0:.1f}s\n'.format(time.time() - start))
+
+        results = {'before': measure(connection, options.accounts, options.groups,
+                                     options.iterations)}
+        start = time.time()
+        run_revision(connection, LOOKUP_INDEXES_REVISION)
+        results['migration_seconds'] = time.time() - start
+        results['after'] = measure(connection, options.accounts, options.groups,
+                                   options.iterations)
+        connection.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('{0:<20} {1:>12} {2:>12} {3:>12} {4:>12}'.format(
+        'lookup', 'before p50', 'before p95', 'after p50', 'after p95'
+    ))
+    for name, _ in LOOKUPS:
+        before, after = results['before'][name], results['after'][name]
+        print('{0:<20} {1:>10.3f}ms {2:>10.3f}ms {3:>10.3f}ms {4:>10.3f}ms'.format(
+            name, before['p50_ms'], before['p95_ms'], after['p50_ms'], after['p95_ms']
+        ))
+    print('Migration took {0:.1f}s'.format(results['migration_seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.permissions
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    How resolving an identity scales with the groups of its account and the privileges of each
+    group.
+
+    For each combination of ``--groups`` and ``--privileges-per-group``, an in-memory SQLite
+    database is seeded with an account belonging to that many groups, some of their privileges
+    being the built-in ones, and the identity loading, ``save_request_identity`` and
+    ``Identity.can`` with each of the built-in permissions are timed, counting the SQL
+    statements they issue.
+
+    With ``--check``, the results are compared to the committed baseline, failing when a time
+    exceeds it by more than ``--margin`` or when more statements than the baseline are issued.
+    The baseline's times are first scaled by how much slower, or faster, a fixed calibration
+    workload ran, still, refresh the baseline with ``--update-baseline`` on the machine the
+    checks run on.
+
+    Usage::
+
+        python benchmarks/permissions.py --groups 1,10,100,500 --check
+'''
+
+# Import python libs
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Import 3rd-party libs
+from flask_principal import Identity, identity_loaded
+
+# Import JeMa libs
+from jema.application import app, db
+from jema.benchmark import StatementCounter, seed
+from jema.permissions import (administrator_permission, anonymous_permission,
+                              authenticated_permission, committer_permission,
+                              contributor_permission, manager_permission, pusher_permission,
+                              save_request_identity)
+from jema.signals import configuration_loaded, sql_statement_executed
+
+BASELINE = os.path.join(ROOT_DIR, 'benchmarks', 'baselines', 'permissions.json')
+PERMISSIONS = (
+    administrator_permission,
+    manager_permission,
+    pusher_permission,
+    contributor_permission,
+    committer_permission,
+    anonymous_permission,
+    authenticated_permission,
+)
+# ``Identity.can`` calls are timed in batches of this many
+CAN_BATCH = 1000
+# Privileges besides the ones the groups are granted, to sample the groups' from
+EXTRA_PRIVILEGES = 20
+
+
+class BenchmarkConfig(object):
+    SECRET_KEY = 'benchmark'
+    CACHE_TYPE = 'simple'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # In memory, disk writes would make the timings vary from run to run
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def calibrate(iterations=5):
+    '''
+    How long a fixed, pure python, workload takes, to tell a slower machine, or a busier one,
+    from a slower identity resolution.
+    '''
+    timings = []
+    for _ in range(iterations):
+        start = time.time()
+        needs = set()
+        for idx in range(20000):
+            needs.add(('role', 'privilege-{0}'.format(idx % 500)))
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def measure(groups, privileges_per_group, iterations):
+    calibration = calibrate()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(1, groups, privileges_per_group + EXTRA_PRIVILEGES, groups_per_account=groups,
+             privileges_per_group=privileges_per_group, rng=random.Random(0))
+        db.session.remove()
+
+    counter = StatementCounter()
+    timings = {'identity_loaded': [], 'save_request_identity': [], 'identity_can': []}
+    statements = {'identity_loaded': 0, 'save_request_identity': 0}
+    sql_statement_executed.connect(counter)
+    try:
+        with app.test_request_context():
+            for _ in range(iterations):
+                # Every request starts with an empty session
+                db.session.remove()
+                identity = Identity(1, 'dbm')
+
+                counter.count = 0
+                start = time.time()
+                identity_loaded.send(app, identity=identity)
+                timings['identity_loaded'].append(time.time() - start)
+                statements['identity_loaded'] = max(statements['identity_loaded'], counter.count)
+
+                counter.count = 0
+                start = time.time()
+                save_request_identity(identity)
+                timings['save_request_identity'].append(time.time() - start)
+                statements['save_request_identity'] = max(
+                    statements['save_request_identity'], counter.count
+                )
+
+            for _ in range(iterations):
+                start = time.time()
+                for _ in range(CAN_BATCH):
+                    for permission in PERMISSIONS:
+                        identity.can(permission)
+                timings['identity_can'].append(
+                    (time.time() - start) / (CAN_BATCH * len(PERMISSIONS))
+                )
+            db.session.remove()
+    finally:
+        sql_statement_executed.disconnect(counter)
+
+    calibration = min(calibration, calibrate())
+    result = {
+        'calibration_ms': round(calibration * 1000, 3),
+        'needs': len(identity.provides),
+        # Like timeit, the fastest batch, the others being slowed down by the rest of the system
+        'identity_can': {'best_us': round(min(timings.pop('identity_can')) * 1000000, 3)}
+    }
+    for name, values in timings.items():
+        result[name] = {
+            'median_ms': round(median(values) * 1000, 3),
+            'statements': statements[name]
+        }
+    return result
+
+
+def check(results, baseline, margin, statements_margin):
+    '''
+    Return the regressions of ``results`` against the ``baseline``, its times scaled by how
+    much slower, or faster, the calibration workload ran.
+    '''
+    cases = [case for case in results if case in baseline]
+    if not cases:
+        return []
+    scale = median([results[case]['calibration_ms'] for case in cases]) / float(
+        median([baseline[case]['calibration_ms'] for case in cases])
+    )
+    failures = []
+    for case in sorted(cases):
+        result, expected = results[case], baseline[case]
+        for name, measured in sorted(result.items()):
+            if not isinstance(measured, dict) or name not in expected:
+                continue
+            for metric, value in sorted(measured.items()):
+                limit = expected[name].get(metric)
+                if limit is None:
+                    continue
+                if metric == 'statements':
+                    allowed = limit * (1 + statements_margin)
+                else:
+                    allowed = limit * scale * (1 + margin)
+                if value > allowed:
+                    failures.append('{0} {1} {2}: {3} > {4} (baseline {5})'.format(
+                        case, name, metric, value, round(allowed, 3), limit
+                    ))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Identity resolution scaling')
+    parser.add_argument('-g', '--groups', default='1,10,50,100,500',
+                        help='Comma separated groups per account. Defaults to 1,10,50,100,500')
+    parser.add_argument('-p', '--privileges-per-group', default='1,5,20',
+                        help='Comma separated privileges per group. Defaults to 1,5,20')
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='Defaults to benchmarks/baselines/permissions.json')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with an error when the baseline is exceeded')
+    parser.add_argument('--margin', type=float, default=1.0,
+                        help='How much slower than the baseline is tolerated, 0.5 being 50%%. '
+                             'Defaults to 1, twice as slow')
+    parser.add_argument('--statements-margin', type=float, default=0,
+                        help='How many more statements than the baseline are tolerated, '
+                             'relatively. Defaults to 0')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Write the results as the new baseline')
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    options = parser.parse_args()
+
+    app.config.from_object(BenchmarkConfig)
+    configuration_loaded.send(app)
+
+    # Warm up, the first identity loaded also configures the mappers and compiles queries
+    measure(1, 1, options.iterations)
+    results = {}
+    for groups in [int(value) for value in options.groups.split(',')]:
+        for privileges in [int(value) for value in options.privileges_per_group.split(',')]:
+            case = 'groups={0},privileges_per_group={1}'.format(groups, privileges)
+            results[case] = measure(groups, privileges, options.iterations)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for case, result in sorted(results.items(), key=lambda item: [
+                int(part.split('=')[1]) for part in item[0].split(',')]):
+            print('{0:<38} {1:>4} needs  loaded {2[median_ms]:>9.3f}ms {2[statements]:>4} '
+                  'statements  saved {3[median_ms]:>9.3f}ms {3[statements]:>4} statements  '
+                  'can {4[best_us]:>7.3f}us'.format(
+                      case, result['needs'], result['identity_loaded'],
+                      result['save_request_identity'], result['identity_can']))
+
+    if options.update_baseline:
+        with open(options.baseline, 'w') as wfh:
+            wfh.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+    if options.check:
+        with open(options.baseline) as rfh:
+            baseline = json.load(rfh)
+        failures = check(results, baseline, options.margin, options.statements_margin)
+        if failures:
+            print('Exceeded the baseline by more than the margin:', file=sys.stderr)
+            for failure in failures:
+                print('  {0}'.format(failure), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.slow_upstream
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Concurrent requests waiting on a slow upstream with the sync and the gevent workers.
+
+    A local Jenkins stand-in answers after ``--delay`` seconds. For each worker class, the
+    application is served the way ``jema serve`` does, with a view connecting to the stand-in
+    through :attr:`~jema.database.JenkinsServer.jenkins_instance`, and ``--concurrency`` clients
+    send ``--requests`` requests to it.
+
+    Usage::
+
+        python benchmarks/slow_upstream.py --workers 2 --concurrency 200 --delay 0.5
+'''
+
+# Import python libs
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import httplib
+import tempfile
+import argparse
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+# ----- Jenkins Stand-In ------------------------------------------------------------------------>
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def jenkins_standin(delay):
+    def application(environ, start_response):
+        time.sleep(delay)
+        # JenkinsAPI reads the python API, a python literal
+        body = repr({'jobs': [], 'views': [], 'primaryView': None})
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(body))),
+            ('X-Jenkins', '1.565')
+        ])
+        return [body]
+    return application
+# <---- Jenkins Stand-In -------------------------------------------------------------------------
+
+
+# ----- Server ---------------------------------------------------------------------------------->
+def serve(options):
+    '''
+    Runs in a child process, ``jema serve`` without the command line parsing.
+    '''
+    if options.serve == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    # Import JeMa libs
+    from flask import Blueprint, jsonify
+    from jema.application import app, db
+    from jema.database import JenkinsServer
+    from jema.prefork import reset_after_fork
+    from jema.serving import patch_for_gevent, serve as serve_app
+    from jema.signals import configuration_loaded
+
+    app.config.update(
+        SECRET_KEY='benchmark',
+        CACHE_TYPE='simple',
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_DATABASE_URI='sqlite:///{0}'.format(os.path.join(options.tempdir, 'jema.db')),
+        JENKINS_TIMEOUT=options.delay * 10
+    )
+    configuration_loaded.send(app)
+
+    benchmark = Blueprint('benchmark', __name__)
+
+    @benchmark.route('/_benchmark/jenkins')
+    def jenkins():
+        server = JenkinsServer.query.first()
+        return jsonify(version=server.jenkins_instance.version)
+
+    app.register_blueprint(benchmark)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(JenkinsServer(options.upstream, 'benchmark', 'token'))
+        db.session.commit()
+
+    if options.serve == 'gevent':
+        patch_for_gevent()
+    serve_app(app, {
+        'bind': options.bind,
+        'workers': options.workers,
+        'worker_class': options.serve,
+        'worker_connections': options.concurrency,
+        'timeout': 120,
+        'loglevel': 'warning',
+        'preload_app': True,
+        'post_fork': lambda server, worker: reset_after_fork(app),
+    })
+# <---- Server -----------------------------------------------------------------------------------
+
+
+# ----- Client ---------------------------------------------------------------------------------->
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('The server did not start listening on port {0}'.format(port))
+
+
+def request(port):
+    start = time.time()
+    try:
+        conn = httplib.HTTPConnection('127.0.0.1', port, timeout=300)
+        conn.request('GET', '/_benchmark/jenkins')
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        ok = response.status == 200
+    except (socket.error, httplib.HTTPException):
+        ok = False
+    return time.time() - start, ok
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(round(pct / 100.0 * len(values) + 0.5)) - 1)]
+
+
+def run(worker_class, options, upstream, tempdir):
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), '--serve', worker_class,
+        '--workers', str(options.workers),
+        '--concurrency', str(options.concurrency),
+        '--delay', str(options.delay),
+        '--bind', '127.0.0.1:{0}'.format(port),
+        '--upstream', upstream,
+        '--tempdir', tempdir
+    ])
+    try:
+        wait_for(port)
+        # Warm up every worker
+        ThreadPool(options.workers).map(lambda _: request(port), range(options.workers))
+        pool = ThreadPool(options.concurrency)
+        start = time.time()
+        results = pool.map(lambda _: request(port), range(options.requests))
+        elapsed = time.time() - start
+        pool.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for (latency, ok) in results)
+    return {
+        'requests': options.requests,
+        'errors': len([ok for (latency, ok) in results if not ok]),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(options.requests / elapsed, 1),
+        'latency_ms': dict(
+            ('p{0}'.format(pct), round(percentile(latencies, pct) * 1000, 1))
+            for pct in (50, 95, 99)
+        )
+    }
+# <---- Client -----------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Concurrent requests waiting on a slow upstream per worker class'
+    )
+    parser.add_argument('-n', '--requests', type=int, default=400)
+    parser.add_argument('-c', '--concurrency', type=int, default=200)
+    parser.add_argument('-w', '--workers', type=int, default=2)
+    parser.add_argument('-d', '--delay', type=float, default=0.5,
+                        help='How many seconds the stand-in Jenkins takes to answer')
+    parser.add_argument('-k', '--worker-class', dest='worker_classes', action='append',
+                        choices=('sync', 'gevent'),
+                        help='Only benchmark these workers. Defaults to sync and gevent')
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    # The server process' options
+    parser.add_argument('--serve', metavar='WORKER_CLASS', help=argparse.SUPPRESS)
+    parser.add_argument('--bind', help=argparse.SUPPRESS)
+    parser.add_argument('--upstream', help=argparse.SUPPRESS)
+    parser.add_argument('--tempdir', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.serve:
+        serve(options)
+        return
+
+    standin = make_server(
+        '127.0.0.1', 0, jenkins_standin(options.delay),
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler
+    )
+    thread = threading.Thread(target=standin.serve_forever)
+    thread.daemon = True
+    thread.start()
+    upstream = 'http://127.0.0.1:{0}'.format(standin.server_port)
+
+    results = {}
+    try:
+        for worker_class in options.worker_classes or ('sync', 'gevent'):
+            tempdir = tempfile.mkdtemp()
+            try:
+                results[worker_class] = run(worker_class, options, upstream, tempdir)
+            finally:
+                shutil.rmtree(tempdir)
+    finally:
+        standin.shutdown()
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('{0} requests, {1} concurrent, {2} workers, upstream answering in {3}s'.format(
+        options.requests, options.concurrency, options.workers, options.delay
+    ))
+    for worker_class, result in sorted(results.items()):
+        print('{0:<8} {1:>8.1f} req/s  p50 {2[p50]:>8.1f}ms  p95 {2[p95]:>8.1f}ms  '
+              'p99 {2[p99]:>8.1f}ms  {3} errors'.format(
+                  worker_class, result['requests_per_second'], result['latency_ms'],
+                  result['errors']))
+
+
+if __name__ == '__main__':
+    main()
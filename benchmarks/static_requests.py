@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    benchmarks.static_requests
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Static file requests per second with and without the lightweight request fast path.
+
+    Usage::
+
+        python benchmarks/static_requests.py -n 2000
+'''
+
+# Import python libs
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import JeMa libs
+from jema.application import app, db
+from jema.database import Account
+from jema.signals import configuration_loaded
+
+
+class BenchmarkConfig(object):
+    SECRET_KEY = 'benchmark'
+    CACHE_TYPE = 'simple'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+
+def configure(tempdir):
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///{0}'.format(
+        os.path.join(tempdir, 'jema.db')
+    )
+    app.config.from_object(BenchmarkConfig)
+    configuration_loaded.send(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Account(1, 'jema', 'JeMa', 'jema@example.com', 'token', None))
+        db.session.commit()
+
+
+def run(client, url, requests):
+    start = time.time()
+    for _ in range(requests):
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+        response.close()
+    return requests / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Static file requests per second with and without the fast path'
+    )
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('--url', default='/static/favicon.ico')
+    parser.add_argument('--json', action='store_true', help='Output the results as JSON')
+    options = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        configure(tempdir)
+        results = {}
+        for signed_in in (False, True):
+            client = app.test_client()
+            if signed_in:
+                with client.session_transaction() as session:
+                    session['identity.id'] = 1
+                    session['identity.auth_type'] = 'dbm'
+            for enabled in (False, True):
+                app.config['FASTPATH_ENABLED'] = enabled
+                # Warm up
+                run(client, options.url, 50)
+                key = '{0}/{1}'.format(
+                    'signed-in' if signed_in else 'anonymous',
+                    'fastpath' if enabled else 'baseline'
+                )
+                results[key] = run(client, options.url, options.requests)
+    finally:
+        shutil.rmtree(tempdir)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for key in sorted(results):
+        print('{0:<22} {1:>10.1f} req/s'.format(key, results[key]))
+
+
+if __name__ == '__main__':
+    main()
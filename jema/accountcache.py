@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.accountcache
+    ~~~~~~~~~~~~~~~~~
+
+    Second-level cache for the :class:`~jema.database.Account` lookups by id, login and access
+    token.
+
+    A serialized snapshot of the account's columns is stored in the shared Flask-Cache backend
+    under the three keys, together with the account's version. Committing an update or a
+    deletion of an account bumps its version counter, which turns every snapshot of it into a
+    miss, in every process, whichever key it was stored under. Updates touching only
+    ``last_login``, which is written on every identity load, don't invalidate the snapshots,
+    their ``last_login`` may lag behind the database's.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``ACCOUNT_CACHE_ENABLED``
+        Turn the cache on. Defaults to ``False``.
+    ``ACCOUNT_CACHE_MAX_STALENESS``
+        How many seconds a snapshot lives, the upper bound for stale reads when an account is
+        changed behind the ORM's back, ie, by ``jema import``. Defaults to ``60``.
+'''
+
+# Import python libs
+import hashlib
+import logging
+
+# Import 3rd-party libs
+import sqlalchemy
+from sqlalchemy.orm import attributes, make_transient_to_detached
+from sqlalchemy.types import TypeDecorator
+
+# Import Flask libs & plugins
+from flask import current_app
+
+# Import JeMa libs
+from jema.database import db, Account, RoutingSession
+from jema.signals import application_configured
+
+log = logging.getLogger(__name__)
+
+KEY_PREFIX = 'jema:account:'
+_UNKNOWN = object()
+# Columns whose changes don't invalidate the cached snapshots
+VOLATILE_COLUMNS = frozenset(['last_login'])
+
+
+def _overrides(type_, method):
+    '''
+    Whether the column type customizes the conversion of its values, ie, to a locale object.
+    '''
+    return isinstance(type_, TypeDecorator) and \
+        getattr(type(type_), method).__func__ is not getattr(TypeDecorator, method).__func__
+
+
+class AccountCache(object):
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_staleness = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('ACCOUNT_CACHE_ENABLED', False)
+        if not self.enabled:
+            return
+        self.max_staleness = app.config.get('ACCOUNT_CACHE_MAX_STALENESS', self.max_staleness)
+        for target, event_name, listener in (
+                (Account, 'after_update', self.on_account_updated),
+                (Account, 'after_delete', self.on_account_deleted),
+                (RoutingSession, 'after_commit', self.on_commit),
+                (RoutingSession, 'after_rollback', self.on_rollback)):
+            if not sqlalchemy.event.contains(target, event_name, listener):
+                sqlalchemy.event.listen(target, event_name, listener)
+        app.extensions['account_cache'] = self
+
+    # ----- Keys -------------------------------------------------------------------------------->
+    @staticmethod
+    def key_for(kind, value):
+        if kind == 'token':
+            # Don't spread the access tokens around in clear text
+            value = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        return u'{0}{1}:{2}'.format(KEY_PREFIX, kind, value)
+
+    @staticmethod
+    def version_key(account_id):
+        return '{0}version:{1}'.format(KEY_PREFIX, account_id)
+    # <---- Keys ---------------------------------------------------------------------------------
+
+    def current_version(self, backend, account_id):
+        '''
+        Return the account's version, creating its counter when missing.
+
+        Memcached's ``incr`` doesn't create missing keys, a snapshot stored without a counter
+        would carry a ``None`` version which no invalidation could ever change.
+        '''
+        key = self.version_key(account_id)
+        # Never expires, an evicted counter turns the snapshots into misses
+        backend.add(key, 0, timeout=0)
+        return backend.get(key)
+
+    @property
+    def backend(self):
+        # Looked up on every use, other plugins, ie, metrics, wrap the configured backend
+        return list(current_app.extensions['cache'].values())[0]
+
+    # ----- Snapshots --------------------------------------------------------------------------->
+    @staticmethod
+    def serialize(account, version):
+        dialect = db.engine.dialect
+        snapshot = {'_version': version}
+        for column in Account.__table__.columns:
+            value = getattr(account, column.key)
+            if value is not None and _overrides(column.type, 'process_bind_param'):
+                value = column.type.process_bind_param(value, dialect)
+            snapshot[column.key] = value
+        return snapshot
+
+    @staticmethod
+    def restore(session, snapshot):
+        '''
+        Build a clean, detached, account from ``snapshot`` and attach it to ``session`` without
+        querying the database.
+        '''
+        dialect = db.engine.dialect
+        account = Account.__mapper__.class_manager.new_instance()
+        for column in Account.__table__.columns:
+            value = snapshot[column.key]
+            if value is not None and _overrides(column.type, 'process_result_value'):
+                value = column.type.process_result_value(value, dialect)
+            attributes.set_committed_value(account, column.key, value)
+        make_transient_to_detached(account)
+        return session.merge(account, load=False)
+    # <---- Snapshots ----------------------------------------------------------------------------
+
+    def lookup(self, session, kind, value, loader):
+        '''
+        Return the account found under ``kind`` and ``value`` in the cache, or load it with
+        ``loader`` and cache it.
+        '''
+        if value is None:
+            return loader()
+        backend = self.backend
+        key = self.key_for(kind, value)
+        try:
+            snapshot = backend.get(key)
+            if snapshot is not None:
+                if snapshot['_version'] == backend.get(self.version_key(snapshot['id'])):
+                    return self.restore(session, snapshot)
+            # Read the version before loading when possible, so that an update committed while
+            # loading turns this snapshot into a miss
+            version = self.current_version(backend, value) if kind == 'id' else _UNKNOWN
+        except Exception as exc:  # pylint: disable=W0703
+            log.warning('Failed to read the account cache: {0}'.format(exc))
+            return loader()
+        return self.store(loader(), version)
+
+    def store(self, account, version=_UNKNOWN):
+        if account is None or account.id is None:
+            return account
+        backend = self.backend
+        try:
+            if version is _UNKNOWN:
+                version = self.current_version(backend, account.id)
+            snapshot = self.serialize(account, version)
+            mapping = {self.key_for('id', account.id): snapshot}
+            if account.login:
+                mapping[self.key_for('login', account.login)] = snapshot
+            if account.access_token:
+                mapping[self.key_for('token', account.access_token)] = snapshot
+            backend.set_many(mapping, timeout=self.max_staleness)
+        except Exception as exc:  # pylint: disable=W0703
+            log.warning('Failed to write the account cache: {0}'.format(exc))
+        return account
+
+    def invalidate(self, account_id):
+        backend = self.backend
+        try:
+            backend.add(self.version_key(account_id), 0, timeout=0)
+            backend.inc(self.version_key(account_id))
+        except Exception as exc:  # pylint: disable=W0703
+            log.warning('Failed to invalidate the account cache: {0}'.format(exc))
+
+    # ----- Events ------------------------------------------------------------------------------>
+    def on_account_updated(self, mapper, connection, account):
+        state = sqlalchemy.inspect(account)
+        if any(state.attrs[column.key].history.has_changes()
+               for column in mapper.columns if column.key not in VOLATILE_COLUMNS):
+            self.on_account_deleted(mapper, connection, account)
+
+    def on_account_deleted(self, mapper, connection, account):
+        # Other transactions keep reading the previous row until the flushed changes are
+        # committed, only then the snapshots become stale
+        session = sqlalchemy.orm.object_session(account)
+        if session is not None:
+            session.info.setdefault('jema_changed_accounts', set()).add(account.id)
+
+    def on_commit(self, session):
+        for account_id in session.info.pop('jema_changed_accounts', ()):
+            self.invalidate(account_id)
+
+    def on_rollback(self, session):
+        session.info.pop('jema_changed_accounts', None)
+    # <---- Events -------------------------------------------------------------------------------
+
+
+account_cache = AccountCache()
+
+
+@application_configured.connect
+def configure_account_cache(app):
+    account_cache.init_app(app)
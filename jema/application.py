@@ -18,17 +18,14 @@
 # Import python libs
 import os
 import sys
-from traceback import format_exception
+from datetime import datetime
 from urlparse import urlparse, urljoin
 
 # Import Flask libs & plugins
 from flask import (Blueprint, Flask, g, render_template, flash, url_for, session, request,
-                   redirect, request_started, request_finished)
+                   redirect, request_started)
 from flask_babel import Babel, gettext as _
-from flask_cache import Cache
-from flask_script import Command, Option, Manager
 from flask_sqlalchemy import get_debug_queries
-from flask_migrate import Migrate, MigrateCommand
 from flask_menubuilder import MenuBuilder, MenuItemContent
 
 # Import 3rd-party libs
@@ -36,11 +33,21 @@ from jinja2 import Markup
 
 # Import JeMa libs
 from jema.signals import application_configured, configuration_loaded
+from jema.cache import JemaCache
+from jema.assets import assets_manager
+from jema.templating import templates_manager
+from jema.fastpath import FastPathSessionInterface, is_lightweight_request
+from jema.sessions import sessions_manager
+from jema.errors import error_capture
 # pylint: disable=W0401,W0614
 from jema.helpers import *
 from jema.database import *
 from jema.permissions import *
 # pylint: enable=W0401,W0614
+from jema.accountcache import account_cache  # pylint: disable=W0611
+from jema.profiler import configure_profiler  # pylint: disable=W0611
+from jema.queries import query_analytics  # pylint: disable=W0611
+from jema.tasks import task_queue
 
 # ----- Simplify * Imports ---------------------------------------------------------------------->
 __all__ = [
@@ -60,6 +67,7 @@ __all__ = [
     'redirect_back',
     'get_locale',
     'Blueprint',
+    'task_queue',
     'render_template',
     'glyphiconer',
 
@@ -77,12 +85,14 @@ __all__ = [
 # ----- Setup The Flask Application ------------------------------------------------------------->
 # First we instantiate the application object
 app = Flask(__name__)
+app.session_interface = FastPathSessionInterface()
 
 
-def configure_app(config):
+def load_configuration(config=None):
+    '''
+    Load ``jemaappconfig`` into the application's configuration. When it's not importable, it's
+    looked for in the ``config`` directory.
     '''
-Configure App hook
-'''
     try:
         import jemaappconfig # pylint: disable=F0401
         app.config.from_object(jemaappconfig)
@@ -102,45 +112,30 @@ Configure App hook
             print(errmsg)
             sys.exit(1)
 
-    configuration_loaded.send(app)
-    return app
 
+def create_app(config=None, preload=False):
+    '''
+    Configure the application and its plugins, once, and return it.
 
-# Database Migrations Support
-migrate = Migrate(app, db)
+    With ``preload``, everything the workers of a prefork server would otherwise load on their
+    first requests is loaded now, see :mod:`jema.prefork`.
+    '''
+    if not app.extensions.get('jema_configured', False):
+        load_configuration(config)
+        app.extensions['jema_configured'] = True
+        configuration_loaded.send(app)
+    if preload:
+        # Late import, only the web servers preload
+        from jema.prefork import preload_app
+        preload_app(app)
+    return app
 
 
-# Scripts Support
-class Administrator(Command):
+def configure_app(config):
     '''
-Promote account to administrator
+Configure App hook
 '''
-
-    def get_options(self):
-        return [
-            Option('username', help='The username to promote')
-        ]
-
-    def run(self, username):
-        try:
-            account = Account.query.get(username)
-            if not account:
-                print('The account {0!r} does not exist'.format(username))
-                exit(1)
-            group = Group.query.get('Administrator')
-            if group is None:
-                group = Group('Administrator')
-            account.groups.add(group)
-            db.session.commit()
-            print('The {0!r} user is now an administrator'.format(username))
-            exit(0)
-        except:
-            raise
-
-manager = Manager(configure_app)
-manager.add_command('db', MigrateCommand)
-manager.add_command('administrator', Administrator)
-manager.add_option('-c', '--config', dest='config', required=False)
+    return create_app(config)
 
 
 # I18N & L10N Support
@@ -150,7 +145,7 @@ babel = Babel(app)
 menus = MenuBuilder(app)
 
 # Cache Support
-cache = Cache()
+cache = JemaCache()
 
 
 @configuration_loaded.connect
@@ -159,10 +154,8 @@ def on_configuration_loaded(app):
     Once the configuration is loaded hook
     '''
 
-    # Init database
-    db.init_app(app)
-
-    # Init caching
+    # Init caching. The database, like the other plugins, is initialized once the
+    # ``application_configured`` signal is sent, see ``jema.database.configure_sqlalchemy``
     cache.init_app(app)
 
     # If we're debugging...
@@ -188,8 +181,12 @@ def get_locale():
     # otherwise try to guess the language from the user accept
     # header the browser transmits. The best match wins.
 
-    # Which translations do we support?
-    supported = set(['en'] + [str(l) for l in babel.list_translations()])
+    # Which translations do we support? Either the preloaded ones, see jema.prefork, or the ones
+    # found on disk.
+    if 'jema_translations' in app.extensions:
+        supported = set(['en']).union(app.extensions['jema_translations'])
+    else:
+        supported = set(['en'] + [str(l) for l in babel.list_translations()])
     return request.accept_languages.best_match(supported)
 
 
@@ -197,7 +194,7 @@ def get_locale():
 def get_timezone():
     if not hasattr(g.identity, 'account') or g.identity.account is None:
         # No user is logged in, return the app's default timezone
-        return app.config.get('BABEL_DEFAULT_LOCALE', 'UTC')
+        return app.config.get('BABEL_DEFAULT_TIMEZONE', 'UTC')
     # Return the user's preferred timezone
     return g.identity.account.timezone
 # <---- Setup Babel Selectors --------------------------------------------------------------------
@@ -286,10 +283,10 @@ def is_safe_url(target):
     return test_url.scheme in ('http', 'https') and ref_url.netloc == test_url.netloc
 
 
-def get_redirect_target(invalid_targets=()):
+def get_redirect_target(invalid_targets=(), use_session=True):
     check_target = (request.values.get('_redirect_target') or
                     request.args.get('next') or
-                    session.get('_redirect_target', None) or
+                    (use_session and session.get('_redirect_target', None)) or
                     request.environ.get('HTTP_REFERER'))
 
     # if there is no information in either the form data
@@ -330,24 +327,17 @@ def get_redirect_target(invalid_targets=()):
 # ----- Setup Request Decorators ---------------------------------------------------------------->
 @request_started.connect_via(app)
 def on_request_started(app):
-    if request.path.startswith(app.static_url_path):
-        # Nothing else needs to be done here, it's a static URL
+    if is_lightweight_request():
+        # Nothing else needs to be done here, it's a static, health or API URL
         return
 
-    redirect_target = get_redirect_target(session.pop('_redirect_target', ()))
-    if redirect_target is not None:
+    # Only touch the session when the target changes so that it's not saved on every request
+    previous_target = session.get('_redirect_target', None)
+    redirect_target = get_redirect_target(previous_target or (), use_session=False)
+    if redirect_target is None:
+        session.pop('_redirect_target', None)
+    elif redirect_target != previous_target:
         session['_redirect_target'] = redirect_target
-
-
-@request_finished.connect_via(app)
-def on_request_finished(app, response):
-
-    if request.path.startswith(app.static_url_path):
-        return
-
-    if response.status_code == 404:
-        session.pop('not_found', None)
-        app.save_session(session, response)
 # <---- Setup Request Decorators -----------------------------------------------------------------
 
 
@@ -366,16 +356,11 @@ def on_403(error):
 
 @app.errorhandler(404)
 def on_404(error):
-    if request.endpoint and 'static' not in request.endpoint:
-        session['not_found'] = True
     return render_template('404.html'), 404
 
 
 @app.errorhandler(500)
 def on_500(error):
-    from pprint import pprint
-    from StringIO import StringIO
-
     user = 'anonymous'
 
     identity = getattr(g, 'identity', None)
@@ -385,15 +370,14 @@ def on_500(error):
         if account:
             user = account.login
 
-    summary = str(error)
-    longtext = ''.join(format_exception(*sys.exc_info()))
-    request_details = StringIO()
-    pprint(request.__dict__, request_details)
-    request_details.seek(0)
+    # Only the first occurrences of each error, per time window, get the full, and expensive,
+    # request serialization and formatted traceback
+    sample = error_capture.capture(sys.exc_info(), request, user)
 
     return render_template(
-        '500.html', error=error, user=user, summary=summary,
-        longtext=longtext, request_details=request_details.read()
+        '500.html', error=error, user=user, summary=sample['summary'],
+        fingerprint=sample['fingerprint'], longtext=sample.get('traceback'),
+        request_details=sample.get('request_details')
     ), 500
 # <---- Error Handlers ---------------------------------------------------------------------------
 
@@ -407,6 +391,11 @@ def seconds_format_filter(seconds):
         return '{0:.3f}s'.format(seconds * 1.0)
 
 
+@app.template_filter('fromtimestamp')
+def fromtimestamp_filter(timestamp):
+    return datetime.utcfromtimestamp(timestamp)
+
+
 @app.template_filter('mask_access_token')
 def mask_access_token(access_token, visible=3):
     return '{0}{1}{2}'.format(
@@ -458,6 +447,8 @@ def inject_in_context():
 # ----- Setup The Web-Application Views --------------------------------------------------------->
 from jema.views.main import main
 from jema.views.account import account
+from jema.views.admin import admin
+from jema.views.api import api
 #from jema.views.servers import servers
 #from jema.views.builders import builders
 #from jema.views.users import users
@@ -465,6 +456,8 @@ from jema.views.account import account
 
 app.register_blueprint(main)
 app.register_blueprint(account)
+app.register_blueprint(admin)
+app.register_blueprint(api)
 #app.register_blueprint(servers)
 #app.register_blueprint(builders)
 #app.register_blueprint(users)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.assets
+    ~~~~~~~~~~~
+
+    Build-time static assets pipeline.
+
+    ``jema assets build`` compiles the SCSS sources, copies every file found under the static
+    folder into ``ASSETS_BUILD_DIR`` with a content hash in its name, writes pre-compressed
+    ``.gz`` siblings and a manifest mapping the original names to the fingerprinted ones.
+
+    When the manifest is present, ``url_for('static', filename=...)`` resolves through it and
+    the fingerprinted files are served with far-future ``Cache-Control`` headers, picking the
+    pre-compressed copy whenever the browser accepts it.
+'''
+
+# Import python libs
+import os
+import re
+import json
+import gzip
+import shutil
+import hashlib
+import logging
+import mimetypes
+import posixpath
+import subprocess
+
+# Import Flask libs & plugins
+from flask import current_app, request, send_from_directory
+from flask_script import Command, Manager, Option
+
+# Import JeMa libs
+from jema.signals import application_configured
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# One year, the maximum recommended by RFC 2616
+FAR_FUTURE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Files which are worth compressing. Images and web fonts other than SVG/TTF/EOT are already
+# compressed formats.
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.ttf', '.eot', '.ico', '.txt', '.html')
+
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+# ----- Helpers --------------------------------------------------------------------------------->
+def get_build_dir(app):
+    return os.path.join(app.static_folder, app.config.get('ASSETS_BUILD_DIR', 'dist'))
+
+
+def fingerprint(filename, contents):
+    '''
+    Return ``filename`` with the first 12 hex digits of the md5 of ``contents`` inserted before
+    the extension, ie, ``css/jema.css`` becomes ``css/jema.0123456789ab.css``.
+    '''
+    digest = hashlib.md5(contents).hexdigest()[:12]
+    base, ext = posixpath.splitext(filename)
+    return '{0}.{1}{2}'.format(base, digest, ext)
+
+
+def compile_scss(static_folder, sass_bin=None):
+    '''
+    Compile every ``.scss`` file found in ``static_folder`` into its ``.css`` sibling.
+    '''
+    for (dirpath, dirnames, filenames) in os.walk(static_folder):
+        for filename in filenames:
+            if not filename.endswith('.scss') or filename.startswith('_'):
+                continue
+            scss = os.path.join(dirpath, filename)
+            css = scss[:-5] + '.css'
+            log.info('Converting from {0} to {1}'.format(scss, css))
+            if sass_bin is None:
+                try:
+                    # libsass python bindings, no need for the ruby binary
+                    import sass
+                    with open(css, 'w') as wfh:
+                        wfh.write(sass.compile(filename=scss))
+                    continue
+                except ImportError:
+                    sass_bin = 'sass'
+            subprocess.check_call([sass_bin, '--unix-newlines', scss, css])
+
+
+def rewrite_css_urls(css_name, contents, manifest):
+    '''
+    Point ``url(...)`` references inside a stylesheet to the fingerprinted files.
+    '''
+    css_dir = posixpath.dirname(css_name)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(css_dir, path))
+        if target not in manifest:
+            return match.group(0)
+        new_url = posixpath.relpath(manifest[target], css_dir or '.') + suffix
+        return 'url({0}{1}{0})'.format(quote, new_url)
+
+    return CSS_URL_RE.sub(replace, contents)
+
+
+def write_gzipped(path, contents):
+    '''
+    Write a maximum compression ``.gz`` copy of ``contents`` next to ``path`` when that saves
+    space. The gzip header mtime is zeroed so that builds are reproducible.
+    '''
+    gz_path = path + '.gz'
+    with open(gz_path, 'wb') as wfh:
+        gzfile = gzip.GzipFile(filename='', mode='wb', fileobj=wfh, compresslevel=9, mtime=0)
+        gzfile.write(contents)
+        gzfile.close()
+    if os.path.getsize(gz_path) >= len(contents):
+        os.unlink(gz_path)
+        return False
+    return True
+
+
+def build_assets(app, sass_bin=None, compress=True):
+    '''
+    Run the whole pipeline and return the manifest.
+    '''
+    static_folder = app.static_folder
+    build_dir = get_build_dir(app)
+
+    compile_scss(static_folder, sass_bin=sass_bin)
+
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+
+    sources = []
+    for (dirpath, dirnames, filenames) in os.walk(static_folder):
+        if os.path.abspath(dirpath) == os.path.abspath(static_folder):
+            # Never recurse into a previous build
+            dirnames[:] = [name for name in dirnames
+                           if os.path.join(dirpath, name) != build_dir]
+        for filename in filenames:
+            if filename.endswith('.scss'):
+                continue
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            sources.append((name, path))
+
+    # Stylesheets are processed last so that their ``url(...)`` references can be rewritten
+    # to the already fingerprinted fonts and images.
+    sources.sort(key=lambda source: (source[0].endswith('.css'), source[0]))
+
+    build_prefix = posixpath.relpath(
+        build_dir.replace(os.sep, '/'), static_folder.replace(os.sep, '/')
+    )
+    manifest = {}
+    for name, path in sources:
+        with open(path, 'rb') as rfh:
+            contents = rfh.read()
+        if name.endswith('.css'):
+            contents = rewrite_css_urls(name, contents, manifest)
+        hashed_name = fingerprint(name, contents)
+        destination = os.path.join(build_dir, *hashed_name.split('/'))
+        if not os.path.isdir(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        with open(destination, 'wb') as wfh:
+            wfh.write(contents)
+        if compress and name.endswith(COMPRESSIBLE_EXTENSIONS):
+            write_gzipped(destination, contents)
+        manifest[name] = hashed_name
+
+    with open(os.path.join(build_dir, MANIFEST_FILENAME), 'w') as wfh:
+        json.dump(
+            {'prefix': build_prefix, 'files': manifest}, wfh, indent=2, sort_keys=True
+        )
+    return manifest
+# <---- Helpers ----------------------------------------------------------------------------------
+
+
+# ----- Serving --------------------------------------------------------------------------------->
+class AssetsManifest(object):
+    '''
+    Resolves static filenames through the manifest written by ``jema assets build``.
+    '''
+
+    def __init__(self, app=None):
+        self.files = {}
+        self.hashed = frozenset()
+        self.prefix = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_BUILD_DIR', 'dist')
+        app.config.setdefault('ASSETS_MAX_AGE', FAR_FUTURE_MAX_AGE)
+        app.config.setdefault('ASSETS_USE_MANIFEST', not app.debug)
+        if not app.config['ASSETS_USE_MANIFEST']:
+            return
+
+        manifest_path = os.path.join(get_build_dir(app), MANIFEST_FILENAME)
+        if not os.path.isfile(manifest_path):
+            log.warning(
+                'No assets manifest found at {0}. Run `jema assets build` to generate '
+                'it.'.format(manifest_path)
+            )
+            return
+
+        with open(manifest_path) as rfh:
+            manifest = json.load(rfh)
+
+        self.prefix = manifest['prefix']
+        self.files = dict(
+            (name, posixpath.join(self.prefix, hashed_name))
+            for (name, hashed_name) in manifest['files'].items()
+        )
+        self.hashed = frozenset(self.files.values())
+
+        app.url_defaults(self.url_defaults)
+        app.view_functions['static'] = self.send_static_file
+        app.extensions['assets'] = self
+
+    def url_defaults(self, endpoint, values):
+        if endpoint != 'static' or 'filename' not in values:
+            return
+        values['filename'] = self.files.get(values['filename'], values['filename'])
+
+    def send_static_file(self, filename):
+        app = current_app
+        if filename not in self.hashed:
+            # Not fingerprinted, let Flask handle it as usual
+            return app.send_static_file(filename)
+
+        max_age = app.config['ASSETS_MAX_AGE']
+        gz_filename = filename + '.gz'
+        if 'gzip' in request.headers.get('Accept-Encoding', '') and \
+                os.path.isfile(os.path.join(app.static_folder, gz_filename)):
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(
+                app.static_folder, gz_filename, mimetype=mimetype, cache_timeout=max_age
+            )
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(app.static_folder, filename, cache_timeout=max_age)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        # The contents behind a fingerprinted name never change
+        response.cache_control.max_age = max_age
+        return response
+
+
+assets = AssetsManifest()
+
+
+@application_configured.connect
+def configure_assets(app):
+    assets.init_app(app)
+# <---- Serving ----------------------------------------------------------------------------------
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class BuildAssets(Command):
+    '''
+Compile, fingerprint and pre-compress the static assets
+'''
+
+    def get_options(self):
+        return [
+            Option('--sass', dest='sass_bin', default=None,
+                   help='Path to the sass binary. Defaults to the libsass python bindings.'),
+            Option('--no-compress', dest='compress', action='store_false', default=True,
+                   help='Do not write pre-compressed `.gz` copies')
+        ]
+
+    def run(self, sass_bin, compress):
+        manifest = build_assets(current_app, sass_bin=sass_bin, compress=compress)
+        print('Fingerprinted {0} static files into {1}'.format(
+            len(manifest), get_build_dir(current_app)
+        ))
+
+
+assets_manager = Manager(usage='Manage the static assets')
+assets_manager.add_command('build', BuildAssets())
+# <---- Scripts Support --------------------------------------------------------------------------
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.benchmark
+    ~~~~~~~~~~~~~~
+
+    End-to-end HTTP benchmark suite.
+
+    A database is seeded with accounts, groups and privileges, each account belonging to some
+    groups and each group granting some privileges, and requests to ``main.index``, signed out
+    and signed in, ``account.profile``, ``account.signout`` and a static file are driven
+    through the WSGI application. Each scenario reports its requests per second, its p50, p95
+    and p99 latencies and how many SQL statements its requests issued, and the suite reports
+    the process' peak RSS, all as JSON, to be compared between commits.
+
+    Run it with ``jema benchmark``, which uses the configured application, sessions backend
+    included, or with ``benchmarks/http_requests.py``, which uses a bare configuration. Either
+    way, the database is a temporary SQLite one unless ``--database-uri`` points to a dedicated
+    one, which is never the configured database. The cache is a process local one and the
+    account cache is disabled, the seeded accounts' keys would otherwise clash with the
+    configured database's ones in a shared cache.
+'''
+
+# Import python libs
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from itertools import islice
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# Import Flask libs & plugins
+from flask import url_for
+from flask_script import Command, Option
+
+# Import JeMa libs
+from jema.application import cache
+from jema.accountcache import account_cache
+from jema.database import (db, Account, Group, Privilege, account_privileges, group_accounts,
+                           group_privileges)
+from jema.signals import sql_statement_executed
+
+# The privileges the built-in permissions are granted by, see :mod:`jema.permissions`
+BUILT_IN_PRIVILEGES = (u'administrator', u'manager', u'pusher', u'contributor', u'committer')
+SCENARIOS = ('index:anonymous', 'index:signed-in', 'profile', 'signout', 'static')
+EXPECTED_STATUS = {'signout': 302}
+
+# Shared by the ``jema benchmark`` command and the standalone script, as ``(args, kwargs)``
+OPTIONS = (
+    (('--database-uri',),
+     dict(default=None,
+          help='A dedicated database to seed. Defaults to a temporary SQLite database')),
+    (('--reset',),
+     dict(action='store_true', default=False,
+          help='Drop and recreate the tables of --database-uri before seeding it')),
+    (('-a', '--accounts'), dict(type=int, default=1000, help='Defaults to 1000')),
+    (('-g', '--groups'), dict(type=int, default=50, help='Defaults to 50')),
+    (('-p', '--privileges'), dict(type=int, default=20, help='Defaults to 20')),
+    (('--groups-per-account',), dict(type=int, default=3, help='Defaults to 3')),
+    (('--privileges-per-group',), dict(type=int, default=5, help='Defaults to 5')),
+    (('--privileges-per-account',), dict(type=int, default=1, help='Defaults to 1')),
+    (('-n', '--requests'),
+     dict(type=int, default=500, help='Requests per scenario. Defaults to 500')),
+    (('--warmup',),
+     dict(type=int, default=50, help='Untimed requests per scenario. Defaults to 50')),
+    (('--sessions',),
+     dict(type=int, default=20, help='Signed in accounts requests rotate over. Defaults to 20')),
+    (('-s', '--scenario'),
+     dict(dest='scenarios', action='append', choices=SCENARIOS, default=None,
+          help='Only run these scenarios. Defaults to all of them')),
+    (('--seed',), dict(type=int, default=0, help='Random seed of the memberships')),
+    (('-o', '--output'),
+     dict(default=None, help='Write the results to this file instead of the standard output')),
+)
+
+
+# ----- Seeding --------------------------------------------------------------------------------->
+def chunked(rows, size=5000):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def seed(accounts, groups, privileges, groups_per_account=3, privileges_per_group=5,
+         privileges_per_account=1, rng=None):
+    '''
+    Populate the empty database with ``accounts`` accounts, ``groups`` groups and
+    ``privileges`` privileges, the first of them being the built-in ones, using bulk inserts.
+    '''
+    rng = rng or random.Random()
+    privilege_names = list(BUILT_IN_PRIVILEGES[:privileges]) + [
+        u'privilege-{0}'.format(idx) for idx in range(len(BUILT_IN_PRIVILEGES), privileges)
+    ]
+    tables = (
+        (Privilege.__table__,
+         ({'id': idx, 'name': name} for idx, name in enumerate(privilege_names, 1))),
+        (Group.__table__,
+         ({'id': idx, 'name': u'group-{0}'.format(idx)} for idx in range(1, groups + 1))),
+        (Account.__table__,
+         ({'id': idx,
+           'login': u'account-{0}'.format(idx),
+           'name': u'Account {0}'.format(idx),
+           'email': u'account-{0}@example.com'.format(idx),
+           'access_token': u'token-{0}'.format(idx)} for idx in range(1, accounts + 1))),
+        (group_privileges,
+         ({'group_id': group_id, 'privilege_id': privilege_id}
+          for group_id in range(1, groups + 1)
+          for privilege_id in rng.sample(range(1, privileges + 1),
+                                         min(privileges_per_group, privileges)))),
+        (group_accounts,
+         ({'group_id': group_id, 'account_id': account_id}
+          for account_id in range(1, accounts + 1)
+          for group_id in rng.sample(range(1, groups + 1), min(groups_per_account, groups)))),
+        (account_privileges,
+         ({'account_id': account_id, 'privilege_id': privilege_id}
+          for account_id in range(1, accounts + 1)
+          for privilege_id in rng.sample(range(1, privileges + 1),
+                                         min(privileges_per_account, privileges)))),
+    )
+    for table, rows in tables:
+        for chunk in chunked(rows):
+            db.session.execute(table.insert(), chunk)
+    db.session.commit()
+# <---- Seeding ----------------------------------------------------------------------------------
+
+
+# ----- Measuring ------------------------------------------------------------------------------->
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(round(pct / 100.0 * len(values) + 0.5)) - 1)]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes instead of kilobytes
+        peak //= 1024
+    return peak
+
+
+def current_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StatementCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, sender, **kwargs):
+        self.count += 1
+
+
+def sign_in(client, account_id):
+    with client.session_transaction() as session:
+        session['identity.id'] = account_id
+        session['identity.auth_type'] = 'dbm'
+
+
+def drive(app, scenario, requests, warmup, account_ids, counter):
+    '''
+    Send ``warmup`` and then ``requests`` timed requests of the ``scenario``, the signed in
+    ones rotating over the ``account_ids``.
+    '''
+    with app.test_request_context():
+        static_url = url_for('static', filename='favicon.ico')
+    urls = {
+        'index:anonymous': '/',
+        'index:signed-in': '/',
+        'profile': '/account/profile',
+        'signout': '/account/signout',
+        'static': static_url,
+    }
+    url = urls[scenario]
+    expected_status = EXPECTED_STATUS.get(scenario, 200)
+
+    if scenario in ('index:anonymous', 'static'):
+        clients = [app.test_client()]
+    else:
+        clients = []
+        for account_id in account_ids:
+            client = app.test_client()
+            sign_in(client, account_id)
+            clients.append((client, account_id))
+
+    latencies = []
+    statements = []
+    errors = 0
+    started = None
+    for idx in range(warmup + requests):
+        if idx == warmup:
+            started = time.time()
+        client = clients[idx % len(clients)]
+        if isinstance(client, tuple):
+            client, account_id = client
+            if scenario == 'signout':
+                # The previous request signed it out, the session write isn't measured
+                sign_in(client, account_id)
+        counter.count = 0
+        start = time.time()
+        response = client.get(url)
+        response.close()
+        latency = time.time() - start
+        if idx < warmup:
+            continue
+        latencies.append(latency)
+        statements.append(counter.count)
+        if response.status_code != expected_status:
+            errors += 1
+    elapsed = time.time() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'latency_ms': dict(
+            ('p{0}'.format(pct), round(percentile(latencies, pct) * 1000, 2))
+            for pct in (50, 95, 99)
+        ),
+        'statements_per_request': {
+            'mean': round(float(sum(statements)) / len(statements), 2),
+            'max': max(statements)
+        },
+        'peak_rss_kb': peak_rss_kb()
+    }
+# <---- Measuring --------------------------------------------------------------------------------
+
+
+def run_benchmark(app, options):
+    '''
+    Seed the database and run the scenarios, ``options`` being a mapping of the :data:`OPTIONS`.
+    Returns the results.
+    '''
+    tempdir = None
+    database_uri = options['database_uri']
+    if database_uri is None:
+        tempdir = tempfile.mkdtemp()
+        database_uri = 'sqlite:///{0}'.format(os.path.join(tempdir, 'benchmark.db'))
+    # Flask-SQLAlchemy connects anew once the URI changes. No replica, it would not be seeded.
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_BINDS'] = None
+    # The cache keys aren't namespaced per database, keep the seeded accounts out of a shared
+    # cache
+    app.config['ACCOUNT_CACHE_ENABLED'] = False
+    account_cache.init_app(app)
+    cache.init_app(app, {'CACHE_TYPE': 'simple'})
+
+    try:
+        with app.app_context():
+            if options['reset']:
+                db.drop_all()
+            db.create_all()
+            if db.session.query(Account.id).first() is not None:
+                raise RuntimeError(
+                    'The benchmark database is not empty, pass --reset to recreate its tables'
+                )
+            start = time.time()
+            seed(options['accounts'], options['groups'], options['privileges'],
+                 options['groups_per_account'], options['privileges_per_group'],
+                 options['privileges_per_account'], random.Random(options['seed']))
+            seeding = time.time() - start
+            db.session.remove()
+
+        rng = random.Random(options['seed'])
+        account_ids = rng.sample(range(1, options['accounts'] + 1),
+                                 min(options['sessions'], options['accounts']))
+        counter = StatementCounter()
+        sql_statement_executed.connect(counter)
+        try:
+            results = {}
+            for scenario in options['scenarios'] or SCENARIOS:
+                results[scenario] = drive(app, scenario, options['requests'],
+                                          options['warmup'], account_ids, counter)
+        finally:
+            sql_statement_executed.disconnect(counter)
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+
+    return {
+        'revision': current_revision(),
+        'python': sys.version.split()[0],
+        'database': database_uri.split(':', 1)[0],
+        'seed': dict(
+            (key, options[key]) for key in (
+                'accounts', 'groups', 'privileges', 'groups_per_account',
+                'privileges_per_group', 'privileges_per_account', 'seed'
+            )
+        ),
+        'seeding_seconds': round(seeding, 3),
+        'scenarios': results,
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+
+def write_results(results, output=None):
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if output is None:
+        print(data)
+        return
+    with open(output, 'w') as wfh:
+        wfh.write(data + '\n')
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class Benchmark(Command):
+    '''
+Run the end-to-end HTTP benchmark suite against a seeded database
+'''
+
+    def get_options(self):
+        return [Option(*args, **kwargs) for (args, kwargs) in OPTIONS]
+
+    def __call__(self, app=None, *args, **kwargs):
+        # Each benchmarked request needs its own application context, not the one of the
+        # request context commands run in
+        return self.run(app, *args, **kwargs)
+
+    def run(self, app, **options):
+        try:
+            results = run_benchmark(app, options)
+        except RuntimeError as exc:
+            print(exc)
+            exit(1)
+        write_results(results, options['output'])
+# <---- Scripts Support --------------------------------------------------------------------------
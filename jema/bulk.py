@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.bulk
+    ~~~~~~~~~
+
+    Streaming bulk export and import of the accounts, groups, privileges and memberships.
+
+    Records are JSON lines, one row per line, tagged with its ``type``::
+
+        {"type": "account", "id": 1, "login": "jema", ...}
+        {"type": "group_account", "group_id": 6, "account_id": 1}
+
+    Exports read through a server-side cursor, where the database driver supports it, and
+    imports insert or update, by primary key, in batches, so neither loads the whole data set
+    in memory.
+
+    Imported rows keep their ids. On PostgreSQL, the serial primary keys' sequences are then
+    advanced past the highest id, otherwise the next rows created, ie, a new group, would get
+    ids already taken.
+'''
+
+# Import python libs
+import sys
+import json
+from datetime import datetime
+
+# Import 3rd-party libs
+import sqlalchemy
+from sqlalchemy import and_, bindparam, func, select
+
+# Import Flask libs & plugins
+from flask_script import Command, Option
+
+# Import JeMa libs
+from jema.database import (db, Account, Group, Privilege, account_privileges, group_accounts,
+                           group_privileges)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Ordered so that the rows are imported after the ones they reference
+RECORD_TYPES = (
+    ('privilege', Privilege.__table__),
+    ('group', Group.__table__),
+    ('account', Account.__table__),
+    ('group_privilege', group_privileges),
+    ('account_privilege', account_privileges),
+    ('group_account', group_accounts),
+)
+TABLES = dict(RECORD_TYPES)
+
+
+class BulkImportError(ValueError):
+    '''
+    Raised when an import record is invalid.
+    '''
+
+
+# ----- Serialization --------------------------------------------------------------------------->
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # Locales, URLs, etc
+    return unicode(value)
+
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise BulkImportError('Invalid datetime {0!r}'.format(value))
+
+
+def _to_row(table, record, lineno):
+    row = {}
+    for name, value in record.items():
+        if name == 'type':
+            continue
+        if name not in table.c:
+            raise BulkImportError('Line {0}: {1!r} has no {2!r} column'.format(
+                lineno, record['type'], name
+            ))
+        if isinstance(table.c[name].type, sqlalchemy.DateTime):
+            value = _parse_datetime(value)
+        row[name] = value
+    return row
+# <---- Serialization ----------------------------------------------------------------------------
+
+
+# ----- Export ---------------------------------------------------------------------------------->
+def _plain_column(column):
+    '''
+    Skip the custom types result processing, ie, building locale and URL objects, which costs
+    much more than the export itself.
+    '''
+    if isinstance(column.type, sqlalchemy.types.TypeDecorator):
+        return sqlalchemy.type_coerce(column, column.type.impl).label(column.name)
+    return column
+
+
+def export_records(connection, batch_size=DEFAULT_BATCH_SIZE, record_types=None):
+    '''
+    Yield the ``(record_type, row)`` of every row, reading ``batch_size`` rows at a time.
+    '''
+    for record_type, table in RECORD_TYPES:
+        if record_types and record_type not in record_types:
+            continue
+        result = connection.execution_options(stream_results=True).execute(
+            select([_plain_column(column) for column in table.c]).order_by(
+                *table.primary_key.columns
+            )
+        )
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield record_type, row
+        finally:
+            result.close()
+
+
+def bulk_export(stream, batch_size=DEFAULT_BATCH_SIZE, record_types=None):
+    counts = dict.fromkeys(TABLES, 0)
+    with db.engine.connect() as connection:
+        for record_type, row in export_records(connection, batch_size, record_types):
+            record = dict(row.items())
+            record['type'] = record_type
+            # No sorted keys, those disable the C accelerated encoder
+            stream.write(json.dumps(record, default=_json_default) + '\n')
+            counts[record_type] += 1
+    return counts
+# <---- Export -----------------------------------------------------------------------------------
+
+
+# ----- Import ---------------------------------------------------------------------------------->
+def upsert(connection, table, rows):
+    '''
+    Insert ``rows`` into ``table``, updating the ones whose primary key already exists.
+    '''
+    key_names = [column.name for column in table.primary_key.columns]
+
+    def key_of(row):
+        return tuple(row[name] for name in key_names)
+
+    # The last occurrence of a key in the batch wins
+    rows = list(dict((key_of(row), row) for row in rows).values())
+
+    existing = set(tuple(entry) for entry in connection.execute(
+        select(list(table.primary_key.columns)).where(and_(*[
+            table.c[name].in_(set(row[name] for row in rows)) for name in key_names
+        ]))
+    ))
+    inserts = [row for row in rows if key_of(row) not in existing]
+    updates = [row for row in rows if key_of(row) in existing]
+
+    if inserts:
+        connection.execute(table.insert(), inserts)
+    value_names = [name for name in updates[0] if name not in key_names] if updates else ()
+    if value_names:
+        statement = table.update().where(and_(*[
+            table.c[name] == bindparam('_key_{0}'.format(name)) for name in key_names
+        ])).values(dict((name, bindparam(name)) for name in value_names))
+        connection.execute(statement, [
+            dict(row, **dict(('_key_{0}'.format(name), row[name]) for name in key_names))
+            for row in updates
+        ])
+    return len(inserts), len(updates)
+
+
+def advance_sequences(connection, tables):
+    '''
+    Advance the sequences of the ``tables``' serial primary keys past their highest id.
+    Explicitly inserted ids don't move them. Only PostgreSQL needs this.
+    '''
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in tables:
+        columns = list(table.primary_key.columns)
+        if len(columns) != 1 or not isinstance(columns[0].type, sqlalchemy.Integer):
+            continue
+        column = columns[0]
+        highest = select([func.max(column)]).as_scalar()
+        # Tables without a serial sequence get a NULL one, which setval ignores
+        connection.execute(select([func.setval(
+            func.pg_get_serial_sequence(
+                unicode(connection.dialect.identifier_preparer.format_table(table)), column.name
+            ),
+            func.coalesce(highest, 1),
+            highest.isnot(None)
+        )]))
+
+
+def bulk_import(stream, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Import the records from ``stream``, committing every ``batch_size`` records of a type.
+    '''
+    counts = dict((record_type, [0, 0]) for record_type in TABLES)
+
+    with db.engine.connect() as connection:
+        def flush(record_type, rows):
+            with connection.begin():
+                inserted, updated = upsert(connection, TABLES[record_type], rows)
+            counts[record_type][0] += inserted
+            counts[record_type][1] += updated
+
+        batch_type, batch = None, []
+        for lineno, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                raise BulkImportError('Line {0}: {1}'.format(lineno, exc))
+            record_type = record.get('type')
+            if record_type not in TABLES:
+                raise BulkImportError('Line {0}: unknown record type {1!r}'.format(
+                    lineno, record_type
+                ))
+            if batch and (record_type != batch_type or len(batch) >= batch_size):
+                flush(batch_type, batch)
+                batch = []
+            batch_type = record_type
+            batch.append(_to_row(TABLES[record_type], record, lineno))
+        if batch:
+            flush(batch_type, batch)
+
+        with connection.begin():
+            advance_sequences(connection, [
+                TABLES[record_type] for record_type in TABLES if sum(counts[record_type])
+            ])
+    return counts
+# <---- Import -----------------------------------------------------------------------------------
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class Export(Command):
+    '''
+Export accounts, groups, privileges and memberships as JSON lines
+'''
+
+    def get_options(self):
+        return [
+            Option('-o', '--output', default='-',
+                   help='The file to write to. Defaults to the standard output'),
+            Option('-b', '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                   help='How many rows to fetch from the database at a time'),
+            Option('-t', '--type', dest='record_types', action='append',
+                   choices=[record_type for record_type, _ in RECORD_TYPES],
+                   help='Only export this type of records. Can be passed several times')
+        ]
+
+    def run(self, output, batch_size, record_types):
+        if output == '-':
+            counts = bulk_export(sys.stdout, batch_size, record_types)
+        else:
+            with open(output, 'w') as wfh:
+                counts = bulk_export(wfh, batch_size, record_types)
+        sys.stderr.write('Exported {0}\n'.format(', '.join(
+            '{0} {1} records'.format(counts[record_type], record_type)
+            for record_type, _ in RECORD_TYPES
+        )))
+
+
+class Import(Command):
+    '''
+Import, inserting or updating, accounts, groups, privileges and memberships from JSON lines.
+The records keep their ids, on PostgreSQL the id sequences are then advanced past the highest
+imported id.
+'''
+
+    def get_options(self):
+        return [
+            Option('input', nargs='?', default='-',
+                   help='The file to read from. Defaults to the standard input'),
+            Option('-b', '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                   help='How many records to write to the database at a time')
+        ]
+
+    def run(self, input, batch_size):  # pylint: disable=W0622
+        try:
+            if input == '-':
+                counts = bulk_import(sys.stdin, batch_size)
+            else:
+                with open(input) as rfh:
+                    counts = bulk_import(rfh, batch_size)
+        except BulkImportError as exc:
+            print('Import failed: {0}'.format(exc))
+            exit(1)
+        sys.stderr.write('Imported {0}\n'.format(', '.join(
+            '{0} {1} records ({2} updated)'.format(
+                sum(counts[record_type]), record_type, counts[record_type][1]
+            ) for record_type, _ in RECORD_TYPES
+        )))
+# <---- Scripts Support --------------------------------------------------------------------------
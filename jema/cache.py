@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.cache
+    ~~~~~~~~~~
+
+    Flask-Cache with a two-tier, stampede protected, ``memoize``.
+
+    Memoized values are first looked up in a per-process LRU, bounded to a number of entries,
+    then in the shared Flask-Cache backend. The shared backend keeps them for a grace period
+    past their expiry. Once expired, or a bit earlier with a probability growing as the expiry
+    nears, a single caller, holding a lock in the shared backend, recomputes the value while
+    the others keep getting the previous one. Only a value missing altogether makes the other
+    callers wait for it, up to the lock timeout.
+
+    The lookups of each tier are counted by the ``jema_cache_requests_total`` metric, with the
+    ``memoize:local`` and ``memoize:shared`` cache labels, see :func:`hit_ratios`.
+
+    Configuration, in ``jemaappconfig``, besides Flask-Cache's:
+
+    ``CACHE_LOCAL_MAX_ENTRIES``
+        How many values the per-process tier keeps. ``0`` disables it. Defaults to ``1000``.
+    ``CACHE_LOCAL_TIMEOUT``
+        Seconds a value is served from the per-process tier, the longest a process may miss a
+        ``delete_memoized`` done by another one. Defaults to ``60``.
+    ``CACHE_STALE_GRACE``
+        Seconds an expired value is still kept, served while being recomputed. Defaults to
+        ``300``.
+    ``CACHE_LOCK_TIMEOUT``
+        Seconds the recomputing caller holds the lock, the most a computation is expected to
+        take. Defaults to ``30``.
+    ``CACHE_EARLY_REFRESH_BETA``
+        How eagerly values are recomputed before they expire, ``0`` waits for the expiry.
+        Defaults to ``1``.
+'''
+
+# Import python libs
+import math
+import time
+import random
+import logging
+import functools
+import threading
+from collections import OrderedDict
+
+# Import Flask libs & plugins
+from flask import current_app
+from flask_cache import Cache, function_namespace
+
+# Import JeMa libs
+from jema.metrics import cache_requests
+
+log = logging.getLogger(__name__)
+
+LOCAL_TIER = 'memoize:local'
+SHARED_TIER = 'memoize:shared'
+LOCK_POLL_INTERVAL = 0.05
+
+
+class LocalCache(object):
+    '''
+    Thread safe LRU cache, keeping up to ``max_entries`` values, each for ``timeout`` seconds.
+    '''
+
+    def __init__(self, max_entries=1000, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                return None
+            # Most recently used last
+            self.entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.timeout, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_matching(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class JemaCache(Cache):
+
+    def __init__(self, app=None, with_jinja2_ext=True, config=None):
+        self.local = LocalCache()
+        self.stale_grace = 300
+        self.lock_timeout = 30
+        self.early_refresh_beta = 1.0
+        super(JemaCache, self).__init__(app, with_jinja2_ext, config)
+
+    def init_app(self, app, config=None):
+        super(JemaCache, self).init_app(app, config)
+        self.local = LocalCache(
+            app.config.get('CACHE_LOCAL_MAX_ENTRIES', 1000),
+            app.config.get('CACHE_LOCAL_TIMEOUT', 60)
+        )
+        self.stale_grace = app.config.get('CACHE_STALE_GRACE', self.stale_grace)
+        self.lock_timeout = app.config.get('CACHE_LOCK_TIMEOUT', self.lock_timeout)
+        self.early_refresh_beta = app.config.get(
+            'CACHE_EARLY_REFRESH_BETA', self.early_refresh_beta
+        )
+
+    # ----- Memoize --------------------------------------------------------------------------->
+    def memoize(self, timeout=None, make_name=None, unless=None):
+        '''
+        Like Flask-Cache's ``memoize``, see the module documentation for the differences.
+        '''
+        def memoize(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                if callable(unless) and unless() is True:
+                    return f(*args, **kwargs)
+                return self._memoized_call(decorated_function, f, args, kwargs)
+
+            decorated_function.uncached = f
+            decorated_function.cache_timeout = timeout
+            decorated_function.make_cache_key = self._memoize_make_cache_key(
+                make_name, decorated_function
+            )
+            decorated_function.delete_memoized = lambda: self.delete_memoized(f)
+            return decorated_function
+        return memoize
+
+    def delete_memoized(self, f, *args, **kwargs):
+        namespace = function_namespace(getattr(f, 'uncached', f))[0]
+        if args or kwargs:
+            local_key = self._local_key(getattr(f, 'uncached', f), args, kwargs)
+            self.local.delete_matching(lambda key: key == local_key)
+        else:
+            self.local.delete_matching(lambda key: key[0] == namespace)
+        return super(JemaCache, self).delete_memoized(f, *args, **kwargs)
+
+    @staticmethod
+    def _local_key(f, args, kwargs):
+        # Unlike the shared key, doesn't need a lookup of the function's version
+        return (function_namespace(f)[0], repr(args), repr(sorted(kwargs.items())))
+
+    def _should_refresh(self, envelope):
+        '''
+        Whether to recompute a value now, always once it has expired and, before that, with a
+        probability growing as the expiry nears and with the time the value took to compute.
+        '''
+        _, expires, delta = envelope
+        now = time.time()
+        if now >= expires:
+            return True
+        if self.early_refresh_beta <= 0:
+            return False
+        return now - delta * self.early_refresh_beta * math.log(1.0 - random.random()) >= expires
+
+    def _memoized_call(self, decorated_function, f, args, kwargs):
+        local_key = self._local_key(f, args, kwargs)
+        envelope = self.local.get(local_key)
+        if envelope is not None:
+            cache_requests.inc(LOCAL_TIER, 'hit')
+            if not self._should_refresh(envelope):
+                return envelope[0]
+        else:
+            cache_requests.inc(LOCAL_TIER, 'miss')
+
+        try:
+            cache_key = decorated_function.make_cache_key(f, *args, **kwargs)
+            shared = self.cache.get(cache_key)
+        except Exception:  # pylint: disable=W0703
+            if current_app.debug:
+                raise
+            log.exception('Failed to read the memoized value from the cache backend')
+            return f(*args, **kwargs)
+        if isinstance(shared, tuple) and len(shared) == 3:
+            cache_requests.inc(SHARED_TIER, 'hit')
+            envelope = shared
+            self.local.set(local_key, envelope)
+            if not self._should_refresh(envelope):
+                return envelope[0]
+        else:
+            cache_requests.inc(SHARED_TIER, 'miss')
+
+        lock_key = '{0}:lock'.format(cache_key)
+        if self._acquire(lock_key):
+            try:
+                return self._compute(decorated_function, f, args, kwargs, cache_key, local_key)
+            finally:
+                self._release(lock_key)
+
+        if envelope is not None:
+            # Another caller is recomputing it, the previous value will do meanwhile
+            cache_requests.inc(SHARED_TIER, 'stale')
+            return envelope[0]
+
+        # Another caller is computing the missing value, wait for it
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            envelope = self.cache.get(cache_key)
+            if isinstance(envelope, tuple) and len(envelope) == 3:
+                self.local.set(local_key, envelope)
+                return envelope[0]
+        return self._compute(decorated_function, f, args, kwargs, cache_key, local_key)
+
+    def _compute(self, decorated_function, f, args, kwargs, cache_key, local_key):
+        start = time.time()
+        value = f(*args, **kwargs)
+        now = time.time()
+        timeout = decorated_function.cache_timeout or getattr(self.cache, 'default_timeout', 300)
+        envelope = (value, now + timeout, now - start)
+        self.local.set(local_key, envelope)
+        try:
+            self.cache.set(cache_key, envelope, timeout=timeout + self.stale_grace)
+        except Exception:  # pylint: disable=W0703
+            if current_app.debug:
+                raise
+            log.exception('Failed to write the memoized value to the cache backend')
+        return value
+
+    def _acquire(self, lock_key):
+        try:
+            return self.cache.add(lock_key, 1, timeout=self.lock_timeout)
+        except Exception:  # pylint: disable=W0703
+            log.exception('Failed to acquire the cache lock {0!r}'.format(lock_key))
+            # Compute it then, like without a lock
+            return True
+
+    def _release(self, lock_key):
+        try:
+            self.cache.delete(lock_key)
+        except Exception:  # pylint: disable=W0703
+            log.exception('Failed to release the cache lock {0!r}'.format(lock_key))
+    # <---- Memoize ----------------------------------------------------------------------------
+
+
+def hit_ratios():
+    '''
+    The memoized lookups hit ratio of each tier, in this process, ``None`` when unused. Expired
+    values, served while being recomputed, count as hits.
+    '''
+    with cache_requests.lock:
+        values = dict(cache_requests.values)
+    ratios = {}
+    for tier in (LOCAL_TIER, SHARED_TIER):
+        hits = values.get((tier, 'hit'), 0)
+        total = hits + values.get((tier, 'miss'), 0)
+        ratios[tier] = float(hits) / total if total else None
+    return ratios
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.conditional
+    ~~~~~~~~~~~~~~~~
+
+    Conditional GET support for rendered pages.
+
+    Views decorated with :func:`conditional` get a weak ``ETag`` computed from what goes into
+    rendering them, the templates version, the locale and timezone, the identity's roles and
+    the signed-in account details, the CSRF token and its validity window, plus any extra
+    version the view passes in. When the browser already holds a matching page a
+    ``304 Not Modified`` is returned without calling the view at all.
+
+    Enable it by setting ``CONDITIONAL_GET_ENABLED = True`` in ``jemaappconfig``.
+'''
+
+# Import python libs
+import os
+import time
+import hashlib
+from functools import wraps
+
+# Import Flask libs & plugins
+from flask import current_app, g, make_response, request, session
+from flask_babel import get_locale, get_timezone
+
+# Import JeMa libs
+import jema
+
+# The account attributes which end up in rendered pages. ``last_login`` is left out on purpose,
+# it's updated on every identity load.
+ACCOUNT_RENDER_ATTRIBUTES = (
+    'id', 'login', 'name', 'email', 'avatar_url', 'locale', 'timezone', 'datetime_format'
+)
+
+
+# ----- Render Inputs --------------------------------------------------------------------------->
+def templates_version(app):
+    '''
+    Fingerprint of the templates and assets in use.
+
+    It's computed once per process unless templates are being auto reloaded, deployments
+    restart the workers anyway.
+    '''
+    auto_reload = app.debug or app.config.get('TEMPLATES_AUTO_RELOAD')
+    version = app.extensions.get('templates_version')
+    if version is not None and not auto_reload:
+        return version
+
+    digest = hashlib.sha1(jema.__version__)
+    for name in sorted(app.jinja_env.list_templates()):
+        filename = app.jinja_env.loader.get_source(app.jinja_env, name)[1]
+        digest.update('{0}:{1}'.format(name, filename and os.path.getmtime(filename)))
+    assets = app.extensions.get('assets')
+    if assets is not None:
+        digest.update(repr(sorted(assets.files.items())))
+    version = app.extensions['templates_version'] = digest.hexdigest()
+    return version
+
+
+def identity_fingerprint():
+    identity = getattr(g, 'identity', None)
+    if identity is None:
+        return ()
+    needs = sorted('{0}:{1}'.format(need.method, need.value) for need in identity.provides)
+    account = getattr(identity, 'account', None)
+    if account is None:
+        return needs
+    return needs + [
+        repr(getattr(account, attr, None)) for attr in ACCOUNT_RENDER_ATTRIBUTES
+    ]
+
+
+def csrf_window(app):
+    '''
+    The ``WTF_CSRF_TIME_LIMIT`` long window the current time falls in.
+
+    The rendered CSRF tokens expire ``WTF_CSRF_TIME_LIMIT`` seconds after the page was built,
+    changing the ETag with the window keeps an expired token from being served again.
+    '''
+    time_limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if not time_limit:
+        # The tokens never expire
+        return None
+    return int(time.time() // time_limit)
+
+
+def compute_etag(versions=()):
+    digest = hashlib.sha1(templates_version(current_app))
+    digest.update(request.full_path.encode('utf-8'))
+    digest.update(str(get_locale()))
+    digest.update(str(get_timezone()))
+    for part in identity_fingerprint():
+        digest.update(part.encode('utf-8') if isinstance(part, unicode) else part)
+    # Forms embed the CSRF token which is bound to the session
+    digest.update(str(session.get('csrf_token')))
+    digest.update(str(csrf_window(current_app)))
+    for version in versions:
+        digest.update(repr(version() if callable(version) else version))
+    return digest.hexdigest()
+# <---- Render Inputs ----------------------------------------------------------------------------
+
+
+# ----- View Decorator -------------------------------------------------------------------------->
+def conditional(*versions):
+    '''
+    Add weak ETag based conditional GET support to a view.
+
+    ``versions`` are additional values, or callables returning them, which invalidate the page
+    when they change, ie, the version of the models the view renders.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get('CONDITIONAL_GET_ENABLED', False) or \
+                    current_app.debug or \
+                    request.method not in ('GET', 'HEAD') or \
+                    session.get('_flashes'):
+                # Pending flash messages are consumed by the rendering, the page must be built
+                return func(*args, **kwargs)
+
+            etag = compute_etag(versions)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            # Signed-in identities come from the session cookie, anonymous locales from the
+            # browser languages
+            response.vary.update(('Cookie', 'Accept-Language'))
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+# <---- View Decorator ---------------------------------------------------------------------------
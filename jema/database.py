@@ -13,24 +13,32 @@
 # pylint: disable=E8221,C0326
 
 # Import Python libs
+import time
+import logging
 from datetime import datetime
+from contextlib import contextmanager
 
 # Import 3rd-party plugins
 import sqlalchemy
-from flask import g
+from flask import current_app, g, has_app_context
 from sqlalchemy import orm
 from flask_babel import _
-from flask_sqlalchemy import SQLAlchemy
-from jenkinsapi.jenkins import Jenkins
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
 #from sqlalchemy_utils import *
 from sqlalchemy_utils import coercion_listener
 from sqlalchemy_utils.types import EmailType, LocaleType, TimezoneType, URLType
 
 # Import JeMa libs
-from jema.signals import application_configured
+from jema.metrics import timed_call
+from jema.pagination import DEFAULT_PER_PAGE, MAX_PER_PAGE, keyset_page, iter_keyset_pages
+from jema.signals import application_configured, process_forked, sql_statement_executed
+
+log = logging.getLogger(__name__)
 
 sqlalchemy.event.listen(sqlalchemy.orm.mapper, 'mapper_configured', coercion_listener)
 
+REPLICA_BIND = 'replica'
+
 # ----- Simplify * Imports ---------------------------------------------------------------------->
 ALL_DB_IMPORTS = [
     'db',
@@ -38,6 +46,8 @@ ALL_DB_IMPORTS = [
     'Group',
     'Privilege',
     'JenkinsServer',
+    'read_replica',
+    'upstream_call',
 ]
 __all__ = ALL_DB_IMPORTS + ['ALL_DB_IMPORTS']
 # <---- Simplify * Imports -----------------------------------------------------------------------
@@ -55,33 +65,251 @@ def _timezone_choices():
 # <---- Form Helpers -----------------------------------------------------------------------------
 
 
+# ----- Read Replica Routing -------------------------------------------------------------------->
+class RoutingSession(SignallingSession):
+    '''
+    Session which sends the queries issued within :func:`read_replica` to the replica engine,
+    when one is configured through ``SQLALCHEMY_REPLICA_URI``.
+
+    Flushes always go to the primary and, once the session has flushed anything, it stays
+    pinned to the primary so that the request reads its own writes.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        SignallingSession.__init__(self, *args, **kwargs)
+        self.use_replica = False
+        self.pinned_to_primary = False
+        # Whether the current transaction has flushed anything, unlike the pinning, it's reset
+        # once the transaction ends, see upstream_call()
+        self.flushed_in_transaction = False
+        sqlalchemy.event.listen(self, 'after_flush', self._pin_to_primary)
+        sqlalchemy.event.listen(self, 'after_transaction_end', self._transaction_ended)
+
+    @staticmethod
+    def _pin_to_primary(session, flush_context):
+        session.pinned_to_primary = True
+        session.flushed_in_transaction = True
+
+    @staticmethod
+    def _transaction_ended(session, transaction):
+        if transaction.parent is None:
+            session.flushed_in_transaction = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.use_replica and not self.pinned_to_primary and not self._flushing and \
+                REPLICA_BIND in (self.app.config['SQLALCHEMY_BINDS'] or ()):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class JemaSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@contextmanager
+def read_replica(session=None):
+    '''
+    Route the read-only queries issued within the context to the replica engine, ie::
+
+        with read_replica():
+            account = Account.query.get(login)
+    '''
+    if session is None:
+        session = db.session()
+    previous = getattr(session, 'use_replica', False)
+    session.use_replica = True
+    try:
+        yield session
+    finally:
+        session.use_replica = previous
+
+
+@contextmanager
+def upstream_call(service, operation):
+    '''
+    Time a call to an upstream service, ie, GitHub or Jenkins, like
+    :func:`~jema.metrics.timed_call`, having first given the request's database connection back
+    to the pool.
+
+    Otherwise every request waiting on a slow upstream pins a connection, capping the
+    concurrent requests at the pool size when serving cooperatively, see :mod:`jema.serving`.
+    Only a read-only transaction is ended, the loaded objects are kept as they are. One with
+    pending or flushed changes is left alone, the view must still be able to roll them back.
+    '''
+    if has_app_context():
+        session = db.session()
+        if not (session.new or session.dirty or session.deleted or
+                getattr(session, 'flushed_in_transaction', False)):
+            expire_on_commit = session.expire_on_commit
+            session.expire_on_commit = False
+            try:
+                session.commit()
+            finally:
+                session.expire_on_commit = expire_on_commit
+    with timed_call(service, operation):
+        yield
+# <---- Read Replica Routing ---------------------------------------------------------------------
+
+
 # ----- Instantiate the Plugin ------------------------------------------------------------------>
-db = SQLAlchemy()
+db = JemaSQLAlchemy()
+
+
+def configure_engines(app):
+    '''
+    Translate JeMa's engine tuning settings into ``SQLALCHEMY_ENGINE_OPTIONS``.
+
+    The pool sizing uses Flask-SQLAlchemy's own settings, ``SQLALCHEMY_POOL_SIZE``,
+    ``SQLALCHEMY_MAX_OVERFLOW``, ``SQLALCHEMY_POOL_TIMEOUT`` and ``SQLALCHEMY_POOL_RECYCLE``.
+    On top of those:
+
+    ``SQLALCHEMY_POOL_PRE_PING``
+        Test connections for liveness when checking them out of the pool.
+    ``SQLALCHEMY_STATEMENT_TIMEOUT``
+        Abort statements running for longer than this many seconds. Supported on PostgreSQL
+        and MySQL.
+    ``SQLALCHEMY_REPLICA_URI``
+        Database to route read-only queries to, see :func:`read_replica`.
+    '''
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if app.config.get('SQLALCHEMY_POOL_PRE_PING', False):
+        options.setdefault('pool_pre_ping', True)
+
+    timeout = app.config.get('SQLALCHEMY_STATEMENT_TIMEOUT', None)
+    if timeout:
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        connect_args = options.setdefault('connect_args', {})
+        if uri.startswith('postgres'):
+            connect_args.setdefault(
+                'options', '-c statement_timeout={0:d}'.format(int(timeout * 1000))
+            )
+        elif uri.startswith('mysql'):
+            connect_args.setdefault(
+                'init_command',
+                'SET SESSION max_execution_time={0:d}'.format(int(timeout * 1000))
+            )
+        else:
+            log.warning('SQLALCHEMY_STATEMENT_TIMEOUT is not supported by {0!r}'.format(
+                uri.split(':', 1)[0]
+            ))
+
+    replica_uri = app.config.get('SQLALCHEMY_REPLICA_URI', None)
+    if replica_uri:
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        binds.setdefault(REPLICA_BIND, replica_uri)
+        app.config['SQLALCHEMY_BINDS'] = binds
+    else:
+        app.config.setdefault('SQLALCHEMY_BINDS', None)
 
 
 @application_configured.connect
 def configure_sqlalchemy(app):
+    configure_engines(app)
     db.init_app(app)
+
+
+def dispose_engines(app):
+    '''
+    Close the pooled connections of every engine, the primary and the binds, so that none is
+    shared with a forked process.
+    '''
+    db.session.remove()
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+        db.get_engine(app, bind).dispose()
+
+
+@process_forked.connect
+def on_process_forked(app):
+    dispose_engines(app)
 # <---- Instantiate the Plugin -------------------------------------------------------------------
 
 
+# ----- Statements Timing ----------------------------------------------------------------------->
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not sql_statement_executed.receivers:
+        return
+    conn.info.setdefault('jema_statement_start', []).append(time.time())
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('jema_statement_start')
+    if not starts:
+        return
+    duration = time.time() - starts.pop()
+    sql_statement_executed.send(
+        conn.engine, statement=statement, parameters=parameters, duration=duration
+    )
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'handle_error')
+def on_cursor_execute_error(context):
+    if context.connection is None:
+        return
+    starts = context.connection.info.get('jema_statement_start')
+    if starts:
+        starts.pop()
+# <---- Statements Timing ------------------------------------------------------------------------
+
+
 # ----- Define the Models ----------------------------------------------------------------------->
 class AccountQuery(db.Query):
 
     def get(self, id_or_login):
-        if isinstance(id_or_login, basestring):
-            return self.filter(Account.login == id_or_login).first()
-        return db.Query.get(self, id_or_login)
+        kind = 'login' if isinstance(id_or_login, basestring) else 'id'
+        return self._cached(kind, id_or_login, lambda: self._get(id_or_login))
+
+    def _get(self, id_or_login):
+        with read_replica(self.session):
+            if isinstance(id_or_login, basestring):
+                return self.filter(Account.login == id_or_login).first()
+            return db.Query.get(self, id_or_login)
 
     def from_github_token(self, token):
-        return self.filter(Account.access_token == token).first()
+        return self._cached(
+            'token', token, lambda: self.filter(Account.access_token == token).first()
+        )
+
+    def _cached(self, kind, value, loader):
+        # Late import
+        from jema.accountcache import account_cache
+        if not account_cache.enabled or self._criterion is not None:
+            # Filtered queries, ie, a group's accounts, can't be answered from the cache
+            return loader()
+        return account_cache.lookup(self.session, kind, value, loader)
+
+    def keyset_page(self, sort='id', cursor=None, per_page=DEFAULT_PER_PAGE):
+        '''
+        Return a :class:`~jema.pagination.KeysetPage` of accounts sorted by ``id`` or
+        ``login``. Accounts without a login are left out of the ``login`` sorted pages.
+        '''
+        query, columns = self._keyset(sort)
+        with read_replica(self.session):
+            return keyset_page(query, columns, cursor=cursor, per_page=per_page)
+
+    def iter_keyset_pages(self, sort='id', per_page=MAX_PER_PAGE):
+        query, columns = self._keyset(sort)
+        with read_replica(self.session):
+            for page in iter_keyset_pages(query, columns, per_page=per_page):
+                yield page
+
+    def _keyset(self, sort):
+        if sort == 'id':
+            return self, (Account.id,)
+        elif sort == 'login':
+            # pylint: disable=C0121
+            return self.filter(Account.login != None), (Account.login, Account.id)
+        raise ValueError('Unsupported sort key {0!r}'.format(sort))
 
 
 class Account(db.Model):
     __tablename__   = 'accounts'
 
     id              = db.Column(db.Integer, primary_key=True)
-    login           = db.Column(db.String(100),
+    login           = db.Column(db.String(100), index=True,
                                 info={'label': _('Username')})
     name            = db.Column(db.String(100),
                                 info={'label': _('Name')})
@@ -135,9 +363,10 @@ class Group(db.Model):
     __tablename__ = 'groups'
 
     id            = db.Column(db.Integer, primary_key=True)
-    name          = db.Column(db.String(30))
+    name          = db.Column(db.String(30), index=True)
 
     accounts      = db.dynamic_loader('Account', secondary='group_accounts',
+                                      query_class=AccountQuery,
                                       backref=db.backref(
                                           'groups', lazy=True, collection_class=set
                                       ))
@@ -157,14 +386,16 @@ class Group(db.Model):
 group_accounts = db.Table(
     'group_accounts', db.metadata,
     db.Column('group_id', db.Integer, db.ForeignKey('groups.id')),
-    db.Column('account_id', db.Integer, db.ForeignKey('accounts.id'))
+    db.Column('account_id', db.Integer, db.ForeignKey('accounts.id'), index=True),
+    db.PrimaryKeyConstraint('group_id', 'account_id', name='pk_group_accounts')
 )
 
 
 group_privileges = db.Table(
     'group_privileges', db.metadata,
     db.Column('group_id', db.Integer, db.ForeignKey('groups.id')),
-    db.Column('privilege_id', db.Integer, db.ForeignKey('privileges.id'))
+    db.Column('privilege_id', db.Integer, db.ForeignKey('privileges.id')),
+    db.PrimaryKeyConstraint('group_id', 'privilege_id', name='pk_group_privileges')
 )
 
 
@@ -209,20 +440,43 @@ class Privilege(db.Model):
 # Association table
 account_privileges = db.Table(
     'account_privileges', db.metadata,
-    db.Column('account_id', db.Integer, db.ForeignKey('accounts.id'), nullable=False),
-    db.Column('privilege_id', db.Integer, db.ForeignKey('privileges.id'), nullable=False)
+    db.Column('account_id', db.Integer, db.ForeignKey('accounts.id')),
+    db.Column('privilege_id', db.Integer, db.ForeignKey('privileges.id')),
+    db.PrimaryKeyConstraint('account_id', 'privilege_id', name='pk_account_privileges')
 )
 
 
 class JenkinsServerQuery(db.Query):
 
     def get(self, id_or_address):
-        if isinstance(id_or_address, basestring):
-            return self.filter(JenkinsServer.address == id_or_address).first()
-        return db.Query.get(self, id_or_address)
+        with read_replica(self.session):
+            if isinstance(id_or_address, basestring):
+                return self.filter(JenkinsServer.address == id_or_address).first()
+            return db.Query.get(self, id_or_address)
 
     def from_address(self, address):
-        return self.filter(JenkinsServer.address == address).first()
+        with read_replica(self.session):
+            return self.filter(JenkinsServer.address == address).first()
+
+    def from_addresses(self, addresses):
+        '''
+        Return the servers at ``addresses``, by address, in a single query.
+        '''
+        addresses = set(addresses)
+        if not addresses:
+            return {}
+        with read_replica(self.session):
+            return dict(
+                (jenkins_server.address, jenkins_server)
+                for jenkins_server in self.filter(JenkinsServer.address.in_(addresses))
+            )
+
+    def keyset_page(self, cursor=None, per_page=DEFAULT_PER_PAGE):
+        '''
+        Return a :class:`~jema.pagination.KeysetPage` of servers sorted by ``id``.
+        '''
+        with read_replica(self.session):
+            return keyset_page(self, (JenkinsServer.id,), cursor=cursor, per_page=per_page)
 
 
 class JenkinsServer(db.Model):
@@ -247,5 +501,9 @@ class JenkinsServer(db.Model):
 
     @property
     def jenkins_instance(self):
-        return Jenkins(self.address, self.username, self.access_token)
+        # Late import, JenkinsAPI is expensive to import and only needed to talk to Jenkins
+        from jenkinsapi.jenkins import Jenkins
+        with upstream_call('jenkins', 'connect'):
+            return Jenkins(self.address, self.username, self.access_token,
+                           timeout=current_app.config.get('JENKINS_TIMEOUT', 10))
 # <---- Define the Models ------------------------------------------------------------------------
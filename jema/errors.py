@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.errors
+    ~~~~~~~~~~~
+
+    Bounded cost error capture.
+
+    Exceptions are fingerprinted by their type and traceback signature. For each fingerprint
+    only the first ``ERROR_CAPTURE_FULL_PER_WINDOW`` occurrences within a window of
+    ``ERROR_CAPTURE_WINDOW`` seconds get the expensive treatment, a formatted traceback and the
+    serialized request. The remaining ones are only counted, so an error storm does not make
+    each failing request more expensive than it needs to be.
+
+    The aggregated errors are kept in a bounded in-memory ring, per process.
+'''
+
+# Import python libs
+import sys
+import time
+import hashlib
+import logging
+import threading
+import traceback
+from pprint import pformat
+from collections import deque, OrderedDict
+
+# Import JeMa libs
+from jema.signals import application_configured
+
+log = logging.getLogger(__name__)
+
+
+class CapturedError(object):
+    '''
+    The aggregated occurrences of one exception fingerprint.
+    '''
+
+    def __init__(self, fingerprint, exc_type, location, max_samples):
+        self.fingerprint = fingerprint
+        self.exc_type = exc_type
+        self.location = location
+        self.count = 0
+        self.first_seen = self.last_seen = time.time()
+        self.window_start = self.first_seen
+        self.window_count = 0
+        self.samples = deque(maxlen=max_samples)
+
+
+class ErrorCapture(object):
+
+    def __init__(self, app=None):
+        self.errors = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_errors = 100
+        self.max_samples = 10
+        self.full_per_window = 5
+        self.window = 60
+        self.max_details = 32 * 1024
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_errors = app.config.get('ERROR_CAPTURE_MAX_ERRORS', self.max_errors)
+        self.max_samples = app.config.get('ERROR_CAPTURE_SAMPLES', self.max_samples)
+        self.full_per_window = app.config.get(
+            'ERROR_CAPTURE_FULL_PER_WINDOW', self.full_per_window
+        )
+        self.window = app.config.get('ERROR_CAPTURE_WINDOW', self.window)
+        self.max_details = app.config.get('ERROR_CAPTURE_MAX_DETAILS', self.max_details)
+
+    @staticmethod
+    def fingerprint(exc_info):
+        '''
+        Return the ``(fingerprint, location)`` of an exception.
+
+        The fingerprint is built from the exception type and the ``(filename, function, line)``
+        of each traceback frame, leaving out the exception message which usually carries
+        request specific values.
+        '''
+        exc_type, exc_value, exc_tb = exc_info
+        signature = [getattr(exc_type, '__name__', repr(exc_type))]
+        location = None
+        while exc_tb is not None:
+            code = exc_tb.tb_frame.f_code
+            location = '{0}:{1} in {2}'.format(code.co_filename, exc_tb.tb_lineno, code.co_name)
+            signature.append(location)
+            exc_tb = exc_tb.tb_next
+        return hashlib.sha1('\n'.join(signature)).hexdigest()[:16], location
+
+    def truncate(self, text):
+        if len(text) <= self.max_details:
+            return text
+        return '{0}\n... truncated {1} characters ...'.format(
+            text[:self.max_details], len(text) - self.max_details
+        )
+
+    def capture(self, exc_info=None, request=None, user=None):
+        '''
+        Record an occurrence of the exception being handled and return the sample dictionary.
+
+        The sample only includes the formatted ``traceback`` and ``request_details`` while the
+        occurrences of the fingerprint in the current window are below the configured limit.
+        '''
+        if exc_info is None:
+            exc_info = sys.exc_info()
+        fingerprint, location = self.fingerprint(exc_info)
+        now = time.time()
+
+        with self.lock:
+            error = self.errors.pop(fingerprint, None)
+            if error is None:
+                error = CapturedError(
+                    fingerprint, getattr(exc_info[0], '__name__', repr(exc_info[0])),
+                    location, self.max_samples
+                )
+                while len(self.errors) >= self.max_errors:
+                    # Evict the least recently seen error
+                    self.errors.popitem(last=False)
+            # Most recently seen errors go last
+            self.errors[fingerprint] = error
+
+            error.count += 1
+            error.last_seen = now
+            if now - error.window_start > self.window:
+                error.window_start = now
+                error.window_count = 0
+            error.window_count += 1
+            full = error.window_count <= self.full_per_window
+
+        sample = {
+            'time': now,
+            'user': user,
+            'summary': str(exc_info[1]),
+            'method': getattr(request, 'method', None),
+            'url': getattr(request, 'url', None),
+            'fingerprint': fingerprint,
+            'full': full,
+        }
+        if full:
+            sample['traceback'] = self.truncate(''.join(traceback.format_exception(*exc_info)))
+            if request is not None:
+                sample['request_details'] = self.truncate(pformat(request.__dict__))
+        else:
+            log.debug('Error {0} seen {1} times in the last {2} seconds. Not capturing '
+                      'details.'.format(fingerprint, error.window_count, self.window))
+
+        with self.lock:
+            error.samples.append(sample)
+        return sample
+
+    def aggregated(self):
+        '''
+        The captured errors, most recently seen first.
+        '''
+        with self.lock:
+            return list(reversed(self.errors.values()))
+
+
+error_capture = ErrorCapture()
+
+
+@application_configured.connect
+def configure_error_capture(app):
+    error_capture.init_app(app)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.events
+    ~~~~~~~~~~~
+
+    Live jobs and builds state changes, streamed as Server-Sent Events, see
+    :mod:`jema.views.api`.
+
+    A single change feed per process polls the jobs state of the servers someone is subscribed
+    to, see :func:`jema.jenkins.server_jobs`, every ``SSE_POLL_INTERVAL`` seconds, compares it
+    with the previous poll and fans the changed jobs out to the subscribers. Whatever changed
+    between two polls, however often, is sent once, and a subscriber gets all the changes of a
+    poll as a single message. Each change is serialized once and shared by the subscribers.
+
+    Every subscriber has a buffer of ``SSE_CLIENT_BUFFER`` messages. A client too slow to drain
+    it is sent a ``dropped`` event and disconnected, it should reconnect, getting the current
+    state back. Idle streams get a comment every ``SSE_HEARTBEAT`` seconds, so proxies keep
+    them open and disconnected clients are noticed.
+
+    Each stream holds a worker for as long as it's open, serve them with the ``gevent``
+    workers, see :mod:`jema.serving`.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``SSE_POLL_INTERVAL``
+        Seconds between the change feed polls. Defaults to ``JENKINS_STATE_TTL``, or ``15``.
+    ``SSE_HEARTBEAT``
+        Seconds an idle stream waits before sending a heartbeat. Defaults to ``15``.
+    ``SSE_CLIENT_BUFFER``
+        Messages buffered per subscriber before it's dropped. Defaults to ``32``.
+    ``SSE_MAX_CLIENTS``
+        Streams open at once, per process. Defaults to ``1000``.
+    ``SSE_MAX_SUBSCRIPTIONS``
+        Servers and jobs a single stream can subscribe to. Defaults to ``100``.
+'''
+
+# Import python libs
+import json
+import time
+import Queue
+import logging
+import threading
+
+# Import JeMa libs
+from jema.database import JenkinsServer
+from jema.jenkins import JenkinsError, server_jobs
+from jema.signals import process_forked
+
+log = logging.getLogger(__name__)
+
+HEARTBEAT = ': heartbeat\n\n'
+DROPPED = 'event: dropped\ndata: {}\n\n'
+
+
+def format_event(event, data):
+    return 'event: {0}\ndata: {1}\n\n'.format(
+        event, json.dumps(data, separators=(',', ':'), sort_keys=True)
+    )
+
+
+def job_event(server_id, job, fetched_at):
+    return format_event('job', dict(job, server_id=server_id, fetched_at=fetched_at))
+
+
+def removed_job_event(server_id, job_name):
+    return format_event('job', {'server_id': server_id, 'name': job_name, 'removed': True})
+
+
+# ----- Subscribers ----------------------------------------------------------------------------->
+class Subscriber(object):
+    '''
+    A stream's subscription to all the jobs of ``servers`` and to the ``(server_id, job_name)``
+    ``jobs``, buffering up to ``buffer_size`` messages.
+    '''
+
+    __slots__ = ('servers', 'jobs', 'server_ids', 'queue', 'dropped')
+
+    def __init__(self, servers, jobs, buffer_size):
+        self.servers = frozenset(servers)
+        self.jobs = frozenset(jobs)
+        self.server_ids = self.servers.union(server_id for (server_id, _) in self.jobs)
+        self.queue = Queue.Queue(buffer_size)
+        self.dropped = False
+
+    def wants(self, server_id, job_name):
+        return server_id in self.servers or (server_id, job_name) in self.jobs
+
+    def push(self, events):
+        '''
+        Buffer the ``events``, returning ``False`` when the buffer is full.
+        '''
+        try:
+            self.queue.put_nowait(events)
+        except Queue.Full:
+            self.dropped = True
+            return False
+        return True
+# <---- Subscribers ------------------------------------------------------------------------------
+
+
+# ----- Change Feed ----------------------------------------------------------------------------->
+class TooManyClients(Exception):
+    '''
+    Raised when subscribing past ``SSE_MAX_CLIENTS``.
+    '''
+
+
+class ChangeFeed(object):
+    '''
+    Polls the subscribed servers' jobs, in a thread only running while there are subscribers,
+    and fans out what changed.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        # The jobs state, by name, of each polled server, as of the previous poll
+        self.snapshots = {}
+        self.thread = None
+
+    def subscribe(self, app, servers=(), jobs=(), states=None):
+        '''
+        Subscribe to ``servers`` and ``jobs``, see :class:`Subscriber`. ``states`` maps the
+        server ids to the jobs state the subscriber was sent, the changes are then relative to
+        it for servers not already polled.
+        '''
+        subscriber = Subscriber(servers, jobs, app.config.get('SSE_CLIENT_BUFFER', 32))
+        with self.lock:
+            if len(self.subscribers) >= app.config.get('SSE_MAX_CLIENTS', 1000):
+                raise TooManyClients()
+            self.subscribers.add(subscriber)
+            for server_id, state in (states or {}).items():
+                if server_id not in self.snapshots:
+                    self.snapshots[server_id] = dict((job['name'], job) for job in state)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, args=(app,), name='jema-change-feed'
+                )
+                self.thread.daemon = True
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def stream(self, subscriber, initial, heartbeat):
+        '''
+        Yield the ``initial`` events, and then the ``subscriber``'s buffered ones, or a
+        heartbeat when there are none for ``heartbeat`` seconds, until it's dropped or the
+        client disconnects.
+        '''
+        try:
+            yield initial
+            while not subscriber.dropped:
+                try:
+                    events = subscriber.queue.get(timeout=heartbeat)
+                except Queue.Empty:
+                    yield HEARTBEAT
+                    continue
+                if subscriber.dropped:
+                    break
+                yield ''.join(events)
+            yield DROPPED
+        finally:
+            self.unsubscribe(subscriber)
+
+    def reset(self):
+        # The polling thread, and the streams, stay in the parent process
+        with self.lock:
+            self.subscribers.clear()
+            self.snapshots.clear()
+            self.thread = None
+
+    def run(self, app):
+        interval = app.config.get('SSE_POLL_INTERVAL', app.config.get('JENKINS_STATE_TTL', 15))
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    self.snapshots.clear()
+                    return
+                subscribers = list(self.subscribers)
+                server_ids = set()
+                for subscriber in subscribers:
+                    server_ids.update(subscriber.server_ids)
+                for server_id in set(self.snapshots).difference(server_ids):
+                    del self.snapshots[server_id]
+            start = time.time()
+            try:
+                with app.app_context():
+                    self.poll(server_ids, subscribers, interval)
+            except Exception:  # pylint: disable=W0703
+                log.exception('Failed to poll the subscribed Jenkins servers')
+            time.sleep(max(0, interval - (time.time() - start)))
+
+    def poll(self, server_ids, subscribers, max_age):
+        for jenkins_server in JenkinsServer.query.filter(JenkinsServer.id.in_(server_ids)):
+            try:
+                jobs, fetched_at = server_jobs(jenkins_server, max_age=max_age)
+            except JenkinsError as exc:
+                log.warning('Failed to poll %s: %s', jenkins_server.address, exc)
+                continue
+            changes = self.changes(jenkins_server.id, jobs, fetched_at)
+            if changes:
+                self.publish(jenkins_server.id, changes, subscribers)
+
+    def changes(self, server_id, jobs, fetched_at):
+        '''
+        Return the ``(job_name, event)`` of the jobs which changed since the previous poll.
+        '''
+        current = dict((job['name'], job) for job in jobs)
+        previous = self.snapshots.get(server_id)
+        self.snapshots[server_id] = current
+        if previous is None:
+            # Subscribers get the current state when they connect
+            return []
+        changes = [
+            (name, job_event(server_id, job, fetched_at))
+            for (name, job) in sorted(current.items()) if previous.get(name) != job
+        ]
+        changes.extend(
+            (name, removed_job_event(server_id, name))
+            for name in sorted(set(previous).difference(current))
+        )
+        return changes
+
+    def publish(self, server_id, changes, subscribers):
+        dropped = []
+        for subscriber in subscribers:
+            events = tuple(event for (name, event) in changes if subscriber.wants(server_id, name))
+            if events and not subscriber.push(events):
+                dropped.append(subscriber)
+        if dropped:
+            log.info('Dropping %d slow change feed subscriber(s)', len(dropped))
+            with self.lock:
+                self.subscribers.difference_update(dropped)
+
+
+change_feed = ChangeFeed()
+
+
+@process_forked.connect
+def reset_change_feed(app):
+    change_feed.reset()
+# <---- Change Feed ------------------------------------------------------------------------------
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.fakegithub
+    ~~~~~~~~~~~~~~~
+
+    A stand-in for GitHub's OAuth web flow and user API, to load test the sign-in offline.
+
+    :class:`FakeGitHub` is a WSGI application implementing:
+
+    ``GET /login/oauth/authorize``
+        Signs one of its users in and redirects back to ``redirect_uri`` with a code and the
+        ``state``. The user is picked at random, unless a ``login`` argument names one.
+    ``POST /login/oauth/access_token``
+        Exchanges a code, once, for the user's access token, as JSON.
+    ``GET /user``
+        The user owning the ``Authorization: token <token>`` header.
+
+    Each answer takes ``latency`` seconds, plus up to ``jitter`` more. Its ``users`` users are
+    ``user-1``, ``user-2``, and so on, with ids counting from ``first_id``. Their tokens are
+    the same on every sign-in, like GitHub's, unless ``rotate_tokens`` is set.
+
+    Point JeMa to it with::
+
+        GITHUB_BASE_URL = 'http://127.0.0.1:5001'
+        GITHUB_API_URL = 'http://127.0.0.1:5001'
+
+    Usage::
+
+        python -m jema.fakegithub --port 5001 --users 10000 --latency 0.1
+'''
+
+# Import python libs
+from __future__ import print_function
+import json
+import time
+import random
+import urllib
+import argparse
+import threading
+from uuid import uuid4
+from urlparse import urlparse, urlunparse, parse_qsl
+from collections import defaultdict
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+# Import 3rd-party libs
+from werkzeug.wrappers import Request, Response
+
+
+class FakeGitHub(object):
+
+    def __init__(self, users=1000, latency=0.0, jitter=0.0, first_id=1000000,
+                 rotate_tokens=False):
+        self.users = users
+        self.latency = latency
+        self.jitter = jitter
+        self.first_id = first_id
+        self.rotate_tokens = rotate_tokens
+        self.lock = threading.Lock()
+        # Pending codes and issued tokens, both mapping to user numbers
+        self.codes = {}
+        self.tokens = {}
+        self.requests = defaultdict(int)
+
+    def user(self, number):
+        login = 'user-{0}'.format(number)
+        return {
+            'id': self.first_id + number,
+            'login': login,
+            'name': 'User {0}'.format(number),
+            'email': '{0}@example.com'.format(login),
+            'avatar_url': 'https://avatars.example.com/u/{0}'.format(self.first_id + number),
+            'type': 'User',
+            'site_admin': False
+        }
+
+    def token_for(self, number):
+        if self.rotate_tokens:
+            return uuid4().hex
+        return 'fake-token-{0}'.format(self.first_id + number)
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        with self.lock:
+            self.requests[request.path] += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        handler = {
+            '/login/oauth/authorize': self.authorize,
+            '/login/oauth/access_token': self.access_token,
+            '/user': self.get_user
+        }.get(request.path)
+        if handler is None:
+            response = self.json({'message': 'Not Found'}, 404)
+        else:
+            response = handler(request)
+        return response(environ, start_response)
+
+    @staticmethod
+    def json(data, status=200):
+        return Response(json.dumps(data), status=status, mimetype='application/json')
+
+    def authorize(self, request):
+        redirect_uri = request.args.get('redirect_uri')
+        if not redirect_uri:
+            return self.json({'message': 'Missing redirect_uri'}, 400)
+        login = request.args.get('login')
+        if login is not None:
+            try:
+                number = int(login.rsplit('-', 1)[-1])
+            except ValueError:
+                number = 0
+            if not 1 <= number <= self.users:
+                return self.json({'message': 'Unknown login {0!r}'.format(login)}, 404)
+        else:
+            number = random.randint(1, self.users)
+        code = uuid4().hex
+        with self.lock:
+            self.codes[code] = number
+
+        url = urlparse(redirect_uri)
+        query = parse_qsl(url.query) + [('code', code)]
+        if 'state' in request.args:
+            query.append(('state', request.args['state']))
+        response = Response(status=302)
+        response.headers['Location'] = urlunparse(url._replace(query=urllib.urlencode(query)))
+        return response
+
+    def access_token(self, request):
+        code = request.values.get('code')
+        with self.lock:
+            number = self.codes.pop(code, None)
+            if number is not None:
+                token = self.token_for(number)
+                self.tokens[token] = number
+        if number is None:
+            # Like GitHub, errors are answered with a 200
+            return self.json({
+                'error': 'bad_verification_code',
+                'error_description': 'The code passed is incorrect or expired.'
+            })
+        return self.json({'access_token': token, 'token_type': 'bearer', 'scope': 'user:email'})
+
+    def get_user(self, request):
+        authorization = request.headers.get('Authorization', '')
+        scheme, _, token = authorization.partition(' ')
+        with self.lock:
+            number = self.tokens.get(token) if scheme.lower() in ('token', 'bearer') else None
+        if number is None and not self.rotate_tokens and token.startswith('fake-token-'):
+            # Tokens are stable, still valid after a restart
+            try:
+                number = int(token.rsplit('-', 1)[-1]) - self.first_id
+            except ValueError:
+                pass
+            else:
+                if not 1 <= number <= self.users:
+                    number = None
+        if number is None:
+            return self.json({'message': 'Bad credentials'}, 401)
+        return self.json(self.user(number))
+
+
+# ----- Serving --------------------------------------------------------------------------------->
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def make_fake_github_server(host='127.0.0.1', port=0, quiet=True, **kwargs):
+    '''
+    A threaded server of a :class:`FakeGitHub` built with ``kwargs``, its ``application``
+    attribute. Port ``0`` picks a free one, see its ``server_port``.
+    '''
+    return make_server(
+        host, port, FakeGitHub(**kwargs), server_class=ThreadingWSGIServer,
+        handler_class=QuietHandler if quiet else WSGIRequestHandler
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake GitHub OAuth and user API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds each answer takes')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to how many more seconds each answer takes, at random')
+    parser.add_argument('--first-id', type=int, default=1000000)
+    parser.add_argument('--rotate-tokens', action='store_true',
+                        help='Grant a new token on every sign-in')
+    options = parser.parse_args()
+
+    server = make_fake_github_server(
+        options.host, options.port, quiet=False, users=options.users, latency=options.latency,
+        jitter=options.jitter, first_id=options.first_id, rotate_tokens=options.rotate_tokens
+    )
+    print('Fake GitHub listening on http://{0}:{1}'.format(options.host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+# <---- Serving ----------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.fastpath
+    ~~~~~~~~~~~~~
+
+    Lightweight request handling.
+
+    Requests routed to endpoints registered here, static files, health checks, metrics and the
+    machine API, skip identity loading, redirect target tracking and session writes.
+
+    The fast path can be turned off by setting ``FASTPATH_ENABLED = False`` in
+    ``jemaappconfig``.
+'''
+
+# Import Flask libs & plugins
+from flask import current_app, request
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.exceptions import HTTPException
+
+# ----- Endpoint Kinds -------------------------------------------------------------------------->
+STATIC = 'static'
+HEALTH = 'health'
+METRICS = 'metrics'
+API = 'api'
+# <---- Endpoint Kinds ---------------------------------------------------------------------------
+
+
+# ----- Registry -------------------------------------------------------------------------------->
+class LightweightEndpoints(object):
+    '''
+    Registry of the endpoints, or whole blueprints, which are served through the fast path.
+    '''
+
+    def __init__(self):
+        self.endpoints = {}
+        self.blueprints = {}
+
+    def register_endpoint(self, endpoint, kind):
+        self.endpoints[endpoint] = kind
+
+    def register_blueprint(self, blueprint, kind):
+        self.blueprints[getattr(blueprint, 'name', blueprint)] = kind
+
+    def kind_of(self, endpoint):
+        if endpoint is None:
+            return None
+        kind = self.endpoints.get(endpoint)
+        if kind is None and '.' in endpoint:
+            kind = self.blueprints.get(endpoint.rsplit('.', 1)[0])
+        return kind
+
+    def request_kind(self, req=None):
+        '''
+        Return the kind of the current request's endpoint or ``None`` if it's not lightweight.
+        '''
+        if req is None:
+            req = request
+        if not current_app.config.get('FASTPATH_ENABLED', True):
+            return None
+        rule = req.url_rule
+        if rule is None:
+            return self.kind_of(self.match_endpoint(req))
+        return self.kind_of(rule.endpoint)
+
+    @staticmethod
+    def match_endpoint(req):
+        '''
+        Match the request's endpoint when Flask hasn't yet. Flask 1.1 opens the session before
+        matching the request, a lightweight request would otherwise still load it.
+        '''
+        if req.routing_exception is not None:
+            # Already matched, without success
+            return None
+        endpoint = req.environ.get('jema.fastpath.endpoint', False)
+        if endpoint is False:
+            adapter = current_app.create_url_adapter(req)
+            try:
+                endpoint = adapter.match(return_rule=True)[0].endpoint if adapter else None
+            except HTTPException:
+                endpoint = None
+            req.environ['jema.fastpath.endpoint'] = endpoint
+        return endpoint
+
+    def is_lightweight_request(self, req=None):
+        return self.request_kind(req) is not None
+
+
+lightweight_endpoints = LightweightEndpoints()
+lightweight_endpoints.register_endpoint('static', STATIC)
+
+is_lightweight_request = lightweight_endpoints.is_lightweight_request
+# <---- Registry ---------------------------------------------------------------------------------
+
+
+# ----- Session Support ------------------------------------------------------------------------->
+class FastPathSessionMixin(object):
+    '''
+    Session interface mixin which neither loads nor saves sessions for lightweight requests.
+
+    Lightweight requests get an empty session, so code writing to it keeps working, though
+    nothing is ever sent back to the browser.
+    '''
+
+    def open_session(self, app, req):
+        if is_lightweight_request(req):
+            return self.session_class()
+        return super(FastPathSessionMixin, self).open_session(app, req)
+
+    def save_session(self, app, session, response):
+        if is_lightweight_request():
+            return
+        return super(FastPathSessionMixin, self).save_session(app, session, response)
+
+
+class FastPathSessionInterface(FastPathSessionMixin, SecureCookieSessionInterface):
+    pass
+# <---- Session Support --------------------------------------------------------------------------
@@ -16,7 +16,6 @@ import logging
 from datetime import datetime
 
 # Import 3rd-party libs
-import pytz
 from wtforms import *
 from wtforms.fields import *
 from wtforms.validators import *
@@ -27,7 +26,6 @@ from wtforms.fields import SubmitField as BaseSubmitField
 from wtforms_alchemy import model_form_factory
 #from wtforms_alchemy import *
 
-from babel.dates import get_timezone_name
 from werkzeug.datastructures import MultiDict
 from jinja2 import Markup
 from flask_wtf import Form
@@ -50,6 +48,8 @@ log = logging.getLogger(__name__)
 
 @cache.memoize(3600)
 def build_timezones():
+    # Late import, only the profile form needs the timezones
+    import pytz
     tzs = set()
     now = datetime.now()
     for tz_name in pytz.common_timezones:
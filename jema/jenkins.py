@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.jenkins
+    ~~~~~~~~~~~~
+
+    Jobs and builds state, read from Jenkins' JSON API.
+
+    Unlike :attr:`~jema.database.JenkinsServer.jenkins_instance`, which loads a whole
+    :class:`jenkinsapi.jenkins.Jenkins` object, the state is fetched with a single request per
+    server, for all its jobs and their last build, or per job, for all its builds, asking only
+    for the attributes used, through a per-process, keep-alive, HTTP session.
+
+    The fetched state is kept in the cache, along with when it was fetched, and served from it
+    for ``JENKINS_STATE_TTL`` seconds.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``JENKINS_STATE_TTL``
+        Seconds the jobs and builds fetched from a server are served from the cache. Defaults
+        to ``15``.
+    ``JENKINS_TIMEOUT``
+        Seconds to wait for Jenkins. Defaults to ``10``.
+'''
+
+# Import python libs
+import time
+import urllib
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+
+# Import Flask libs & plugins
+from flask import current_app
+
+# Import JeMa libs
+from jema.application import cache
+from jema.database import upstream_call
+from jema.signals import process_forked
+
+log = logging.getLogger(__name__)
+
+KEY_PREFIX = 'jenkins:'
+# How long the fetched state is kept, past its time to live, it's then only served when asked
+# for stale state
+STATE_RETENTION = 3600
+
+BUILD_ATTRIBUTES = 'number,result,building,timestamp,duration,url'
+JOBS_TREE = 'jobs[name,url,color,lastBuild[{0}]]'.format(BUILD_ATTRIBUTES)
+BUILDS_TREE = 'allBuilds[{0}]'.format(BUILD_ATTRIBUTES)
+
+# Jenkins' ball colors, ``_anime`` suffixed while building
+COLOR_STATUS = {
+    'blue': 'success',
+    'green': 'success',
+    'red': 'failure',
+    'yellow': 'unstable',
+    'aborted': 'aborted',
+    'notbuilt': 'not_built',
+    'disabled': 'disabled',
+    'grey': 'pending',
+}
+
+
+class JenkinsError(Exception):
+    '''
+    Raised when Jenkins can't be reached or answers with an error.
+    '''
+
+
+# ----- HTTP Session ---------------------------------------------------------------------------->
+_http_session = None
+
+
+def http_session():
+    global _http_session  # pylint: disable=W0603
+    if _http_session is None:
+        # Late import, requests is only needed to talk to Jenkins
+        import requests
+        _http_session = requests.Session()
+    return _http_session
+
+
+@process_forked.connect
+def reset_http_session(app):
+    global _http_session  # pylint: disable=W0603
+    # The connections were opened by the parent process
+    _http_session = None
+
+
+def jenkins_get(server, path, operation, **params):
+    '''
+    GET ``path`` from the ``server``'s JSON API, ``None`` when it's not found.
+    '''
+    # Late import, see http_session()
+    import requests
+    url = '{0}{1}/api/json'.format(server.address.rstrip('/'), path)
+    try:
+        with upstream_call('jenkins', operation):
+            response = http_session().get(
+                url, params=params, auth=(server.username, server.access_token),
+                timeout=current_app.config.get('JENKINS_TIMEOUT', 10)
+            )
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+    except (requests.RequestException, ValueError) as exc:
+        raise JenkinsError('Failed to read {0}: {1}'.format(url, exc))
+# <---- HTTP Session -----------------------------------------------------------------------------
+
+
+# ----- State ----------------------------------------------------------------------------------->
+def build_state(data):
+    if not data:
+        return None
+    return {
+        'number': data.get('number'),
+        'result': data['result'].lower() if data.get('result') else None,
+        'building': bool(data.get('building')),
+        # Jenkins counts in milliseconds
+        'timestamp': data['timestamp'] / 1000.0 if data.get('timestamp') else None,
+        'duration': data['duration'] / 1000.0 if data.get('duration') else None,
+        'url': data.get('url')
+    }
+
+
+def job_state(data):
+    color = data.get('color') or 'grey'
+    building = color.endswith('_anime')
+    return {
+        'name': data['name'],
+        'url': data.get('url'),
+        'status': COLOR_STATUS.get(color.replace('_anime', ''), 'unknown'),
+        'building': building,
+        'last_build': build_state(data.get('lastBuild'))
+    }
+
+
+def job_path(job_name):
+    return '/job/{0}'.format(urllib.quote(job_name.encode('utf-8'), safe=''))
+
+
+def fetch_jobs(server):
+    '''
+    All the jobs of the ``server``, sorted by name, with their last build.
+    '''
+    data = jenkins_get(server, '', 'jobs', tree=JOBS_TREE)
+    if data is None:
+        raise JenkinsError('{0} is not a Jenkins server'.format(server.address))
+    return sorted((job_state(job) for job in data.get('jobs', ())), key=lambda job: job['name'])
+
+
+def fetch_builds(server, job_name):
+    '''
+    All the builds of the ``server``'s ``job_name``, most recent first, ``None`` if there's no
+    such job.
+    '''
+    data = jenkins_get(server, job_path(job_name), 'builds', tree=BUILDS_TREE)
+    if data is None:
+        return None
+    return sorted(
+        (build_state(build) for build in data.get('allBuilds', ())),
+        key=lambda build: build['number'], reverse=True
+    )
+# <---- State ------------------------------------------------------------------------------------
+
+
+# ----- Cached State ---------------------------------------------------------------------------->
+def state_key(kind, *parts):
+    digest = hashlib.sha1(u'\0'.join(unicode(part) for part in parts).encode('utf-8'))
+    return '{0}{1}:{2}'.format(KEY_PREFIX, kind, digest.hexdigest())
+
+
+def peek_state(key):
+    '''
+    Return the cached ``(state, fetched_at)``, however old, ``None`` if there's none.
+    '''
+    try:
+        return cache.get(key)
+    except Exception:  # pylint: disable=W0703
+        log.exception('Failed to read the Jenkins state from the cache')
+        return None
+
+
+def cached_state(key, fetch, max_age=None):
+    '''
+    Return ``(state, fetched_at)``, from the cache unless it's older than ``max_age`` seconds,
+    ``JENKINS_STATE_TTL`` by default, in which case ``fetch()`` is called and cached.
+    '''
+    if max_age is None:
+        max_age = current_app.config.get('JENKINS_STATE_TTL', 15)
+    cached = peek_state(key)
+    if cached is not None and time.time() - cached[1] <= max_age:
+        return cached
+
+    state = (fetch(), time.time())
+    try:
+        cache.set(key, state, timeout=max_age + STATE_RETENTION)
+    except Exception:  # pylint: disable=W0703
+        log.exception('Failed to write the Jenkins state to the cache')
+    return state
+
+
+def server_jobs_key(server):
+    return state_key('jobs', server.id, server.address)
+
+
+def server_jobs(server, max_age=None):
+    '''
+    ``(jobs, fetched_at)`` of the ``server``, see :func:`fetch_jobs`.
+    '''
+    return cached_state(server_jobs_key(server), lambda: fetch_jobs(server), max_age)
+
+
+def many_server_jobs(servers, concurrency=8):
+    '''
+    Return, by server id, the ``(jobs, fetched_at, error)`` of each of the ``servers``.
+
+    The fresh ones are read from the cache, the stale ones fetched concurrently, ``concurrency``
+    at a time. When fetching fails, ``error`` says why and the jobs are the cached ones, however
+    old, or ``None``.
+    '''
+    max_age = current_app.config.get('JENKINS_STATE_TTL', 15)
+    results, stale = {}, []
+    for server in servers:
+        cached = peek_state(server_jobs_key(server))
+        if cached is not None and time.time() - cached[1] <= max_age:
+            results[server.id] = (cached[0], cached[1], None)
+        else:
+            stale.append((server, cached))
+    if not stale:
+        return results
+
+    app = current_app._get_current_object()
+
+    def fetch(item):
+        server, cached = item
+        with app.app_context():
+            try:
+                jobs, fetched_at = server_jobs(server, max_age)
+            except JenkinsError as exc:
+                log.warning('Failed to fetch the jobs of %s: %s', server.address, exc)
+                if cached is None:
+                    return server.id, (None, None, str(exc))
+                return server.id, (cached[0], cached[1], str(exc))
+            return server.id, (jobs, fetched_at, None)
+
+    pool = ThreadPool(min(concurrency, len(stale)))
+    try:
+        # Gives the request's database connection back while waiting
+        with upstream_call('jenkins', 'many_jobs'):
+            results.update(pool.map(fetch, stale))
+    finally:
+        pool.close()
+    return results
+
+
+def job_builds(server, job_name, max_age=None):
+    '''
+    ``(builds, fetched_at)`` of the ``server``'s ``job_name``, see :func:`fetch_builds`.
+    '''
+    return cached_state(
+        state_key('builds', server.id, server.address, job_name),
+        lambda: fetch_builds(server, job_name), max_age
+    )
+# <---- Cached State -----------------------------------------------------------------------------
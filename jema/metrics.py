@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.metrics
+    ~~~~~~~~~~~~
+
+    Application metrics, exposed in the Prometheus text format.
+
+    Records the request latency per endpoint, the number of SQL statements and the time spent
+    on them per request, the outbound GitHub and Jenkins calls timings and the cache hit and
+    miss counts.
+
+    Enable it by setting ``METRICS_ENABLED = True`` in ``jemaappconfig``, the metrics are then
+    served at ``/metrics``. The metrics are kept per process, scrape each worker, or a single
+    worker deployment, accordingly.
+'''
+
+# Import python libs
+import time
+import threading
+from contextlib import contextmanager
+
+# Import Flask libs & plugins
+from flask import g, has_request_context, request
+
+# Import JeMa libs
+from jema.signals import application_configured, sql_statement_executed
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENTS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+# ----- Metric Types ---------------------------------------------------------------------------->
+def _escape(value):
+    return unicode(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return u'{{{0}}}'.format(
+        u','.join(u'{0}="{1}"'.format(name, _escape(value)) for (name, value) in pairs)
+    )
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+
+    type_ = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self):
+        lines = [
+            u'# HELP {0} {1}'.format(self.name, self.documentation),
+            u'# TYPE {0} {1}'.format(self.name, self.type_)
+        ]
+        with self.lock:
+            for labelvalues in sorted(self.values):
+                lines.extend(self.render_sample(labelvalues, self.values[labelvalues]))
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+
+    type_ = 'counter'
+
+    def inc(self, *labelvalues, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render_sample(self, labelvalues, value):
+        return [u'{0}{1} {2}'.format(
+            self.name, _format_labels(self.labelnames, labelvalues), _format_value(value)
+        )]
+
+
+class Histogram(Metric):
+
+    type_ = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            entry = self.values.get(labelvalues)
+            if entry is None:
+                entry = self.values[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render_sample(self, labelvalues, entry):
+        counts, total, count = entry
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(u'{0}_bucket{1} {2}'.format(
+                self.name,
+                _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))]),
+                cumulative
+            ))
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(u'{0}_sum{1} {2}'.format(self.name, labels, _format_value(total)))
+        lines.append(u'{0}_count{1} {2}'.format(self.name, labels, count))
+        return lines
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return u'\n'.join(lines) + u'\n'
+
+
+registry = MetricsRegistry()
+# <---- Metric Types -----------------------------------------------------------------------------
+
+
+# ----- JeMa Metrics ---------------------------------------------------------------------------->
+request_duration = registry.histogram(
+    'jema_http_request_duration_seconds', 'HTTP request latency.', ('endpoint', 'method')
+)
+requests_total = registry.counter(
+    'jema_http_requests_total', 'HTTP requests served.', ('endpoint', 'method', 'status')
+)
+request_statements = registry.histogram(
+    'jema_db_statements_per_request', 'SQL statements executed per HTTP request.',
+    ('endpoint',), buckets=STATEMENTS_BUCKETS
+)
+request_statements_duration = registry.histogram(
+    'jema_db_time_per_request_seconds', 'Time spent executing SQL statements per HTTP request.',
+    ('endpoint',)
+)
+statements_duration = registry.histogram(
+    'jema_db_statement_duration_seconds', 'SQL statement latency.'
+)
+outbound_duration = registry.histogram(
+    'jema_outbound_request_duration_seconds', 'Outbound calls latency.',
+    ('service', 'operation', 'outcome')
+)
+cache_requests = registry.counter(
+    'jema_cache_requests_total', 'Cache lookups.', ('cache', 'result')
+)
+
+
+@contextmanager
+def timed_call(service, operation):
+    '''
+    Time an outbound call, ie::
+
+        with timed_call('github', 'access_token'):
+            conn.request(...)
+    '''
+    outcome = 'error'
+    start = time.time()
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        outbound_duration.observe(time.time() - start, service, operation, outcome)
+
+
+class InstrumentedCache(object):
+    '''
+    Proxy to a cache backend which counts the hits and misses of the lookups.
+    '''
+
+    def __init__(self, backend, name='default'):
+        self.backend = backend
+        self.name = name
+
+    def get(self, key):
+        value = self.backend.get(key)
+        cache_requests.inc(self.name, 'miss' if value is None else 'hit')
+        return value
+
+    def get_many(self, *keys):
+        values = self.backend.get_many(*keys)
+        hits = len([value for value in values if value is not None])
+        if hits:
+            cache_requests.inc(self.name, 'hit', amount=hits)
+        if len(values) - hits:
+            cache_requests.inc(self.name, 'miss', amount=len(values) - hits)
+        return values
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+# <---- JeMa Metrics -----------------------------------------------------------------------------
+
+
+# ----- Request Hooks --------------------------------------------------------------------------->
+def on_request_started():
+    g._metrics_request_start = time.time()
+    g._metrics_statements = 0
+    g._metrics_statements_duration = 0.0
+
+
+def on_request_teardown(exc):
+    start = getattr(g, '_metrics_request_start', None)
+    if start is None:
+        return
+    endpoint = request.endpoint or '<unmatched>'
+    request_duration.observe(time.time() - start, endpoint, request.method)
+    request_statements.observe(g._metrics_statements, endpoint)
+    request_statements_duration.observe(g._metrics_statements_duration, endpoint)
+
+
+def on_response(response):
+    requests_total.inc(request.endpoint or '<unmatched>', request.method, response.status_code)
+    return response
+
+
+def on_statement_executed(engine, statement, parameters, duration):
+    statements_duration.observe(duration)
+    if has_request_context() and hasattr(g, '_metrics_statements'):
+        g._metrics_statements += 1
+        g._metrics_statements_duration += duration
+
+
+@application_configured.connect
+def configure_metrics(app):
+    if not app.config.get('METRICS_ENABLED', False):
+        return
+    app.before_request_funcs.setdefault(None, []).insert(0, on_request_started)
+    app.after_request(on_response)
+    app.teardown_request(on_request_teardown)
+    sql_statement_executed.connect(on_statement_executed)
+
+    # Count the cache hits and misses of every configured Flask-Cache instance
+    backends = app.extensions.get('cache', {})
+    for cache_instance in list(backends):
+        if not isinstance(backends[cache_instance], InstrumentedCache):
+            backends[cache_instance] = InstrumentedCache(backends[cache_instance])
+    app.extensions['metrics'] = registry
+# <---- Request Hooks ----------------------------------------------------------------------------
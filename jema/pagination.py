@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.pagination
+    ~~~~~~~~~~~~~~~
+
+    Keyset pagination.
+
+    Instead of skipping ``OFFSET`` rows, each page continues from the sort key values of the
+    last row of the previous page, carried by an opaque cursor. With an index on the sort
+    columns every page costs the same, be it the first or the ten thousandth.
+'''
+
+# Import python libs
+import json
+import base64
+import binascii
+
+# Import 3rd-party libs
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+class InvalidCursor(ValueError):
+    '''
+    Raised when a pagination cursor can't be decoded.
+    '''
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values), separators=(',', ':')).encode('utf-8'))
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise InvalidCursor('Invalid pagination cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Invalid pagination cursor')
+    return values
+
+
+class KeysetPage(object):
+
+    def __init__(self, items, next_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_page(query, columns, cursor=None, per_page=DEFAULT_PER_PAGE):
+    '''
+    Return the :class:`KeysetPage` of ``query`` following ``cursor``, sorted by ``columns``.
+
+    The last of the ``columns`` must be unique, usually the primary key, so that the sort
+    order is total.
+    '''
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    if cursor:
+        values = decode_cursor(cursor, len(columns))
+        # (a, b) > (x, y) spelled as ``a > x OR (a = x AND b > y)``, row values comparisons
+        # aren't supported everywhere
+        clauses = []
+        for idx, column in enumerate(columns):
+            clauses.append(and_(*(
+                [previous == values[pidx] for pidx, previous in enumerate(columns[:idx])] +
+                [column > values[idx]]
+            )))
+        query = query.filter(or_(*clauses))
+
+    # Fetch an extra row to know if there's a next page
+    items = query.order_by(None).order_by(*columns).limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(getattr(items[-1], column.key) for column in columns)
+    return KeysetPage(items, next_cursor, per_page)
+
+
+def sequence_page(items, key, cursor=None, per_page=DEFAULT_PER_PAGE, descending=False):
+    '''
+    Like :func:`keyset_page`, for a sequence already sorted by the unique ``key`` of its items,
+    ie, state fetched from an upstream service.
+    '''
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    if cursor:
+        value = decode_cursor(cursor, 1)[0]
+        if descending:
+            items = [item for item in items if item[key] < value]
+        else:
+            items = [item for item in items if item[key] > value]
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor([items[-1][key]])
+    return KeysetPage(list(items), next_cursor, per_page)
+
+
+def iter_keyset_pages(query, columns, per_page=MAX_PER_PAGE, cursor=None):
+    '''
+    Iterate through all the pages of ``query``, ie, for exports.
+    '''
+    while True:
+        page = keyset_page(query, columns, cursor=cursor, per_page=per_page)
+        yield page
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
@@ -16,12 +16,13 @@
 import logging
 
 # Import 3rd-party Libs
-import github
 # pylint: disable=E0611,F0401
+from flask import g
 from flask_principal import (AnonymousIdentity, Identity, Permission, Principal, RoleNeed,
                              TypeNeed, identity_changed, identity_loaded, ActionNeed)
 # pylint: enable=E0611,F0401
 from sqlalchemy.exc import OperationalError
+from jema.fastpath import is_lightweight_request
 from jema.signals import after_identity_account_loaded, application_configured
 
 log = logging.getLogger(__name__)
@@ -86,12 +87,27 @@ for key, value in locals().copy().items():
 
 
 # ----- Instantiate Principal ------------------------------------------------------------------->
-principal = Principal(use_sessions=True, skip_static=False)
+class FastPathPrincipal(Principal):
+    '''
+    Principal which does not load identities for lightweight requests, see :mod:`jema.fastpath`.
+    '''
+
+    def _on_before_request(self):
+        if is_lightweight_request():
+            g.identity = AnonymousIdentity()
+            return
+        return Principal._on_before_request(self)
+
+    def _is_static_route(self):
+        return is_lightweight_request() or Principal._is_static_route(self)
+
+
+principal = FastPathPrincipal(use_sessions=True, skip_static=False)
 
 
 @application_configured.connect
 def on_application_configured(app):
-    from jema.database import db, Account
+    from jema.database import db, Account, read_replica
 
     # Finalize principal configuration
     principal.init_app(app)
@@ -108,18 +124,21 @@ def on_application_configured(app):
             identity.account = account = Account.query.get(int(identity.id))
             if account is not None:
                 log.debug('User {0!r} loaded from identity {1}'.format(account.login, identity))
-                account.update_last_login()
                 identity.provides.add(TypeNeed('authenticated'))
-                # Update the privileges that a user has
-                for privilege in account.privileges:
-                    identity.provides.add(ActionNeed(privilege.name))
-                for group in account.groups:
-                    # And for each of the groups the user belongs to
-                    for privilege in group.privileges:
-                        if privilege.name in __BUILT_IN_PERMISSIONS:
-                            for role in __BUILT_IN_PERMISSIONS[privilege.name]:
-                                identity.provides.add(role)
-                        identity.provides.add(RoleNeed(privilege.name))
+                with read_replica():
+                    # Update the privileges that a user has
+                    for privilege in account.privileges:
+                        identity.provides.add(ActionNeed(privilege.name))
+                    for group in account.groups:
+                        # And for each of the groups the user belongs to
+                        for privilege in group.privileges:
+                            if privilege.name in __BUILT_IN_PERMISSIONS:
+                                for role in __BUILT_IN_PERMISSIONS[privilege.name]:
+                                    identity.provides.add(role)
+                            identity.provides.add(RoleNeed(privilege.name))
+                # Only write once all the reads are done, a flush pins the session to the
+                # primary database
+                account.update_last_login()
 
                 # Setup this user's github api access
                 # identity.github = github.Github(
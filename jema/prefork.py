@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.prefork
+    ~~~~~~~~~~~~
+
+    Prefork servers support.
+
+    :func:`preload_app` runs in the master process, before the workers are forked. It imports
+    the modules otherwise loaded on first use, compiles the templates, loads the translations
+    catalogs and builds the timezones list, so the workers share all of that, copy-on-write,
+    and serve their first requests as fast as the following ones.
+
+    :func:`reset_after_fork` runs in each worker right after it's forked. It sends the
+    :data:`~jema.signals.process_forked` signal for the plugins to drop what can't be shared
+    between processes, ie, the database connections pools.
+'''
+
+# Import python libs
+import gc
+import time
+import logging
+import importlib
+
+# Import Flask libs & plugins
+from flask import current_app, request
+from flask_babel import get_locale, support
+
+# Import 3rd-party libs
+import sqlalchemy
+
+# Import JeMa libs
+from jema.database import dispose_engines
+from jema.fastpath import is_lightweight_request
+from jema.signals import process_forked
+from jema.templating import precompile_templates
+
+log = logging.getLogger(__name__)
+
+# Modules only imported on first use, see benchmarks/import_time.py
+PRELOAD_MODULES = (
+    'github',
+    'jenkinsapi.jenkins',
+    'requests',
+    'jema.forms',
+)
+
+
+# ----- Translations ---------------------------------------------------------------------------->
+def load_translations(babel, locale):
+    '''
+    Load the ``locale`` catalogs the way Flask-Babel does on each request.
+    '''
+    translations = support.Translations()
+    for dirname in babel.translation_directories:
+        catalog = support.Translations.load(dirname, [locale], babel.domain)
+        translations.merge(catalog)
+        if hasattr(catalog, 'plural'):
+            translations.plural = catalog.plural
+    return translations
+
+
+def install_translations():
+    '''
+    Hand the preloaded catalogs to Flask-Babel, which otherwise reads them from disk on every
+    request.
+    '''
+    if is_lightweight_request():
+        return
+    translations = current_app.extensions['jema_translations'].get(str(get_locale()))
+    if translations is not None:
+        # Where Flask-Babel caches the request's translations
+        request.babel_translations = translations
+# <---- Translations -----------------------------------------------------------------------------
+
+
+def preload_app(app):
+    '''
+    Load, once, everything the workers would otherwise load on their first requests.
+    '''
+    timings = []
+
+    def timed(step, func, *args):
+        start = time.time()
+        result = func(*args)
+        timings.append('{0} {1:.0f}ms'.format(step, (time.time() - start) * 1000))
+        return result
+
+    def import_modules():
+        for name in PRELOAD_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError as exc:
+                log.warning('Failed to preload {0}: {1}'.format(name, exc))
+        # Late import
+        from jema.views.account import get_profile_form_class
+        get_profile_form_class()
+        sqlalchemy.orm.configure_mappers()
+
+    def translations():
+        babel = app.extensions['babel']
+        catalogs = dict(
+            (str(locale), load_translations(babel, locale))
+            for locale in babel.list_translations() + [babel.default_locale]
+        )
+        if 'jema_translations' not in app.extensions:
+            app.before_request(install_translations)
+        app.extensions['jema_translations'] = catalogs
+        return catalogs
+
+    def timezones():
+        # Late import
+        from jema.forms import build_timezones
+        return build_timezones()
+
+    with app.app_context():
+        timed('imports', import_modules)
+        timed('templates', precompile_templates, app)
+        timed('translations', translations)
+        timed('timezones', timezones)
+        # Preloading shouldn't have used the database, still, no connection may be inherited
+        dispose_engines(app)
+
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        # Python >= 3.7, keep the collector from touching, and thus copying, the preloaded
+        # objects in the workers
+        gc.freeze()
+    log.info('Preloaded the application: {0}'.format(', '.join(timings)))
+
+
+def reset_after_fork(app):
+    '''
+    To be called in each worker process right after it's forked, ie, from gunicorn's
+    ``post_fork`` hook, see :mod:`jema.wsgi`.
+    '''
+    process_forked.send(app)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.profiler
+    ~~~~~~~~~~~~~
+
+    Sampled request profiling.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``PROFILER_ENABLED``
+        Wrap the WSGI application with the sampling profiler. Defaults to ``False``.
+    ``PROFILER_SAMPLE_RATE``
+        The fraction of requests to profile. Defaults to ``0.01``.
+    ``PROFILER_DUMP_DIR``
+        When set, each profile is dumped to this directory, for offline analysis with
+        :mod:`pstats`, instead of being aggregated in memory.
+    ``PROFILER_TOP``
+        How many functions to show, per endpoint, on the report. Defaults to ``30``.
+
+    Unsampled requests only pay for a call to :func:`random.random`.
+'''
+
+# Import python libs
+import os
+import time
+import pstats
+import random
+import cProfile
+import logging
+import threading
+
+# Import 3rd-party libs
+from werkzeug.exceptions import HTTPException
+
+# Import JeMa libs
+from jema.signals import application_configured
+
+log = logging.getLogger(__name__)
+
+
+class SamplingProfilerMiddleware(object):
+    '''
+    WSGI middleware which profiles a random sample of the requests with :mod:`cProfile` and
+    aggregates the statistics per endpoint.
+    '''
+
+    def __init__(self, wsgi_app, app, sample_rate=0.01, dump_dir=None, top=30):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self.sample_rate = sample_rate
+        self.dump_dir = dump_dir
+        self.top = top
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.samples = {}
+        if dump_dir and not os.path.isdir(dump_dir):
+            os.makedirs(dump_dir)
+
+    def __call__(self, environ, start_response):
+        if random.random() >= self.sample_rate:
+            return self.wsgi_app(environ, start_response)
+
+        profile = cProfile.Profile()
+        # Only the application call is profiled, streamed response bodies are consumed by the
+        # WSGI server afterwards
+        response = profile.runcall(self.wsgi_app, environ, start_response)
+        try:
+            self.record(self.get_endpoint(environ), profile)
+        except Exception as exc:  # pylint: disable=W0703
+            log.warning('Failed to record the request profile: {0}'.format(exc))
+        return response
+
+    def get_endpoint(self, environ):
+        try:
+            return self.app.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            return '<unmatched>'
+
+    def record(self, endpoint, profile):
+        if self.dump_dir:
+            profile.dump_stats(os.path.join(
+                self.dump_dir,
+                '{0}.{1:.6f}.{2}.prof'.format(endpoint, time.time(), os.getpid())
+            ))
+            return
+        with self.lock:
+            if endpoint in self.stats:
+                self.stats[endpoint].add(profile)
+            else:
+                self.stats[endpoint] = pstats.Stats(profile)
+            self.samples[endpoint] = self.samples.get(endpoint, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.samples.clear()
+
+    def report(self):
+        '''
+        Return a list of ``(endpoint, samples, functions)`` tuples, sorted by endpoint, where
+        ``functions`` are the top functions by cumulative time, as dictionaries.
+        '''
+        report = []
+        with self.lock:
+            for endpoint in sorted(self.stats):
+                functions = []
+                stats = self.stats[endpoint].stats
+                ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+                for (filename, lineno, name), (pcalls, ncalls, tottime, cumtime, _) in \
+                        ranked[:self.top]:
+                    functions.append({
+                        'function': pstats.func_std_string((filename, lineno, name)),
+                        'ncalls': ncalls,
+                        'pcalls': pcalls,
+                        'tottime': tottime,
+                        'cumtime': cumtime,
+                        'percall': cumtime / pcalls if pcalls else 0
+                    })
+                report.append((endpoint, self.samples[endpoint], functions))
+        return report
+
+
+@application_configured.connect
+def configure_profiler(app):
+    if not app.config.get('PROFILER_ENABLED', False):
+        return
+    app.wsgi_app = app.extensions['profiler'] = SamplingProfilerMiddleware(
+        app.wsgi_app, app,
+        sample_rate=app.config.get('PROFILER_SAMPLE_RATE', 0.01),
+        dump_dir=app.config.get('PROFILER_DUMP_DIR', None),
+        top=app.config.get('PROFILER_TOP', 30)
+    )
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.queries
+    ~~~~~~~~~~~~
+
+    SQL query analytics.
+
+    Every statement is normalized into a fingerprint, literals and bound parameters replaced by
+    ``?``, and its count, total time and 95th percentile are aggregated per endpoint. A
+    fingerprint executed more than ``QUERY_ANALYTICS_NPLUSONE_THRESHOLD`` times during a single
+    request is flagged as a probable N+1 pattern and statements slower than
+    ``SLOW_QUERY_THRESHOLD`` seconds are logged to the ``jema.slowqueries`` logger.
+
+    Enable it by setting ``QUERY_ANALYTICS_ENABLED = True`` in ``jemaappconfig``.
+'''
+
+# Import python libs
+import re
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+# Import Flask libs & plugins
+from flask import g, has_request_context, request
+
+# Import JeMa libs
+from jema.signals import application_configured, sql_statement_executed
+
+log = logging.getLogger(__name__)
+slow_log = logging.getLogger('jema.slowqueries')
+
+NORMALIZE_PATTERNS = (
+    # String literals
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    # Bound parameters in the several DB-API styles
+    (re.compile(r'%\(\w+\)s|%s|:\w+'), '?'),
+    # Numeric literals
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    # Lists of parameters, ie, ``IN (?, ?, ?)``
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),
+    # Whitespace
+    (re.compile(r'\s+'), ' '),
+)
+
+# Normalizing is cached per statement text, the ORM keeps generating the same statements
+MAX_CACHED_FINGERPRINTS = 2048
+_fingerprints = {}
+
+
+def fingerprint(statement):
+    try:
+        return _fingerprints[statement]
+    except KeyError:
+        pass
+    normalized = statement
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        normalized = pattern.sub(replacement, normalized)
+    normalized = normalized.strip()
+    if len(_fingerprints) >= MAX_CACHED_FINGERPRINTS:
+        _fingerprints.clear()
+    _fingerprints[statement] = normalized
+    return normalized
+
+
+class QueryStats(object):
+    '''
+    Aggregated statistics of a statement fingerprint on an endpoint.
+
+    Durations are kept in a fixed size reservoir sample to estimate the percentiles.
+    '''
+
+    reservoir_size = 256
+
+    def __init__(self, endpoint, fingerprint):
+        self.endpoint = endpoint
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.nplusone = 0
+        self.reservoir = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(duration)
+        else:
+            index = random.randint(0, self.count - 1)
+            if index < self.reservoir_size:
+                self.reservoir[index] = duration
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        if not self.reservoir:
+            return 0.0
+        ordered = sorted(self.reservoir)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+
+class QueryAnalytics(object):
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.slow_queries = deque(maxlen=100)
+        self.nplusone_threshold = 10
+        self.slow_threshold = 0.5
+        self.max_fingerprints = 1000
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_ANALYTICS_ENABLED', False)
+        if not self.enabled:
+            return
+        self.nplusone_threshold = app.config.get(
+            'QUERY_ANALYTICS_NPLUSONE_THRESHOLD', self.nplusone_threshold
+        )
+        self.slow_threshold = app.config.get('SLOW_QUERY_THRESHOLD', self.slow_threshold)
+        self.max_fingerprints = app.config.get(
+            'QUERY_ANALYTICS_MAX_FINGERPRINTS', self.max_fingerprints
+        )
+        self.slow_queries = deque(maxlen=app.config.get('SLOW_QUERY_LOG_SIZE', 100))
+        sql_statement_executed.connect(self.on_statement_executed)
+        app.teardown_request(self.on_teardown_request)
+        app.extensions['query_analytics'] = self
+
+    def get_stats(self, endpoint, statement_fingerprint):
+        key = (endpoint, statement_fingerprint)
+        stats = self.stats.get(key)
+        if stats is None:
+            if len(self.stats) >= self.max_fingerprints:
+                # Don't let an unbounded number of distinct statements eat the memory
+                key = (endpoint, '<other>')
+                stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = QueryStats(*key)
+        return stats
+
+    def on_statement_executed(self, engine, statement, parameters, duration):
+        if has_request_context():
+            endpoint = request.endpoint or '<unmatched>'
+            counts = getattr(g, '_query_fingerprint_counts', None)
+            if counts is None:
+                counts = g._query_fingerprint_counts = {}
+        else:
+            endpoint = '<no request>'
+            counts = None
+
+        statement_fingerprint = fingerprint(statement)
+        with self.lock:
+            self.get_stats(endpoint, statement_fingerprint).add(duration)
+        if counts is not None:
+            counts[statement_fingerprint] = counts.get(statement_fingerprint, 0) + 1
+
+        if duration >= self.slow_threshold:
+            slow_log.warning('Slow query on {0} took {1:.3f}s: {2} {3!r}'.format(
+                endpoint, duration, statement, parameters
+            ))
+            self.slow_queries.append({
+                'time': time.time(),
+                'endpoint': endpoint,
+                'duration': duration,
+                'statement': statement,
+                'parameters': repr(parameters)[:1024]
+            })
+
+    def on_teardown_request(self, exc):
+        # Popped, an application context outliving the request, ie, in the benchmarks, scripts
+        # or workers, would otherwise carry the counts over to the next request
+        counts = g.pop('_query_fingerprint_counts', None)
+        if not counts:
+            return
+        endpoint = request.endpoint or '<unmatched>'
+        for statement_fingerprint, count in counts.items():
+            if count <= self.nplusone_threshold:
+                continue
+            log.warning(
+                'Probable N+1 queries pattern on {0}, the following statement was executed {1} '
+                'times: {2}'.format(endpoint, count, statement_fingerprint)
+            )
+            with self.lock:
+                self.get_stats(endpoint, statement_fingerprint).nplusone += 1
+
+    def report(self):
+        '''
+        Return the aggregated statistics grouped by endpoint, costlier statements first.
+        '''
+        endpoints = {}
+        with self.lock:
+            for stats in self.stats.values():
+                endpoints.setdefault(stats.endpoint, []).append(stats)
+        return [
+            (endpoint, sorted(endpoints[endpoint], key=lambda stats: stats.total, reverse=True))
+            for endpoint in sorted(endpoints)
+        ]
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.slow_queries.clear()
+
+
+query_analytics = QueryAnalytics()
+
+
+@application_configured.connect
+def configure_query_analytics(app):
+    query_analytics.init_app(app)
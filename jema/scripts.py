@@ -9,13 +9,123 @@
     ~~~~~~~~~~~~~
 
     CLI scripts access
+
+    The management commands live here instead of in :mod:`jema.application`, the web and
+    worker processes don't need to import them. Flask-Migrate, which pulls in Alembic, Mako and
+    Pygments, is only imported when running ``jema db``. When running ``jema serve -k gevent``,
+    the standard library is patched for gevent before anything else is imported.
 '''
 
+# Import python libs
+import sys
+
+
+def requested_command(argv):
+    args = iter(argv)
+    for arg in args:
+        if arg in ('-c', '--config'):
+            # Skip the option's value
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+
+
+def cooperative_serving_requested(argv):
+    if requested_command(argv) != 'serve':
+        return False
+    for idx, arg in enumerate(argv):
+        if arg in ('-k', '--worker-class'):
+            return argv[idx + 1:idx + 2] == ['gevent']
+        if arg in ('-kgevent', '--worker-class=gevent'):
+            return True
+    return False
+
+
+if cooperative_serving_requested(sys.argv[1:]):
+    # gevent has to patch the standard library before anything else imports it
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        # Reported by the serve command
+        pass
+
+# Import Flask libs & plugins
+from flask_script import Command, Option, Manager
+
 # Import JeMa libs
-from jema.application import manager
+from jema.application import app, configure_app, db, Account, Group
+from jema.assets import assets_manager
+from jema.benchmark import Benchmark
+from jema.bulk import Export, Import
+from jema.serving import Serve
+from jema.sessions import sessions_manager
+from jema.tasks import Worker
+from jema.tokens import ApiToken
+from jema.templating import templates_manager
+
+
+# Scripts Support
+class DatabaseMigrations(Command):
+    '''
+Perform database migrations
+'''
+
+    capture_all_args = True
+
+    def run(self, args):
+        # Only reached if ``main()`` didn't swap in Flask-Migrate's command
+        print('Please run `jema db --help` for the database migrations commands')
+        exit(1)
+
+
+class Administrator(Command):
+    '''
+Promote account to administrator
+'''
+
+    def get_options(self):
+        return [
+            Option('username', help='The username to promote')
+        ]
+
+    def run(self, username):
+        try:
+            account = Account.query.get(username)
+            if not account:
+                print('The account {0!r} does not exist'.format(username))
+                exit(1)
+            group = Group.query.get('Administrator')
+            if group is None:
+                group = Group('Administrator')
+            account.groups.add(group)
+            db.session.commit()
+            print('The {0!r} user is now an administrator'.format(username))
+            exit(0)
+        except:
+            raise
+
+manager = Manager(configure_app)
+manager.add_command('db', DatabaseMigrations)
+manager.add_command('administrator', Administrator)
+manager.add_command('assets', assets_manager)
+manager.add_command('templates', templates_manager)
+manager.add_command('sessions', sessions_manager)
+manager.add_command('export', Export)
+manager.add_command('import', Import)
+manager.add_command('serve', Serve)
+manager.add_command('worker', Worker)
+manager.add_command('benchmark', Benchmark)
+manager.add_command('api-token', ApiToken)
+manager.add_option('-c', '--config', dest='config', required=False)
 
 
 def main():
+    if requested_command(sys.argv[1:]) == 'db':
+        # Late import, see the module docstring
+        from flask_migrate import Migrate, MigrateCommand
+        Migrate(app, db)
+        manager.add_command('db', MigrateCommand)
     manager.run()
 
 
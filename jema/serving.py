@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.serving
+    ~~~~~~~~~~~~
+
+    ``jema serve``, serving the preloaded application, see :mod:`jema.prefork`, with gunicorn.
+
+    The ``sync`` workers handle one request at a time, a view waiting on GitHub or Jenkins holds
+    its worker for the whole round trip. The ``gevent`` workers handle up to ``--connections``
+    requests at a time, switching between them while they wait on the network, so a few
+    processes cope with hundreds of slow upstream calls.
+
+    For those, the outbound calls are bounded by the ``GITHUB_TIMEOUT`` and ``JENKINS_TIMEOUT``
+    settings, in seconds, defaulting to ``10``, and the waiting requests don't hold database
+    connections, see :func:`jema.database.upstream_call`. The pool, ``SQLALCHEMY_POOL_SIZE`` and
+    ``SQLALCHEMY_MAX_OVERFLOW``, only needs to fit the requests querying the database at once.
+
+    Requires ``gunicorn``, plus ``gevent`` for the ``gevent`` workers. With PostgreSQL,
+    ``psycogreen`` makes ``psycopg2`` cooperate too.
+'''
+
+# Import python libs
+import logging
+import multiprocessing
+
+# Import Flask libs & plugins
+from flask_script import Command, Option
+
+# Import JeMa libs
+from jema.prefork import preload_app, reset_after_fork
+
+log = logging.getLogger(__name__)
+
+WORKER_CLASSES = ('sync', 'gevent')
+
+
+def patch_for_gevent():
+    '''
+    Make the standard library, and ``psycopg2`` when available, cooperative.
+
+    ``jema serve -k gevent`` patches the standard library before anything else is imported,
+    see :mod:`jema.scripts`, patching it this late is only a fallback.
+    '''
+    from gevent import monkey
+    if not monkey.is_module_patched('socket'):
+        log.warning('Patching the standard library for gevent after it was imported')
+        monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return
+    patch_psycopg()
+
+
+def serve(app, options):
+    '''
+    Serve ``app`` with gunicorn, ``options`` being gunicorn's settings.
+    '''
+    # Late import, gunicorn is optional
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # With ``preload_app``, called once in the master process
+            preload_app(app)
+            return app
+
+    Server().run()
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class Serve(Command):
+    '''
+Serve the application with gunicorn, optionally with gevent's cooperative workers
+'''
+
+    def get_options(self):
+        return [
+            Option('-b', '--bind', default='127.0.0.1:5000',
+                   help='The address to listen on. Defaults to 127.0.0.1:5000'),
+            Option('-w', '--workers', type=int, default=None,
+                   help='How many worker processes to fork. Defaults to 2 per CPU for sync '
+                        'workers and 1 per CPU for gevent workers'),
+            Option('-k', '--worker-class', default='sync', choices=WORKER_CLASSES,
+                   help='The workers type. Defaults to sync'),
+            Option('--connections', type=int, default=1000,
+                   help='How many requests each gevent worker handles at a time. '
+                        'Defaults to 1000'),
+            Option('-t', '--timeout', type=int, default=30,
+                   help='Restart the workers silent for more than this many seconds. '
+                        'Defaults to 30'),
+            Option('--access-log', default=None,
+                   help='The access log file, "-" for the standard output')
+        ]
+
+    def __call__(self, app=None, *args, **kwargs):
+        # Like Flask-Script's own server, serve outside of the request context commands run in,
+        # the workers would otherwise share it
+        return self.run(app, *args, **kwargs)
+
+    def run(self, app, bind, workers, worker_class, connections, timeout, access_log):
+        try:
+            import gunicorn  # pylint: disable=W0612
+            if worker_class == 'gevent':
+                import gevent  # pylint: disable=W0612
+        except ImportError as exc:
+            print('Serving with {0} workers is not available: {1}'.format(worker_class, exc))
+            exit(1)
+        if worker_class == 'gevent':
+            patch_for_gevent()
+
+        if workers is None:
+            workers = multiprocessing.cpu_count() * (2 if worker_class == 'sync' else 1)
+        serve(app, {
+            'bind': bind,
+            'workers': workers,
+            'worker_class': worker_class,
+            'worker_connections': connections,
+            'timeout': timeout,
+            'accesslog': access_log,
+            'preload_app': True,
+            'post_fork': lambda server, worker: reset_after_fork(app),
+        })
+# <---- Scripts Support --------------------------------------------------------------------------
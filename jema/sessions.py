@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.sessions
+    ~~~~~~~~~~~~~
+
+    Server-side sessions support.
+
+    With ``SESSION_BACKEND`` set to ``'sqlalchemy'`` or ``'memory'`` in ``jemaappconfig`` the
+    session data is kept on the server and the cookie only carries a signed session id. The
+    store is only written to when the session was actually modified and expired sessions are
+    garbage collected in batches.
+
+    The session moves to a new id when the identity changes, see :func:`regenerate_session`, so
+    that an id planted before signing in is useless afterwards.
+
+    Sessions expire ``PERMANENT_SESSION_LIFETIME`` after they're written. While they're in use,
+    their expiry is pushed back once less than half of that lifetime remains, unless
+    ``SESSION_REFRESH_EACH_REQUEST`` is ``False``, so that only reading the session doesn't
+    sign users out, without writing to the store on every request.
+
+    The ``sqlalchemy`` backend stores the sessions in the application database unless
+    ``SESSION_SQLALCHEMY_URI`` points somewhere else, ie, a local SQLite file. The default,
+    ``'cookie'``, keeps Flask's signed cookie sessions.
+'''
+
+# Import python libs
+import os
+import time
+import logging
+import binascii
+import threading
+from datetime import datetime, timedelta
+
+# Import Flask libs & plugins
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from flask_script import Command, Manager
+from flask import current_app
+
+# Import 3rd-party libs
+import sqlalchemy
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+# Import JeMa libs
+from jema.database import db
+from jema.fastpath import FastPathSessionMixin
+from jema.signals import application_configured, process_forked
+
+log = logging.getLogger(__name__)
+
+
+# ----- Session Object -------------------------------------------------------------------------->
+def generate_sid():
+    return binascii.hexlify(os.urandom(32)).decode('ascii')
+
+
+def regenerate_session(session):
+    '''
+    Move a server-side ``session`` to a new id, cookie sessions don't have one.
+    '''
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate is not None:
+        regenerate()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    '''
+    Session data referenced by the ``sid`` stored in the cookie.
+    '''
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        # The id the session was stored under before being regenerated
+        self.previous_sid = None
+        self.modified = False
+
+    def regenerate(self):
+        '''
+        Move the session to a new id, the previous one is deleted from the store when the session
+        is saved.
+        '''
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = generate_sid()
+        self.modified = True
+# <---- Session Object ---------------------------------------------------------------------------
+
+
+# ----- Session Stores -------------------------------------------------------------------------->
+class MemorySessionStore(object):
+    '''
+    Keeps the sessions in the process memory. Only suitable for development and single process
+    deployments.
+    '''
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        entry = self.sessions.get(sid)
+        if entry is None or entry[0] < datetime.utcnow():
+            return None
+        return session_json_serializer.loads(entry[1]), entry[0]
+
+    def save(self, sid, data, expires):
+        with self.lock:
+            self.sessions[sid] = (expires, session_json_serializer.dumps(data))
+
+    def touch(self, sid, expires):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is not None:
+                self.sessions[sid] = (expires, entry[1])
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def collect_garbage(self, now, batch_size):
+        with self.lock:
+            expired = [sid for (sid, entry) in self.sessions.items() if entry[0] < now]
+            for sid in expired[:batch_size]:
+                del self.sessions[sid]
+        return min(len(expired), batch_size)
+
+
+sessions_table = db.Table(
+    'sessions', db.metadata,
+    db.Column('id', db.String(64), primary_key=True),
+    db.Column('data', db.LargeBinary, nullable=False),
+    db.Column('expires', db.DateTime, nullable=False, index=True)
+)
+
+
+class SQLAlchemySessionStore(object):
+    '''
+    Keeps the sessions in the ``sessions`` table, either in the application database or in the
+    database at ``SESSION_SQLALCHEMY_URI`` where the table is created if missing.
+    '''
+
+    def __init__(self, app, uri=None):
+        self.app = app
+        self.uri = uri
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            if self.uri:
+                self._engine = sqlalchemy.create_engine(self.uri)
+                sessions_table.create(self._engine, checkfirst=True)
+            else:
+                self._engine = db.get_engine(self.app)
+        return self._engine
+
+    def load(self, sid):
+        row = self.engine.execute(
+            sqlalchemy.select([sessions_table.c.data, sessions_table.c.expires])
+            .where(sessions_table.c.id == sid)
+        ).first()
+        if row is None or row.expires < datetime.utcnow():
+            return None
+        return session_json_serializer.loads(bytes(row.data).decode('utf-8')), row.expires
+
+    def save(self, sid, data, expires):
+        payload = session_json_serializer.dumps(data).encode('utf-8')
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                sessions_table.update()
+                .where(sessions_table.c.id == sid)
+                .values(data=payload, expires=expires)
+            ).rowcount
+            if not updated:
+                conn.execute(sessions_table.insert().values(id=sid, data=payload, expires=expires))
+
+    def touch(self, sid, expires):
+        self.engine.execute(
+            sessions_table.update().where(sessions_table.c.id == sid).values(expires=expires)
+        )
+
+    def delete(self, sid):
+        self.engine.execute(sessions_table.delete().where(sessions_table.c.id == sid))
+
+    def collect_garbage(self, now, batch_size):
+        with self.engine.begin() as conn:
+            sids = [row.id for row in conn.execute(
+                sqlalchemy.select([sessions_table.c.id])
+                .where(sessions_table.c.expires < now)
+                .limit(batch_size)
+            )]
+            if sids:
+                conn.execute(sessions_table.delete().where(sessions_table.c.id.in_(sids)))
+        return len(sids)
+
+    def dispose(self):
+        # Only the dedicated engine, the application database's is disposed by jema.database
+        if self.uri and self._engine is not None:
+            self._engine.dispose()
+# <---- Session Stores ---------------------------------------------------------------------------
+
+
+# ----- Session Interface ----------------------------------------------------------------------->
+class BaseServerSideSessionInterface(SessionInterface):
+    '''
+    Session interface storing the session data in ``store`` and only a signed session id in the
+    cookie.
+    '''
+
+    session_class = ServerSideSession
+    salt = 'jema-session'
+
+    def __init__(self, store, gc_interval=300, gc_batch_size=1000):
+        self.store = store
+        self.gc_interval = gc_interval
+        self.gc_batch_size = gc_batch_size
+        self._next_gc = time.time() + gc_interval
+
+    @staticmethod
+    def generate_sid():
+        return generate_sid()
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            if sid is not None:
+                loaded = self.store.load(sid)
+                if loaded is not None:
+                    return self.session_class(loaded[0], sid=sid, expires=loaded[1])
+        # Either no cookie, an invalid one or the session expired. The new session is only
+        # stored once something is written to it.
+        return self.session_class(sid=self.generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+
+        if not session.modified:
+            # Nothing changed, only the expiry might need to be pushed back
+            if self.should_refresh(app, session):
+                self.store.touch(session.sid, datetime.utcnow() + app.permanent_session_lifetime)
+                if session.permanent:
+                    self.set_cookie(app, session, response, domain, path)
+            return
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        self.store.save(
+            session.sid, dict(session), datetime.utcnow() + app.permanent_session_lifetime
+        )
+        if session.new or session.permanent or session.previous_sid is not None:
+            self.set_cookie(app, session, response, domain, path)
+        self.maybe_collect_garbage()
+
+    def should_refresh(self, app, session):
+        '''
+        Whether the expiry of an unmodified session should be pushed back, at most once per half
+        ``PERMANENT_SESSION_LIFETIME``.
+        '''
+        if session.new or not session or session.expires is None:
+            return False
+        if not app.config.get('SESSION_REFRESH_EACH_REQUEST', True):
+            return False
+        return session.expires - datetime.utcnow() < app.permanent_session_lifetime // 2
+
+    def set_cookie(self, app, session, response, domain, path):
+        response.set_cookie(
+            app.session_cookie_name,
+            self.get_signer(app).sign(session.sid.encode('ascii')),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app)
+        )
+
+    def maybe_collect_garbage(self):
+        now = time.time()
+        if now < self._next_gc:
+            return
+        self._next_gc = now + self.gc_interval
+        try:
+            collected = self.store.collect_garbage(datetime.utcnow(), self.gc_batch_size)
+            log.debug('Garbage collected {0} expired sessions'.format(collected))
+        except Exception as exc:  # pylint: disable=W0703
+            # Never fail a request because of the garbage collection
+            log.warning('Failed to garbage collect expired sessions: {0}'.format(exc))
+
+
+class ServerSideSessionInterface(FastPathSessionMixin, BaseServerSideSessionInterface):
+    '''
+    Server-side sessions, neither loaded nor saved for lightweight requests, see
+    :mod:`jema.fastpath`.
+    '''
+
+
+SESSION_STORES = {
+    'memory': lambda app: MemorySessionStore(),
+    'sqlalchemy': lambda app: SQLAlchemySessionStore(
+        app, app.config.get('SESSION_SQLALCHEMY_URI', None)
+    ),
+}
+
+
+@application_configured.connect
+def configure_sessions(app):
+    backend = app.config.get('SESSION_BACKEND', 'cookie')
+    if backend == 'cookie':
+        return
+    if backend not in SESSION_STORES:
+        raise RuntimeError(
+            'Unknown session backend {0!r}. Choose one of: cookie, {1}'.format(
+                backend, ', '.join(sorted(SESSION_STORES))
+            )
+        )
+    app.session_interface = ServerSideSessionInterface(
+        SESSION_STORES[backend](app),
+        gc_interval=app.config.get('SESSION_GC_INTERVAL', 300),
+        gc_batch_size=app.config.get('SESSION_GC_BATCH_SIZE', 1000)
+    )
+
+
+@process_forked.connect
+def reset_session_store(app):
+    dispose = getattr(getattr(app.session_interface, 'store', None), 'dispose', None)
+    if dispose is not None:
+        dispose()
+# <---- Session Interface ------------------------------------------------------------------------
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class CollectSessions(Command):
+    '''
+Delete all the expired server-side sessions
+'''
+
+    def run(self):
+        interface = current_app.session_interface
+        if not isinstance(interface, ServerSideSessionInterface):
+            print('Server-side sessions are not enabled. Please set `SESSION_BACKEND`.')
+            exit(1)
+        now = datetime.utcnow()
+        total = 0
+        while True:
+            collected = interface.store.collect_garbage(now, interface.gc_batch_size)
+            total += collected
+            if collected < interface.gc_batch_size:
+                break
+        print('Deleted {0} expired sessions'.format(total))
+
+
+sessions_manager = Manager(usage='Manage the server-side sessions')
+sessions_manager.add_command('gc', CollectSessions())
+# <---- Scripts Support --------------------------------------------------------------------------
@@ -27,7 +27,17 @@ application_configured = signal(
     'Emitted once the application has been configured.'
 )
 
+process_forked = signal(
+    'process-forked',
+    'Emitted in a worker process after it was forked from a preloading master process.'
+)
+
 after_identity_account_loaded = signal(
     'after-identity-account-loaded',
     'Emitted after loading the identity from the database.'
 )
+
+sql_statement_executed = signal(
+    'sql-statement-executed',
+    'Emitted after each SQL statement is executed, with its duration.'
+)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.tasks
+    ~~~~~~~~~~
+
+    Durable task queue, for the slow side effects which shouldn't hold a request, ie, refreshing
+    a GitHub profile.
+
+    Tasks are rows in the ``tasks`` table, in the application database unless
+    ``TASKS_SQLALCHEMY_URI`` points somewhere else, ie, a local SQLite file, where the table is
+    created if missing. Enqueueing is a single insert. ``jema worker`` claims the due tasks in
+    batches, highest priority first, and runs them in a pool of threads, in one or more
+    processes::
+
+        @task_queue.task('github.refresh_profile')
+        def refresh_github_profile(account_id):
+            ...
+
+        task_queue.enqueue('github.refresh_profile', {'account_id': account.id},
+                           dedupe_key='github.refresh_profile:{0}'.format(account.id))
+
+    Claimed tasks are hidden from the other workers for the visibility timeout. Tasks whose
+    worker died, or which ran for longer, are claimed again, so tasks run at least once and
+    should be idempotent. Failed tasks are retried, with an exponential backoff, until they run
+    out of attempts and are kept as dead. While a task with a deduplication key is queued,
+    enqueueing another one with the same key does nothing.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``TASKS_ENABLED``
+        Turn the queue on, otherwise enqueueing does nothing. Defaults to ``False``.
+    ``TASKS_SQLALCHEMY_URI``
+        Database to keep the tasks in. Defaults to the application database.
+    ``TASKS_VISIBILITY_TIMEOUT``
+        Seconds a claimed task is hidden from the other workers. Defaults to ``300``.
+    ``TASKS_MAX_ATTEMPTS``
+        How many times a task runs before it's dead. Defaults to ``5``.
+    ``TASKS_RETRY_DELAY``
+        Seconds before the first retry of a failed task, doubling on each retry, up to an hour.
+        Defaults to ``30``.
+'''
+
+# Import python libs
+import json
+import uuid
+import signal
+import logging
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+
+# Import 3rd-party libs
+import sqlalchemy
+from sqlalchemy import and_, or_
+
+# Import Flask libs & plugins
+from flask_script import Command, Option
+
+# Import JeMa libs
+from jema.database import db, dispose_engines
+from jema.prefork import reset_after_fork
+from jema.signals import application_configured, process_forked
+
+log = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 3600
+
+
+tasks_table = db.Table(
+    'tasks', db.metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(128), nullable=False),
+    db.Column('kwargs', db.Text, nullable=False),
+    db.Column('priority', db.Integer, nullable=False, default=0),
+    db.Column('dedupe_key', db.String(256), unique=True),
+    db.Column('attempts', db.Integer, nullable=False, default=0),
+    db.Column('max_attempts', db.Integer, nullable=False),
+    db.Column('run_at', db.DateTime, nullable=False, index=True),
+    db.Column('locked_until', db.DateTime),
+    db.Column('claim', db.String(32)),
+    db.Column('last_error', db.Text),
+    db.Column('created', db.DateTime, nullable=False),
+    db.Column('dead_at', db.DateTime)
+)
+
+
+class Task(object):
+    '''
+    A claimed task.
+    '''
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.kwargs = json.loads(row.kwargs)
+        self.attempts = row.attempts
+        self.max_attempts = row.max_attempts
+        self.claim = row.claim
+
+    def __repr__(self):
+        return '<Task {0} {1!r}, attempt {2}/{3}>'.format(
+            self.id, self.name, self.attempts, self.max_attempts
+        )
+
+
+class TaskQueue(object):
+
+    def __init__(self, app=None):
+        self.handlers = {}
+        self.enabled = False
+        self.app = None
+        self.uri = None
+        self.visibility_timeout = 300
+        self.max_attempts = 5
+        self.retry_delay = 30
+        self._engine = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('TASKS_ENABLED', False)
+        self.uri = app.config.get('TASKS_SQLALCHEMY_URI', None)
+        self.visibility_timeout = app.config.get(
+            'TASKS_VISIBILITY_TIMEOUT', self.visibility_timeout
+        )
+        self.max_attempts = app.config.get('TASKS_MAX_ATTEMPTS', self.max_attempts)
+        self.retry_delay = app.config.get('TASKS_RETRY_DELAY', self.retry_delay)
+        self._engine = None
+        app.extensions['task_queue'] = self
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            if self.uri:
+                self._engine = sqlalchemy.create_engine(self.uri)
+                tasks_table.create(self._engine, checkfirst=True)
+            else:
+                self._engine = db.get_engine(self.app)
+        return self._engine
+
+    def dispose(self):
+        # Only the dedicated engine, the application database's is disposed by jema.database
+        if self.uri and self._engine is not None:
+            self._engine.dispose()
+
+    def task(self, name):
+        '''
+        Register the decorated function as the handler of the ``name`` tasks. It's called with
+        the task's keyword arguments, within an application context.
+        '''
+        def decorator(func):
+            self.handlers[name] = func
+            return func
+        return decorator
+
+    # ----- Producing ------------------------------------------------------------------------->
+    def enqueue(self, name, kwargs=None, priority=0, dedupe_key=None, delay=0, max_attempts=None):
+        '''
+        Queue a ``name`` task, to run in ``delay`` seconds, with ``kwargs``, which must be JSON
+        serializable. Higher ``priority`` tasks run first.
+
+        Returns the task id, or ``None`` when the queue is disabled or a task with the same
+        ``dedupe_key`` is already queued.
+        '''
+        if not self.enabled:
+            return None
+        now = datetime.utcnow()
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(tasks_table.insert().values(
+                    name=name,
+                    kwargs=json.dumps(kwargs or {}),
+                    priority=priority,
+                    dedupe_key=dedupe_key,
+                    max_attempts=max_attempts or self.max_attempts,
+                    run_at=now + timedelta(seconds=delay),
+                    created=now
+                )).inserted_primary_key[0]
+        except sqlalchemy.exc.IntegrityError:
+            if dedupe_key is None:
+                raise
+            log.debug('Task {0!r} is already queued'.format(dedupe_key))
+            return None
+    # <---- Producing --------------------------------------------------------------------------
+
+    # ----- Consuming ------------------------------------------------------------------------->
+    def claim(self, batch_size):
+        '''
+        Claim up to ``batch_size`` due tasks, hiding them from the other workers for the
+        visibility timeout.
+
+        Tasks whose last attempt never finished, their worker died or they timed out, are kept
+        as dead instead.
+        '''
+        now = datetime.utcnow()
+        claim = uuid.uuid4().hex
+        unlocked = and_(
+            tasks_table.c.dead_at.is_(None),
+            or_(tasks_table.c.locked_until.is_(None), tasks_table.c.locked_until < now)
+        )
+        claimable = and_(
+            unlocked,
+            tasks_table.c.run_at <= now,
+            tasks_table.c.attempts < tasks_table.c.max_attempts
+        )
+        with self.engine.begin() as conn:
+            # Dead tasks no longer hold their deduplication key
+            exhausted = conn.execute(tasks_table.update().where(
+                and_(unlocked, tasks_table.c.attempts >= tasks_table.c.max_attempts)
+            ).values(
+                dead_at=now,
+                dedupe_key=None,
+                locked_until=None,
+                claim=None,
+                last_error='The last attempt did not finish within the visibility timeout'
+            )).rowcount
+            if exhausted:
+                log.error('{0} task(s) ran out of attempts without finishing'.format(exhausted))
+            ids = [row.id for row in conn.execute(
+                sqlalchemy.select([tasks_table.c.id]).where(claimable).order_by(
+                    tasks_table.c.priority.desc(), tasks_table.c.run_at, tasks_table.c.id
+                ).limit(batch_size)
+            )]
+            if not ids:
+                return []
+            # Repeating the conditions, another worker may have claimed some of the tasks since
+            conn.execute(tasks_table.update().where(
+                and_(tasks_table.c.id.in_(ids), claimable)
+            ).values(
+                claim=claim,
+                locked_until=now + timedelta(seconds=self.visibility_timeout),
+                attempts=tasks_table.c.attempts + 1
+            ))
+            return [Task(row) for row in conn.execute(
+                tasks_table.select().where(tasks_table.c.claim == claim).order_by(
+                    tasks_table.c.priority.desc(), tasks_table.c.run_at, tasks_table.c.id
+                )
+            )]
+
+    def complete(self, task):
+        with self.engine.begin() as conn:
+            conn.execute(tasks_table.delete().where(and_(
+                tasks_table.c.id == task.id, tasks_table.c.claim == task.claim
+            )))
+
+    def fail(self, task, error):
+        now = datetime.utcnow()
+        if task.attempts >= task.max_attempts:
+            log.error('{0} failed for the last time: {1}'.format(task, error))
+            # Dead tasks no longer hold their deduplication key
+            values = dict(dead_at=now, dedupe_key=None)
+        else:
+            delay = min(self.retry_delay * 2 ** (task.attempts - 1), MAX_RETRY_DELAY)
+            log.warning('{0} failed, retrying in {1}s: {2}'.format(task, delay, error))
+            values = dict(run_at=now + timedelta(seconds=delay))
+        with self.engine.begin() as conn:
+            conn.execute(tasks_table.update().where(and_(
+                tasks_table.c.id == task.id, tasks_table.c.claim == task.claim
+            )).values(locked_until=None, claim=None, last_error=error, **values))
+
+    def run(self, task):
+        '''
+        Run a claimed task, completing it when it succeeds.
+        '''
+        handler = self.handlers.get(task.name, None)
+        if handler is None:
+            task.attempts = task.max_attempts
+            self.fail(task, 'No handler for {0!r} tasks'.format(task.name))
+            return False
+        try:
+            with self.app.app_context():
+                try:
+                    handler(**task.kwargs)
+                finally:
+                    db.session.remove()
+        except Exception as exc:  # pylint: disable=W0703
+            log.exception('{0} failed'.format(task))
+            self.fail(task, '{0}: {1}'.format(type(exc).__name__, exc))
+            return False
+        self.complete(task)
+        return True
+    # <---- Consuming --------------------------------------------------------------------------
+
+    def work(self, threads, batch_size, poll_interval, stop, once=False):
+        '''
+        Claim and run batches of tasks with ``threads`` threads until ``stop`` is set or, with
+        ``once``, until no task is due.
+        '''
+        pool = ThreadPool(threads)
+        try:
+            while not stop.is_set():
+                try:
+                    tasks = self.claim(batch_size)
+                except sqlalchemy.exc.DBAPIError as exc:
+                    log.warning('Failed to claim tasks: {0}'.format(exc))
+                    tasks = []
+                if tasks:
+                    pool.map(self.run, tasks)
+                elif once:
+                    break
+                else:
+                    stop.wait(poll_interval)
+        finally:
+            pool.close()
+            pool.join()
+
+
+task_queue = TaskQueue()
+
+
+@application_configured.connect
+def configure_task_queue(app):
+    task_queue.init_app(app)
+
+
+@process_forked.connect
+def reset_task_queue(app):
+    task_queue.dispose()
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class Worker(Command):
+    '''
+Run the queued tasks
+'''
+
+    def get_options(self):
+        return [
+            Option('-p', '--processes', type=int, default=1,
+                   help='How many worker processes to run. Defaults to 1'),
+            Option('-t', '--threads', type=int, default=4,
+                   help='How many threads run tasks in each process. Defaults to 4'),
+            Option('-b', '--batch-size', type=int, default=None,
+                   help='How many tasks to claim at a time. Defaults to the threads count'),
+            Option('-i', '--poll-interval', type=float, default=1,
+                   help='Seconds to wait for new tasks when none is due. Defaults to 1'),
+            Option('--once', action='store_true', default=False,
+                   help='Exit once no task is due instead of waiting for new ones')
+        ]
+
+    def __call__(self, app=None, *args, **kwargs):
+        # Outside of the request context commands run in, the processes would otherwise share it
+        return self.run(app, *args, **kwargs)
+
+    def run(self, app, processes, threads, batch_size, poll_interval, once):
+        if not task_queue.enabled:
+            print('The task queue is not enabled. Please set `TASKS_ENABLED`.')
+            exit(1)
+        batch_size = batch_size or threads
+        if processes < 2:
+            stop = threading.Event()
+            self.handle_signals(stop.set)
+            task_queue.work(threads, batch_size, poll_interval, stop, once)
+            return
+
+        stop = multiprocessing.Event()
+
+        def work():
+            reset_after_fork(app)
+            # The parent tells the children when to stop
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            task_queue.work(threads, batch_size, poll_interval, stop, once)
+
+        # Don't fork with open database connections
+        dispose_engines(app)
+        task_queue.dispose()
+        children = [multiprocessing.Process(target=work) for _ in range(processes)]
+        for child in children:
+            child.start()
+        self.handle_signals(stop.set)
+        while any(child.is_alive() for child in children):
+            # Joining with a timeout, an untimed join would defer the signal handlers
+            for child in children:
+                child.join(0.5)
+
+    @staticmethod
+    def handle_signals(callback):
+        def handler(signum, frame):  # pylint: disable=W0613
+            log.info('Stopping once the running tasks are done')
+            callback()
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGTERM, handler)
+# <---- Scripts Support --------------------------------------------------------------------------
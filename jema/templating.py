@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.templating
+    ~~~~~~~~~~~~~~~
+
+    Jinja templates support.
+
+    Setting ``JINJA_BYTECODE_CACHE_DIR`` in ``jemaappconfig`` makes the compiled templates
+    persist on disk so that new worker processes don't need to compile them from source.
+    ``jema templates precompile`` warms that cache at deploy time.
+'''
+
+# Import python libs
+import os
+import logging
+import tempfile
+
+# Import Flask libs & plugins
+from flask import current_app
+from flask_script import Command, Manager, Option
+
+# Import 3rd-party libs
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+# Import JeMa libs
+from jema.signals import application_configured
+
+log = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSIONS = ('html', 'txt')
+
+
+class AtomicFileSystemBytecodeCache(FileSystemBytecodeCache):
+    '''
+    A :class:`~jinja2.FileSystemBytecodeCache` which is safe to share between processes.
+
+    The bytecode is first written to a temporary file in the cache directory which is then
+    renamed over the final file name, so concurrent readers either see the previous complete
+    file or the new complete one, never a partially written one. Jinja itself validates the
+    source checksum stored along with the bytecode, so changed templates are recompiled.
+    '''
+
+    def __init__(self, directory, pattern='__jema_%s.cache'):
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory, 0o700)
+            except OSError:
+                # Another process might have just created it
+                if not os.path.isdir(directory):
+                    raise
+        FileSystemBytecodeCache.__init__(self, directory, pattern)
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=os.path.basename(filename), suffix='.tmp', dir=self.directory
+        )
+        try:
+            with os.fdopen(fd, 'wb') as wfh:
+                bucket.write_bytecode(wfh)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as exc:
+            log.warning('Failed to write the template bytecode cache {0}: {1}'.format(
+                filename, exc
+            ))
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+
+
+@application_configured.connect
+def configure_bytecode_cache(app):
+    cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR', None)
+    if not cache_dir:
+        return
+    app.jinja_env.bytecode_cache = AtomicFileSystemBytecodeCache(
+        os.path.abspath(os.path.expanduser(cache_dir))
+    )
+
+
+def precompile_templates(app, extensions=TEMPLATE_EXTENSIONS):
+    '''
+    Load, and thus compile, every template known to the application. Returns the names of the
+    compiled templates.
+    '''
+    compiled = []
+    for name in app.jinja_env.list_templates(extensions=extensions):
+        try:
+            app.jinja_env.get_template(name)
+        except TemplateSyntaxError as exc:
+            # Some templates depend on filters which are only available with certain
+            # configurations, ie, ``sql_highlight`` used in ``_db_queries.html``.
+            log.warning('Skipping template {0!r}: {1}'.format(name, exc))
+            continue
+        compiled.append(name)
+    return compiled
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class PrecompileTemplates(Command):
+    '''
+Compile all templates into the bytecode cache
+'''
+
+    def get_options(self):
+        return [
+            Option('-e', '--extension', dest='extensions', action='append',
+                   help='Template file extensions to compile. Defaults to {0}'.format(
+                       ', '.join(TEMPLATE_EXTENSIONS)))
+        ]
+
+    def run(self, extensions):
+        if current_app.jinja_env.bytecode_cache is None:
+            print('The templates bytecode cache is not enabled. Please set '
+                  '`JINJA_BYTECODE_CACHE_DIR` in the configuration.')
+            exit(1)
+        names = precompile_templates(current_app, extensions or TEMPLATE_EXTENSIONS)
+        print('Compiled {0} templates into {1}'.format(
+            len(names), current_app.jinja_env.bytecode_cache.directory
+        ))
+
+
+templates_manager = Manager(usage='Manage the Jinja templates')
+templates_manager.add_command('precompile', PrecompileTemplates())
+# <---- Scripts Support --------------------------------------------------------------------------
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.tokens
+    ~~~~~~~~~~~
+
+    API bearer tokens.
+
+    Tokens are signed with the ``SECRET_KEY``, not stored. They carry the account id and a
+    fingerprint of the account's GitHub access token, signing in with a new GitHub token
+    revokes them. Checking one costs an HMAC, no session is involved, see
+    :mod:`jema.views.api`.
+
+    Issue them with ``jema api-token <username>``.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``API_TOKEN_MAX_AGE``
+        Seconds a token is valid for. Defaults to ``2592000``, 30 days.
+'''
+
+# Import python libs
+import hashlib
+
+# Import 3rd-party libs
+from itsdangerous import BadData, URLSafeTimedSerializer
+
+# Import Flask libs & plugins
+from flask import current_app
+from flask_script import Command, Option
+
+# Import JeMa libs
+from jema.database import Account
+
+SALT = 'jema-api-token'
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=SALT)
+
+
+def fingerprint(account):
+    return hashlib.sha1((account.access_token or '').encode('utf-8')).hexdigest()[:12]
+
+
+def issue_api_token(account):
+    return _serializer().dumps([account.id, fingerprint(account)])
+
+
+def read_api_token(token):
+    '''
+    Return the ``(account_id, fingerprint)`` the ``token`` carries, ``None`` if it's invalid or
+    expired.
+    '''
+    try:
+        account_id, account_fingerprint = _serializer().loads(
+            token, max_age=current_app.config.get('API_TOKEN_MAX_AGE', 30 * 24 * 3600)
+        )
+    except (BadData, TypeError, ValueError):
+        return None
+    return account_id, account_fingerprint
+
+
+# ----- Scripts Support ------------------------------------------------------------------------->
+class ApiToken(Command):
+    '''
+Issue an API bearer token for an account
+'''
+
+    def get_options(self):
+        return [
+            Option('username', help='The username to issue the token for')
+        ]
+
+    def run(self, username):
+        account = Account.query.get(username)
+        if not account:
+            print('The account {0!r} does not exist'.format(username))
+            exit(1)
+        print(issue_api_token(account))
+# <---- Scripts Support --------------------------------------------------------------------------
@@ -9,6 +9,16 @@
     ~~~~~~~~~~~~~~~~~~~
 
     Account related views
+
+    Configuration, in ``jemaappconfig``:
+
+    ``GITHUB_BASE_URL``
+        Where GitHub's OAuth endpoints live. Defaults to ``https://github.com``.
+    ``GITHUB_API_URL``
+        Where GitHub's API lives. Defaults to ``https://api.github.com``.
+
+    Pointing both to a GitHub Enterprise instance, or to :mod:`jema.fakegithub` to load test
+    the sign-in offline, works the same.
 '''
 
 # Import Python libs
@@ -17,18 +27,21 @@ import urllib
 import httplib
 import logging
 from uuid import uuid4
+from urlparse import urlparse
 
 # Import 3rd-party libs
-import pytz
-import github
-from babel.dates import get_timezone_name
+from flask_babel import lazy_gettext
 
 # Import JeMa Libs
-from jema.forms import *
 from jema.application import *
+from jema.conditional import conditional
+from jema.sessions import regenerate_session
 
 log = logging.getLogger(__name__)
 
+DEFAULT_GITHUB_BASE_URL = 'https://github.com'
+DEFAULT_GITHUB_API_URL = 'https://api.github.com'
+
 
 # ----- Blueprints & Menu Entries --------------------------------------------------------------->
 account = Blueprint('account', __name__, url_prefix='/account')
@@ -47,18 +60,69 @@ account_view_nav = build_context_nav('account_view_nav')
 
 
 # ----- Forms ----------------------------------------------------------------------------------->
-class ProfileForm(DBBoundForm):
+_form_classes = {}
+
+
+def get_profile_form_class():
+    '''
+    The forms machinery, ``wtforms_alchemy``, is expensive to import. It's only loaded once a
+    form is first needed instead of with the application.
+    '''
+    try:
+        return _form_classes['profile']
+    except KeyError:
+        pass
 
-    title = _('My Account')
+    # Late import
+    from jema.forms import DBBoundForm, PrimarySubmitField
 
-    class Meta:
-        model = Account
+    class ProfileForm(DBBoundForm):
 
-    # Actions
-    update = PrimarySubmitField(_('Update Details'))
+        title = lazy_gettext('My Account')
+
+        class Meta:
+            model = Account
+
+        # Actions
+        update = PrimarySubmitField(lazy_gettext('Update Details'))
+
+    _form_classes['profile'] = ProfileForm
+    return ProfileForm
 # <---- Forms ------------------------------------------------------------------------------------
 
 
+# ----- GitHub ---------------------------------------------------------------------------------->
+def github_url(path):
+    return '{0}{1}'.format(
+        app.config.get('GITHUB_BASE_URL', DEFAULT_GITHUB_BASE_URL).rstrip('/'), path
+    )
+
+
+def github_connection():
+    '''
+    A connection to ``GITHUB_BASE_URL``, HTTPS unless it's an ``http://`` one.
+    '''
+    url = urlparse(app.config.get('GITHUB_BASE_URL', DEFAULT_GITHUB_BASE_URL))
+    if url.scheme == 'http':
+        connection_class = httplib.HTTPConnection
+    else:
+        connection_class = httplib.HTTPSConnection
+    return connection_class(url.netloc, timeout=app.config.get('GITHUB_TIMEOUT', 10))
+
+
+def github_client(token):
+    # Late import, PyGithub is expensive to import and only needed on sign-in
+    import github
+    return github.Github(
+        token,
+        base_url=app.config.get('GITHUB_API_URL', DEFAULT_GITHUB_API_URL).rstrip('/'),
+        client_id=app.config.get('GITHUB_CLIENT_ID'),
+        client_secret=app.config.get('GITHUB_CLIENT_SECRET'),
+        timeout=app.config.get('GITHUB_TIMEOUT', 10)
+    )
+# <---- GitHub -----------------------------------------------------------------------------------
+
+
 # ----- Views ----------------------------------------------------------------------------------->
 @account.route('/signin', methods=('GET',))
 def signin():
@@ -70,6 +134,7 @@ def signin():
     elif identity_account is None:
         # If we reached this point, the github token is not in our database
         session.clear()
+        regenerate_session(session)
 
     # Let's login the user using github's oauth
 
@@ -87,9 +152,7 @@ def signin():
     }
     log.debug('New signin request. Redirect args: {0}'.format(urlargs))
     return redirect(
-        'https://github.com/login/oauth/authorize?{0}'.format(
-            urllib.urlencode(urlargs)
-        )
+        github_url('/login/oauth/authorize?{0}'.format(urllib.urlencode(urlargs)))
     )
 
 
@@ -111,29 +174,45 @@ def callback():
     # let's get some json back
     headers = {'Accept': 'application/json'}
 
-    conn = httplib.HTTPSConnection('github.com')
-    conn.request(
-        'POST',
-        '/login/oauth/access_token?{0}'.format(urllib.urlencode(urlargs)),
-        headers=headers
-    )
-    resp = conn.getresponse()
-    data = resp.read()
+    with upstream_call('github', 'access_token'):
+        conn = github_connection()
+        conn.request(
+            'POST',
+            '{0}?{1}'.format(
+                urlparse(github_url('/login/oauth/access_token')).path,
+                urllib.urlencode(urlargs)
+            ),
+            headers=headers
+        )
+        resp = conn.getresponse()
+        data = resp.read()
     if resp.status == 200:
         data = json.loads(data)
-        token = data['access_token']
+        token = data.get('access_token')
+        if token is None:
+            # GitHub answers bad or expired codes with an error, still with a 200
+            log.warning('GitHub did not grant an access token: {0}'.format(
+                data.get('error_description', data.get('error'))
+            ))
+            flash(_('GitHub did not authorize the sign-in, please try again.'), 'error')
+            return redirect(url_for('main.index'))
 
         account = Account.query.from_github_token(token)
-        if account is None:
-            # We do not know this token.
-            gh = github.Github(
-                token,
-                client_id=app.config.get('GITHUB_CLIENT_ID'),
-                client_secret=app.config.get('GITHUB_CLIENT_SECRET')
+        if account is not None:
+            # A returning account, refresh its details from GitHub without making it wait
+            task_queue.enqueue(
+                'github.refresh_profile', {'account_id': account.id},
+                dedupe_key='github.refresh_profile:{0}'.format(account.id)
             )
-            gh_user = gh.get_user()
+        else:
+            # We do not know this token.
+            gh = github_client(token)
+            with upstream_call('github', 'user'):
+                gh_user = gh.get_user()
+                # The user details are lazily loaded, accessing the id fetches them
+                gh_user_id = gh_user.id
             # Do we know the account by the id?
-            account = Account.query.get(gh_user.id)
+            account = Account.query.get(gh_user_id)
             if account is None:
                 # This is a brand new account
                 account = Account(
@@ -158,6 +237,8 @@ def callback():
 
             db.session.commit()
 
+        # Don't let an id planted before signing in carry the identity
+        regenerate_session(session)
         identity_changed.send(app, identity=Identity(account.id, 'dbm'))
         flash(_('You are now signed in.'), 'success')
     return redirect(url_for('main.index'))
@@ -168,6 +249,7 @@ def callback():
 def signout():
     if g.identity.account is not None:
         session.clear()
+        regenerate_session(session)
         identity_changed.send(app, identity=AnonymousIdentity())
         flash(_('You are now signed out.'), 'success')
     else:
@@ -177,11 +259,30 @@ def signout():
 
 @account.route('/profile', methods=('GET', 'POST'))
 @authenticated_permission.require(403)
+@conditional()
 def profile():
-    form = ProfileForm(formdata=request.values.copy(), obj=g.identity.account)
+    form = get_profile_form_class()(formdata=request.values.copy(), obj=g.identity.account)
     if form.validate_on_submit():
         form.populate_obj(g.identity.account)
         flash(_('Account details updated.'), 'success')
         return redirect_to('account.profile')
     return render_template('account/profile.html', form=form)
 # <---- Views ------------------------------------------------------------------------------------
+
+
+# ----- Tasks ----------------------------------------------------------------------------------->
+@task_queue.task('github.refresh_profile')
+def refresh_github_profile(account_id):
+    account = Account.query.get(account_id)
+    if account is None:
+        return
+    gh = github_client(account.access_token)
+    with upstream_call('github', 'user'):
+        gh_user = gh.get_user()
+        # The user details are lazily loaded, accessing the login fetches them
+        account.login = gh_user.login
+    account.name = gh_user.name
+    account.email = gh_user.email
+    account.avatar_url = gh_user.avatar_url
+    db.session.commit()
+# <---- Tasks ------------------------------------------------------------------------------------
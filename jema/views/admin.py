@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.views.admin
+    ~~~~~~~~~~~~~~~~~
+
+    Administration views
+'''
+
+# Import python libs
+import json
+
+# Import Flask libs
+from flask import Response, abort, jsonify, stream_with_context
+
+# Import JeMa Libs
+from jema.application import *
+from jema.pagination import DEFAULT_PER_PAGE, MAX_PER_PAGE, InvalidCursor
+from jema.errors import error_capture
+from jema.queries import query_analytics
+
+
+# ----- Blueprints & Menu Entries --------------------------------------------------------------->
+admin = Blueprint('admin', __name__, url_prefix='/admin')
+
+top_account_nav.add_menu_entry(
+    glyphiconer('fire') + _('Errors'), 'admin.errors', priority=10,
+    visiblewhen=check_wether_is_admin
+)
+
+admin_view_nav = build_context_nav('admin_view_nav')
+admin_view_nav.add_menu_entry(
+    glyphiconer('fire') + _('Errors'), 'admin.errors', priority=10
+)
+admin_view_nav.add_menu_entry(
+    glyphiconer('time') + _('Profiles'), 'admin.profiles', priority=20
+)
+admin_view_nav.add_menu_entry(
+    glyphiconer('tasks') + _('Queries'), 'admin.queries', priority=30
+)
+# <---- Blueprints & Menu Entries ----------------------------------------------------------------
+
+
+# ----- Forms ----------------------------------------------------------------------------------->
+_form_classes = {}
+
+
+def get_clear_form_class():
+    '''
+    A form only carrying the CSRF token, for the buttons clearing the collected statistics.
+    The forms machinery is only loaded once it's first needed, see
+    :func:`jema.views.account.get_profile_form_class`.
+    '''
+    try:
+        return _form_classes['clear']
+    except KeyError:
+        pass
+
+    # Late import
+    from jema.forms import FormBase
+
+    class ClearForm(FormBase):
+        pass
+
+    _form_classes['clear'] = ClearForm
+    return ClearForm
+# <---- Forms ------------------------------------------------------------------------------------
+
+
+# ----- Helpers --------------------------------------------------------------------------------->
+def _account_dict(account):
+    return {
+        'id': account.id,
+        'login': account.login,
+        'name': account.name,
+        'email': account.email,
+        'avatar_url': unicode(account.avatar_url) if account.avatar_url else None,
+        'register_date': account.register_date.isoformat() if account.register_date else None,
+        'last_login': account.last_login.isoformat() if account.last_login else None,
+    }
+
+
+def _accounts_query():
+    '''
+    All the accounts or, when the ``group`` argument is passed, the group's members.
+    '''
+    group_name = request.args.get('group', None)
+    if group_name is None:
+        return Account.query
+    group = Group.query.get(group_name)
+    if group is None:
+        abort(404)
+    return group.accounts
+
+
+def _sort_key():
+    sort = request.args.get('sort', 'id')
+    if sort not in ('id', 'login'):
+        abort(400)
+    return sort
+# <---- Helpers ----------------------------------------------------------------------------------
+
+
+# ----- Views ----------------------------------------------------------------------------------->
+@admin.route('/errors', methods=('GET',))
+@administrator_permission.require(403)
+def errors():
+    return render_template('admin/errors.html', errors=error_capture.aggregated())
+
+
+@admin.route('/profiles', methods=('GET', 'POST'))
+@administrator_permission.require(403)
+def profiles():
+    profiler = app.extensions.get('profiler')
+    form = get_clear_form_class()(formdata=request.form)
+    if profiler is not None and form.validate_on_submit():
+        profiler.reset()
+        flash(_('Profiling statistics cleared.'), 'success')
+        return redirect_to('admin.profiles')
+    return render_template(
+        'admin/profiles.html', profiler=profiler, form=form,
+        report=profiler.report() if profiler is not None else []
+    )
+
+
+@admin.route('/queries', methods=('GET', 'POST'))
+@administrator_permission.require(403)
+def queries():
+    form = get_clear_form_class()(formdata=request.form)
+    if query_analytics.enabled and form.validate_on_submit():
+        query_analytics.reset()
+        flash(_('Query analytics cleared.'), 'success')
+        return redirect_to('admin.queries')
+    return render_template(
+        'admin/queries.html', analytics=query_analytics, form=form,
+        report=query_analytics.report() if query_analytics.enabled else [],
+        slow_queries=list(reversed(query_analytics.slow_queries))
+    )
+
+
+@admin.route('/accounts.json', methods=('GET',))
+@administrator_permission.require(403)
+def accounts_page():
+    '''
+    A page of accounts, continue with the ``next`` cursor of the previous page. Accepts the
+    ``group``, ``sort``, ``cursor`` and ``per_page`` arguments.
+    '''
+    try:
+        page = _accounts_query().keyset_page(
+            sort=_sort_key(),
+            cursor=request.args.get('cursor', None),
+            per_page=request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+        )
+    except InvalidCursor:
+        abort(400)
+    return jsonify(
+        accounts=[_account_dict(account) for account in page],
+        next=page.next_cursor
+    )
+
+
+@admin.route('/accounts/export', methods=('GET',))
+@administrator_permission.require(403)
+def accounts_export():
+    '''
+    Stream all the accounts as JSON lines, one account per line, fetched a page at a time.
+    '''
+    query = _accounts_query()
+    sort = _sort_key()
+
+    def generate():
+        for page in query.iter_keyset_pages(sort=sort, per_page=MAX_PER_PAGE):
+            yield ''.join(json.dumps(_account_dict(account)) + '\n' for account in page)
+            # Don't keep the whole export in the session's identity map
+            for account in page:
+                if account is not getattr(g.identity, 'account', None):
+                    db.session.expunge(account)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+# <---- Views ------------------------------------------------------------------------------------
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.views.api
+    ~~~~~~~~~~~~~~
+
+    Versioned JSON API, for the Jenkins servers, their jobs and their builds.
+
+    Requests authenticate with an ``Authorization: Bearer <token>`` header, see
+    :mod:`jema.tokens`. They're served through the fast path, no session is loaded or saved,
+    see :mod:`jema.fastpath`.
+
+    Lists are paginated, continue with the ``next`` URL, or the ``next_cursor`` passed as the
+    ``cursor`` argument, of the previous page, ``per_page`` items at a time. Pick the
+    attributes returned with ``fields``, ie, ``?fields=name,status``. Responses carry a weak
+    ``ETag`` and are gzipped for clients accepting it.
+
+    ``/events`` streams the jobs state changes as Server-Sent Events, see :mod:`jema.events`.
+    ``/status`` answers for many jobs, of many servers, at once.
+
+    Configuration, in ``jemaappconfig``:
+
+    ``API_GZIP_MIN_SIZE``
+        Smallest response, in bytes, worth compressing. Defaults to ``1024``.
+    ``API_GZIP_LEVEL``
+        The compression level, from ``1`` to ``9``. Defaults to ``6``.
+    ``API_BATCH_MAX_JOBS``
+        Most jobs ``/status`` answers for at once. Defaults to ``500``.
+    ``API_BATCH_CONCURRENCY``
+        Servers ``/status`` fetches the jobs of at once. Defaults to ``8``.
+'''
+
+# Import python libs
+import json
+import zlib
+import hashlib
+
+# Import Flask libs
+from flask import abort
+from flask_principal import identity_loaded
+
+# Import JeMa libs
+from jema.application import *
+from jema.events import TooManyClients, change_feed, job_event
+from jema.fastpath import API, lightweight_endpoints
+from jema.jenkins import JenkinsError, job_builds, many_server_jobs, server_jobs
+from jema.pagination import DEFAULT_PER_PAGE, InvalidCursor, sequence_page
+from jema.tokens import fingerprint, read_api_token
+
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+lightweight_endpoints.register_blueprint(api, API)
+
+SERVER_FIELDS = ('id', 'address', 'username', 'url', 'jobs_url')
+JOB_FIELDS = ('name', 'url', 'status', 'building', 'last_build', 'builds_url')
+BUILD_FIELDS = ('number', 'result', 'building', 'timestamp', 'duration', 'url')
+
+
+# ----- Authentication -------------------------------------------------------------------------->
+@api.before_request
+def load_token_identity():
+    '''
+    Load the identity from the bearer token. Without one, the identity stays the anonymous one
+    the fast path set.
+    '''
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return
+    payload = read_api_token(token.strip())
+    if payload is None:
+        abort(401, 'Invalid or expired token')
+
+    identity = Identity(payload[0], 'api')
+    g.identity = identity
+    identity_loaded.send(app, identity=identity)
+    account = identity.account
+    if account is None or fingerprint(account) != payload[1]:
+        g.identity = AnonymousIdentity()
+        abort(401, 'Invalid or expired token')
+    # API requests don't count as logins, nor should they write to the database
+    db.session.expire(account, ['last_login'])
+# <---- Authentication ---------------------------------------------------------------------------
+
+
+# ----- Helpers --------------------------------------------------------------------------------->
+def api_response(data, status=200):
+    '''
+    Serialize ``data``, answering conditional requests and gzipping it when accepted.
+    '''
+    body = json.dumps(data, separators=(',', ':'), sort_keys=True)
+    response = app.response_class(body, status=status, mimetype='application/json')
+    # The credentials pick the data, the encoding its representation
+    response.vary.update(('Authorization', 'Accept-Encoding'))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if status != 200:
+        return response
+
+    etag = hashlib.sha1(body).hexdigest()
+    response.set_etag(etag, weak=True)
+    if request.if_none_match.contains_weak(etag):
+        response.status_code = 304
+        response.set_data('')
+        return response
+
+    if len(body) >= app.config.get('API_GZIP_MIN_SIZE', 1024) and \
+            request.accept_encodings['gzip']:
+        # A gzip container, not a raw deflate stream
+        compressor = zlib.compressobj(
+            app.config.get('API_GZIP_LEVEL', 6), zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+        response.set_data(compressor.compress(body) + compressor.flush())
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def requested_fields(allowed):
+    fields = request.args.get('fields', None)
+    if not fields:
+        return allowed
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = sorted(set(fields).difference(allowed))
+    if unknown:
+        abort(400, 'Unknown fields: {0}. Choose from: {1}'.format(
+            ', '.join(unknown), ', '.join(allowed)
+        ))
+    return fields
+
+
+def select_fields(item, fields):
+    return dict((field, item.get(field)) for field in fields)
+
+
+def page_response(page, fields, endpoint, **values):
+    next_url = None
+    if page.has_next:
+        args = request.args.to_dict()
+        args.update(values, cursor=page.next_cursor, per_page=page.per_page)
+        next_url = url_for(endpoint, **args)
+    return {
+        'items': [select_fields(item, fields) for item in page],
+        'next_cursor': page.next_cursor,
+        'next': next_url
+    }
+
+
+def per_page():
+    return request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+
+
+def get_server(server_id):
+    jenkins_server = JenkinsServer.query.get(server_id)
+    if jenkins_server is None:
+        abort(404, 'No such server')
+    return jenkins_server
+
+
+def server_dict(jenkins_server):
+    return {
+        'id': jenkins_server.id,
+        'address': jenkins_server.address,
+        'username': jenkins_server.username,
+        'url': url_for('api.server', server_id=jenkins_server.id),
+        'jobs_url': url_for('api.jobs', server_id=jenkins_server.id)
+    }
+
+
+def job_dict(jenkins_server, state):
+    return dict(state, builds_url=url_for(
+        'api.builds', server_id=jenkins_server.id, job_name=state['name']
+    ))
+
+
+def upstream(fetch, *args):
+    try:
+        return fetch(*args)
+    except JenkinsError as exc:
+        abort(502, str(exc))
+# <---- Helpers ----------------------------------------------------------------------------------
+
+
+# ----- Views ----------------------------------------------------------------------------------->
+@api.route('/servers', methods=('GET',))
+@authenticated_permission.require(401)
+def servers():
+    fields = requested_fields(SERVER_FIELDS)
+    try:
+        page = JenkinsServer.query.keyset_page(
+            cursor=request.args.get('cursor', None), per_page=per_page()
+        )
+    except InvalidCursor:
+        abort(400, 'Invalid pagination cursor')
+    page.items = [server_dict(jenkins_server) for jenkins_server in page]
+    return api_response(page_response(page, fields, 'api.servers'))
+
+
+@api.route('/servers/<int:server_id>', methods=('GET',))
+@authenticated_permission.require(401)
+def server(server_id):
+    fields = requested_fields(SERVER_FIELDS)
+    return api_response(select_fields(server_dict(get_server(server_id)), fields))
+
+
+@api.route('/servers/<int:server_id>/jobs', methods=('GET',))
+@authenticated_permission.require(401)
+def jobs(server_id):
+    fields = requested_fields(JOB_FIELDS)
+    jenkins_server = get_server(server_id)
+    state, fetched_at = upstream(server_jobs, jenkins_server)
+    try:
+        page = sequence_page(
+            state, 'name', cursor=request.args.get('cursor', None), per_page=per_page()
+        )
+    except InvalidCursor:
+        abort(400, 'Invalid pagination cursor')
+    page.items = [job_dict(jenkins_server, job) for job in page]
+    data = page_response(page, fields, 'api.jobs', server_id=server_id)
+    data['fetched_at'] = fetched_at
+    return api_response(data)
+
+
+@api.route('/servers/<int:server_id>/jobs/<job_name>', methods=('GET',))
+@authenticated_permission.require(401)
+def job(server_id, job_name):
+    fields = requested_fields(JOB_FIELDS)
+    jenkins_server = get_server(server_id)
+    state, fetched_at = upstream(server_jobs, jenkins_server)
+    for item in state:
+        if item['name'] == job_name:
+            data = select_fields(job_dict(jenkins_server, item), fields)
+            data['fetched_at'] = fetched_at
+            return api_response(data)
+    abort(404, 'No such job')
+
+
+@api.route('/servers/<int:server_id>/jobs/<job_name>/builds', methods=('GET',))
+@authenticated_permission.require(401)
+def builds(server_id, job_name):
+    fields = requested_fields(BUILD_FIELDS)
+    state, fetched_at = upstream(job_builds, get_server(server_id), job_name)
+    if state is None:
+        abort(404, 'No such job')
+    try:
+        page = sequence_page(
+            state, 'number', cursor=request.args.get('cursor', None), per_page=per_page(),
+            descending=True
+        )
+    except InvalidCursor:
+        abort(400, 'Invalid pagination cursor')
+    data = page_response(page, fields, 'api.builds', server_id=server_id, job_name=job_name)
+    data['fetched_at'] = fetched_at
+    return api_response(data)
+
+
+@api.route('/servers/<int:server_id>/jobs/<job_name>/builds/<int:number>', methods=('GET',))
+@authenticated_permission.require(401)
+def build(server_id, job_name, number):
+    fields = requested_fields(BUILD_FIELDS)
+    state, fetched_at = upstream(job_builds, get_server(server_id), job_name)
+    for item in state or ():
+        if item['number'] == number:
+            data = select_fields(item, fields)
+            data['fetched_at'] = fetched_at
+            return api_response(data)
+    abort(404, 'No such build')
+
+
+@api.route('/events', methods=('GET',))
+@authenticated_permission.require(401)
+def events():
+    '''
+    Stream, as Server-Sent Events, the current state and then the changes of the jobs of each
+    ``server`` id and of each ``job``, as ``<server_id>:<job_name>``.
+    '''
+    servers, jobs = set(), set()
+    for value in request.args.getlist('server'):
+        if not value.isdigit():
+            abort(400, 'Servers are subscribed to by id')
+        servers.add(int(value))
+    for value in request.args.getlist('job'):
+        server_id, _, job_name = value.partition(':')
+        if not server_id.isdigit() or not job_name:
+            abort(400, 'Jobs are subscribed to as <server_id>:<job_name>')
+        jobs.add((int(server_id), job_name))
+    if not servers and not jobs:
+        abort(400, 'Subscribe to a server or a job')
+    if len(servers) + len(jobs) > app.config.get('SSE_MAX_SUBSCRIPTIONS', 100):
+        abort(400, 'Too many subscriptions')
+
+    server_ids = servers.union(server_id for (server_id, _) in jobs)
+    jenkins_servers = JenkinsServer.query.filter(JenkinsServer.id.in_(server_ids)).all()
+    if len(jenkins_servers) != len(server_ids):
+        abort(404, 'No such server')
+    states, initial = {}, []
+    for jenkins_server in jenkins_servers:
+        state, fetched_at = upstream(server_jobs, jenkins_server)
+        states[jenkins_server.id] = state
+        initial.extend(
+            job_event(jenkins_server.id, item, fetched_at) for item in state
+            if jenkins_server.id in servers or (jenkins_server.id, item['name']) in jobs
+        )
+
+    try:
+        subscriber = change_feed.subscribe(app, servers, jobs, states)
+    except TooManyClients:
+        abort(503, 'Too many event streams')
+    response = app.response_class(
+        change_feed.stream(subscriber, ''.join(initial), app.config.get('SSE_HEARTBEAT', 15)),
+        mimetype='text/event-stream'
+    )
+    response.cache_control.no_cache = True
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api.route('/status', methods=('POST',))
+@authenticated_permission.require(401)
+def status():
+    '''
+    The state of the jobs posted as ``{"jobs": [[<server address>, <job name>], ...]}``.
+
+    Each item has its own ``status``, ``ok``, ``stale`` when Jenkins couldn't be reached and
+    the last known state is returned, ``error`` when there's none, ``not_found`` or
+    ``unknown_server``, a failure not failing the whole batch.
+    '''
+    data = request.get_json(silent=True)
+    items = data.get('jobs') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not all(
+            isinstance(item, list) and len(item) == 2 and
+            all(isinstance(part, basestring) for part in item) for item in items):
+        abort(400, 'Post {"jobs": [[<server address>, <job name>], ...]}')
+    if len(items) > app.config.get('API_BATCH_MAX_JOBS', 500):
+        abort(400, 'Too many jobs')
+
+    jenkins_servers = JenkinsServer.query.from_addresses(address for (address, _) in items)
+    states = many_server_jobs(
+        jenkins_servers.values(), concurrency=app.config.get('API_BATCH_CONCURRENCY', 8)
+    )
+    jobs_by_name = {}
+    results = []
+    for address, job_name in items:
+        result = {'server': address, 'job': job_name, 'state': None}
+        results.append(result)
+        jenkins_server = jenkins_servers.get(address)
+        if jenkins_server is None:
+            result['status'] = 'unknown_server'
+            continue
+        state, fetched_at, error = states[jenkins_server.id]
+        if state is None:
+            result.update(status='error', error=error)
+            continue
+        if jenkins_server.id not in jobs_by_name:
+            jobs_by_name[jenkins_server.id] = dict((item['name'], item) for item in state)
+        item = jobs_by_name[jenkins_server.id].get(job_name)
+        if item is None and error is None:
+            result['status'] = 'not_found'
+        elif item is None:
+            result.update(status='error', error=error)
+        elif error is None:
+            result.update(status='ok', state=job_dict(jenkins_server, item), fetched_at=fetched_at)
+        else:
+            result.update(status='stale', state=job_dict(jenkins_server, item),
+                          fetched_at=fetched_at, error=error)
+    return api_response({'items': results})
+# <---- Views ------------------------------------------------------------------------------------
+
+
+# ----- Error Handlers -------------------------------------------------------------------------->
+def api_error(error):
+    description = error.description
+    if not isinstance(description, basestring):
+        # Flask-Principal passes the denied permission along
+        description = type(error).description
+    response = api_response({'error': description}, status=error.code)
+    if error.code == 401:
+        response.headers['WWW-Authenticate'] = 'Bearer realm="jema"'
+    return response
+
+
+for _code in (400, 401, 403, 404, 502, 503):
+    api.errorhandler(_code)(api_error)
+# <---- Error Handlers ---------------------------------------------------------------------------
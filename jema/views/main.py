@@ -11,13 +11,36 @@
     The main application view
 '''
 
+# Import Flask libs
+from flask import abort
+
 # Import JeMa libs
 from jema.application import *
+from jema.conditional import conditional
+from jema.fastpath import HEALTH, METRICS, lightweight_endpoints
 
 
 main = Blueprint('main', __name__)
 
 
 @main.route('/')
+@conditional()
 def index():
     return render_template('index.html')
+
+
+@main.route('/health')
+def health():
+    return 'OK', 200, {'Content-Type': 'text/plain', 'Cache-Control': 'no-cache'}
+
+
+@main.route('/metrics')
+def metrics():
+    registry = app.extensions.get('metrics')
+    if registry is None:
+        abort(404)
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+lightweight_endpoints.register_endpoint('main.health', HEALTH)
+lightweight_endpoints.register_endpoint('main.metrics', METRICS)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+'''
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    jema.wsgi
+    ~~~~~~~~~
+
+    WSGI entry point for prefork servers.
+
+    The application is configured and preloaded when this module is imported, once in the
+    master process, see :mod:`jema.prefork`. The module doubles as a gunicorn configuration
+    providing the ``post_fork`` hook::
+
+        JEMA_CONFIG=/etc/jema gunicorn --preload -c python:jema.wsgi jema.wsgi:application
+
+    ``JEMA_CONFIG`` is the directory holding ``jemaappconfig.py``, when it's not importable.
+    Other servers should call :func:`jema.prefork.reset_after_fork` after forking a worker.
+'''
+
+# Import python libs
+import os
+
+# Import JeMa libs
+from jema.application import create_app
+from jema.prefork import reset_after_fork
+
+application = create_app(os.environ.get('JEMA_CONFIG'), preload=True)
+
+
+def post_fork(server, worker):  # pylint: disable=W0613
+    '''
+    Gunicorn's server hook
+    '''
+    reset_after_fork(application)
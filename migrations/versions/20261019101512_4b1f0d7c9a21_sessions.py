@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+'''
+    Server-side sessions
+
+
+    :copyright: (C) 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    Revision ID: 4b1f0d7c9a21
+    Revises: 230f2e9a95c3
+    Create Date: 2026-10-19 10:15:12.418237
+
+'''
+
+# revision identifiers, used by Alembic.
+revision = '4b1f0d7c9a21'
+down_revision = '230f2e9a95c3'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('sessions',
+        sa.Column('id', sa.String(length=64), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('expires', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sessions_expires', 'sessions', ['expires'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_sessions_expires', 'sessions')
+    op.drop_table('sessions')
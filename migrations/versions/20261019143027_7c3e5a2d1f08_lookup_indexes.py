@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+'''
+    Lookup indexes and association tables primary keys
+
+
+    :copyright: (C) 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    Revision ID: 7c3e5a2d1f08
+    Revises: 4b1f0d7c9a21
+    Create Date: 2026-10-19 14:30:27.551904
+
+'''
+
+# revision identifiers, used by Alembic.
+revision = '7c3e5a2d1f08'
+down_revision = '4b1f0d7c9a21'
+
+from alembic import op
+import sqlalchemy as sa
+
+ASSOCIATION_TABLES = (
+    ('group_accounts', ('group_id', 'account_id'), True),
+    ('group_privileges', ('group_id', 'privilege_id'), True),
+    ('account_privileges', ('account_id', 'privilege_id'), False),
+)
+
+
+def deduplicate(table_name, columns):
+    '''
+    Remove the rows which can't be part of the primary key, those linking nothing and the
+    duplicated ones.
+    '''
+    op.execute('DELETE FROM {0} WHERE {1}'.format(
+        table_name, ' OR '.join('{0} IS NULL'.format(column) for column in columns)
+    ))
+    columns = ', '.join(columns)
+    op.execute('CREATE TABLE {0}_dedup AS SELECT DISTINCT {1} FROM {0}'.format(
+        table_name, columns
+    ))
+    op.execute('DELETE FROM {0}'.format(table_name))
+    op.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {0}_dedup'.format(table_name, columns))
+    op.execute('DROP TABLE {0}_dedup'.format(table_name))
+
+
+def upgrade():
+    op.create_index('ix_accounts_login', 'accounts', ['login'], unique=False)
+    op.create_index('ix_groups_name', 'groups', ['name'], unique=False)
+
+    for table_name, columns, _ in ASSOCIATION_TABLES:
+        deduplicate(table_name, columns)
+        # Batch mode since SQLite can only change a table's primary key by recreating it
+        with op.batch_alter_table(table_name) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.Integer(), nullable=False)
+            batch_op.create_primary_key('pk_{0}'.format(table_name), list(columns))
+
+    # The primary key covers the lookups by group, the identity loading looks up by account
+    op.create_index(
+        'ix_group_accounts_account_id', 'group_accounts', ['account_id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_group_accounts_account_id', 'group_accounts')
+
+    for table_name, columns, nullable in ASSOCIATION_TABLES:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_constraint('pk_{0}'.format(table_name), type_='primary')
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.Integer(), nullable=nullable)
+
+    op.drop_index('ix_groups_name', 'groups')
+    op.drop_index('ix_accounts_login', 'accounts')
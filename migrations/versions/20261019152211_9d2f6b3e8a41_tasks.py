@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''
+    Durable task queue
+
+
+    :copyright: (C) 2014 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+
+
+    Revision ID: 9d2f6b3e8a41
+    Revises: 7c3e5a2d1f08
+    Create Date: 2026-10-19 15:22:11.304716
+
+'''
+
+# revision identifiers, used by Alembic.
+revision = '9d2f6b3e8a41'
+down_revision = '7c3e5a2d1f08'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=128), nullable=False),
+        sa.Column('kwargs', sa.Text(), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False),
+        sa.Column('dedupe_key', sa.String(length=256), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('claim', sa.String(length=32), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('dead_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('dedupe_key')
+    )
+    op.create_index('ix_tasks_run_at', 'tasks', ['run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tasks_run_at', 'tasks')
+    op.drop_table('tasks')